@@ -0,0 +1,51 @@
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import pusta  # noqa: E402
+from pusta.analysis import Analysis  # noqa: E402
+from pusta.runtime import compile_statechart  # noqa: E402
+from generate import generate  # noqa: E402
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return time.perf_counter() - start, result
+
+
+def main(states=100000, regions=2, repeat=3):
+    logging.getLogger().addHandler(logging.NullHandler())
+    text = generate(states=states, depth=3, regions=regions)
+    elapsed, statechart = timed(lambda: pusta.Pusta(engine="fast").transform_stream(text.splitlines(True)))
+    print(f"transform:  {elapsed:8.2f} s")
+    elapsed, compiled = timed(lambda: compile_statechart(statechart))
+    print(f"{len(compiled.names)} vertices, {len(compiled.region_names)} regions, {len(compiled.t_source)} transitions")
+    print(f"compile:    {elapsed * 1e3:8.1f} ms")
+
+    phases = [
+        ("reachable", lambda a: a.unreachable()),
+        ("move graph", lambda a: a._move_graph()),
+        ("components", lambda a: a.components()),
+        ("deadlocks", lambda a: a.deadlocks()),
+        ("traps", lambda a: a.traps()),
+        ("choices", lambda a: a.choices_without_else()),
+        ("fork/join", lambda a: a.unmatched_forks()),
+    ]
+    best = [float("inf")] * len(phases)
+    total = float("inf")
+    for _ in range(repeat):
+        analysis = Analysis(compiled)
+        for i, (_, phase) in enumerate(phases):
+            best[i] = min(best[i], timed(lambda: phase(analysis))[0])
+        total = min(total, timed(lambda: Analysis(compiled).lint())[0])
+    for (name, _), elapsed in zip(phases, best):
+        print(f"{name + ':':<11} {elapsed * 1e3:8.1f} ms")
+    print(f"lint:       {total * 1e3:8.1f} ms ({len(Analysis(compiled).lint())} issues)")
+
+
+if __name__ == "__main__":
+    main(*(int(a) for a in sys.argv[1:]))
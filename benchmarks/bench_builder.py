@@ -0,0 +1,69 @@
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import pusta  # noqa: E402
+from pusta.builder import StatechartBuilder  # noqa: E402
+from generate import generate  # noqa: E402
+
+
+def count(expressions):
+    n = 0
+    for e in expressions:
+        n += 1
+        t = getattr(e, "type", None)
+        if t is not None and hasattr(t, "expressions"):
+            n += count(t.expressions)
+        elif t is not None and hasattr(t, "regions"):
+            n += sum(count(r.expressions) for r in t.regions)
+    return n
+
+
+class DispatchOnly(StatechartBuilder):
+    """
+    Builder that only dispatches, to measure the overhead of consume_expression.
+    """
+
+    def consume_TransitionExpression(self, transition):
+        pass
+
+    def consume_StateDeclarationExpression(self, expression):
+        pass
+
+    def consume_StateDescriptionExpression(self, expression):
+        pass
+
+    def consume_StateAliasExpression(self, expression):
+        pass
+
+
+def best(builder_class, diagram, repeat):
+    times = []
+    for _ in range(repeat):
+        builder = builder_class()
+        start = time.perf_counter()
+        builder.consume_diagram(diagram)
+        times.append(time.perf_counter() - start)
+    return min(times), builder
+
+
+def main(states=2000, density=50.0, repeat=5):
+    logging.getLogger().addHandler(logging.NullHandler())
+    text = generate(states=states, depth=3, density=density, notes=0.1, aliases=0.1)
+    diagram = pusta.Pusta(engine="fast").parse(text)
+    expressions = count(diagram._model.expressions)
+
+    elapsed, builder = best(StatechartBuilder, diagram, repeat)
+    transitions = len(builder.statechart.get_contents_of_type(pusta.statechart.Transition, ordered=False))
+    print(f"{states} states, {transitions} transitions, {expressions} expressions")
+    print(f"transform: {elapsed * 1e3:8.1f} ms ({elapsed / expressions * 1e6:.2f} us/expression)")
+    top_level = len(diagram._model.expressions)
+    elapsed, _ = best(DispatchOnly, diagram, repeat)
+    print(f"dispatch:  {elapsed * 1e3:8.1f} ms ({elapsed / top_level * 1e6:.2f} us/expression)")
+
+
+if __name__ == "__main__":
+    main(*(f(a) for f, a in zip((int, float, int), sys.argv[1:])))
@@ -0,0 +1,97 @@
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import pusta  # noqa: E402
+from pusta.codegen.c import CGenerator  # noqa: E402
+
+DIAGRAM = os.path.join(os.path.dirname(__file__), "..", "tests", "diagrams", "concurrent_state_horizontal.pu")
+
+DRIVER = """#define _POSIX_C_SOURCE 199309L
+#include <stdio.h>
+#include <stdlib.h>
+#include <time.h>
+#include "chart.h"
+
+static double now(void)
+{
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return ts.tv_sec + ts.tv_nsec * 1e-9;
+}
+
+int main(int argc, char **argv)
+{
+    size_t count = strtoul(argv[1], NULL, 10);
+    chart_event_t *events = malloc(count * sizeof(*events));
+    unsigned seed = 1;
+    for (size_t i = 0; i < count; i++) {
+        seed = seed * 1103515245u + 12345u;
+        events[i] = (chart_event_t)((seed >> 16) % CHART_EVENT_COUNT);
+    }
+    chart_t m;
+    chart_init(&m, NULL, NULL, NULL);
+    double start = now();
+    for (size_t i = 0; i < count; i++)
+        chart_dispatch(&m, events[i]);
+    double dispatch = now() - start;
+    start = now();
+    chart_run(&m, events, count);
+    double run = now() - start;
+    printf("%f %f %d\\n", dispatch, run, m.error);
+    free(events);
+    return 0;
+}
+"""
+
+
+def chain(states, events):
+    """
+    Synthetic chart: a ring of states where every event moves to a pseudo-random successor.
+    """
+    rng = random.Random(0)
+    lines = ["@startuml", "[*] --> S0"]
+    for s in range(states):
+        for e in range(events):
+            lines.append(f"S{s} --> S{rng.randrange(states)} : Ev{e}")
+    lines.append("@enduml")
+    return pusta.Pusta(engine="fast").parse("\n".join(lines)).transform()
+
+
+def measure(name, statechart, count, cc, flags):
+    with tempfile.TemporaryDirectory() as directory:
+        CGenerator(statechart, "chart").write(directory)
+        obj = os.path.join(directory, "chart.o")
+        subprocess.run([cc, "-std=c99", *flags, "-c", "-o", obj, os.path.join(directory, "chart.c")], check=True)
+        size = subprocess.run(["size", obj], check=True, capture_output=True, text=True).stdout.splitlines()[1]
+        text, data = size.split()[:2]
+        driver = os.path.join(directory, "main.c")
+        with open(driver, "w") as f:
+            f.write(DRIVER)
+        binary = os.path.join(directory, "bench")
+        subprocess.run([cc, "-std=c99", *flags, "-I", directory, "-o", binary, driver, obj], check=True)
+        out = subprocess.run([binary, str(count)], check=True, capture_output=True, text=True).stdout.split()
+        dispatch, run = float(out[0]), float(out[1])
+        print(f"{name:<24} {' '.join(flags):<4} text={text:>6} data={data:>4} "
+              f"dispatch={dispatch / count * 1e9:6.2f}ns/event run={run / count * 1e9:6.2f}ns/event")
+
+
+def main(count=10_000_000):
+    cc = shutil.which("cc")
+    if cc is None or shutil.which("size") is None:
+        sys.exit("a C compiler (cc) and size are required")
+    charts = [("concurrent_state", pusta.Pusta().parse_file(DIAGRAM).transform()),
+              ("chain 100 x 8", chain(100, 8)),
+              ("chain 1000 x 32", chain(1000, 32))]
+    for name, statechart in charts:
+        for flags in (["-O2"], ["-Os"]):
+            measure(name, statechart, count, cc, flags)
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
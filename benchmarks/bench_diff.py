@@ -0,0 +1,46 @@
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import pusta  # noqa: E402
+from pusta.delta import fingerprint  # noqa: E402
+from pusta.statechart import State, Transition  # noqa: E402
+from generate import generate  # noqa: E402
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return time.perf_counter() - start, result
+
+
+def main(states=50000, changes=10):
+    logging.getLogger().addHandler(logging.NullHandler())
+    text = generate(states=states, depth=3, regions=2)
+    parser = pusta.Pusta(engine="fast")
+    elapsed, a = timed(lambda: parser.transform_stream(text.splitlines(True)))
+    b = parser.transform_stream(text.splitlines(True))
+    print(f"{len(a.get_contents())} nodes, transform: {elapsed:.2f} s")
+    elapsed, _ = timed(lambda: (fingerprint(a), fingerprint(b)))
+    print(f"fingerprint: {elapsed * 1e3:8.1f} ms (both charts)")
+    elapsed, delta = timed(lambda: pusta.diff(a, b))
+    print(f"equal:       {elapsed * 1e3:8.1f} ms ({len(delta.added)} added)")
+
+    # Relabel and add transitions spread over the chart
+    states_b = b.get_contents_of_type(State)
+    for i in range(changes):
+        state = states_b[i * len(states_b) // changes]
+        for t in state.get_transitions()[:1]:
+            t.label = f"changed {i}"
+        t = Transition(f"added {i}")
+        t.destination = states_b[-1 - i]
+        t.source = state
+    elapsed, delta = timed(lambda: pusta.diff(a, b))
+    print(f"changed:     {elapsed * 1e3:8.1f} ms ({len(delta.added)} added, {len(delta.relabelled)} relabelled)")
+
+
+if __name__ == "__main__":
+    main(*(int(a) for a in sys.argv[1:]))
@@ -0,0 +1,116 @@
+import os
+import random
+import re
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import pusta  # noqa: E402
+from pusta.incremental import IncrementalDiagram  # noqa: E402
+
+
+def diagram(lines):
+    """
+    Synthetic diagram of roughly the given number of lines: composite states with a chain of substates,
+    interleaved with transitions between top level states.
+    """
+    rng = random.Random(0)
+    out = ["@startuml", "[*] --> S0"]
+    n = 0
+    while len(out) < lines:
+        out.append(f"state C{n} {{")
+        out.append(f"  [*] --> C{n}A0")
+        for i in range(40):
+            out.append(f"  C{n}A{i} --> C{n}A{i + 1} : Ev{i % 7}")
+        out.append("}")
+        for i in range(20):
+            out.append(f"S{n * 20 + i} --> S{rng.randrange((n + 1) * 20)} : Go{i % 5}")
+        out.append(f"S{n * 20} --> C{n}")
+        n += 1
+    out.append("@enduml")
+    return "\n".join(out) + "\n"
+
+
+def best(function, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def random_edits(inc, count):
+    """
+    Deletes and re-inserts count random transition lines, returns the times of the edits applied locally and of
+    those that fell back to a rebuild.
+    """
+    rng = random.Random(1)
+    text = inc.text
+    lines = [m.start() for m in re.finditer(r"^.*-->.*\n", text, re.M)]
+    local, rebuilt = [], []
+    for pos in rng.sample(lines, count):
+        line = text[pos:text.index("\n", pos) + 1]
+        for edit in (((pos, pos + len(line)), ""), ((pos, pos), line)):
+            start = time.perf_counter()
+            result = inc.apply_edit(*edit)
+            (rebuilt if result.rebuilt else local).append(time.perf_counter() - start)
+    return local, rebuilt
+
+
+def main(lines=10000, repeat=20, count=40):
+    text = diagram(lines)
+    parser = pusta.Pusta(engine="fast")
+    full = best(lambda: parser.parse(text).transform(), 3)
+
+    start = time.perf_counter()
+    inc = IncrementalDiagram(text, parser)
+    initial = time.perf_counter() - start
+
+    middle = text.index("\nS", len(text) // 2) + 1
+    line = "S0 --> S1 : Edited\n"
+
+    def insert_delete():
+        inc.apply_edit((middle, middle), line)
+        inc.apply_edit((middle, middle + len(line)), "")
+
+    label = text.index(" : Go", middle) + len(" : ")
+
+    def relabel():
+        inc.apply_edit((label, label + 2), "Xy")
+        inc.apply_edit((label, label + 2), "Go")
+
+    inner = text.index("  C", middle)
+
+    def composite():
+        inc.apply_edit((inner, inner), "  C0X --> C0Y\n")
+        inc.apply_edit((inner, inner + len("  C0X --> C0Y\n")), "")
+
+    redeclare = "state S1 <<choice>>\n"
+
+    def fallback():
+        # Redeclaring a state of another block is not local
+        assert inc.apply_edit((middle, middle), redeclare).rebuilt
+        assert inc.apply_edit((middle, middle + len(redeclare)), "").rebuilt
+
+    print(f"{text.count(chr(10))} lines")
+    print(f"full parse + transform: {full * 1e3:8.2f} ms")
+    print(f"incremental initial:    {initial * 1e3:8.2f} ms")
+    for name, edit, times in (("insert + delete line", insert_delete, repeat), ("edit label", relabel, repeat),
+                              ("edit inside composite", composite, repeat), ("fallback to rebuild", fallback, 3)):
+        elapsed = best(edit, times) / 2
+        print(f"{name + ':':<23} {elapsed * 1e3:8.2f} ms/edit")
+    local, rebuilt = random_edits(inc, count)
+    edits = len(local) + len(rebuilt)
+    print(f"random line edits:      {len(rebuilt)}/{edits} rebuilt ({len(rebuilt) / edits:.0%})")
+    for name, times in (("local", local), ("rebuilt", rebuilt)):
+        if times:
+            print(f"  {name + ':':<21} {statistics.median(times) * 1e3:8.2f} ms/edit median, "
+                  f"{max(times) * 1e3:.2f} ms max")
+    assert str(inc.statechart) == str(parser.parse(inc.text).transform())
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
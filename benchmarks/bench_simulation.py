@@ -0,0 +1,42 @@
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import pusta  # noqa: E402
+from pusta.runtime import Machine, compile_statechart  # noqa: E402
+from pusta.simulation import Simulation  # noqa: E402
+
+DIAGRAM = os.path.join(os.path.dirname(__file__), "..", "tests", "diagrams", "concurrent_state_horizontal.pu")
+
+
+def main(instances=10000, steps=100):
+    statechart = pusta.Pusta().parse_file(DIAGRAM).transform()
+    compiled = compile_statechart(statechart)
+    rng = np.random.default_rng(0)
+    events = rng.integers(0, len(compiled.event_names), size=(steps, instances))
+
+    start = time.perf_counter()
+    simulation = Simulation(compiled, instances)
+    simulation.run(events)
+    vectorized = time.perf_counter() - start
+
+    start = time.perf_counter()
+    machines = [Machine(compiled).start() for _ in range(instances)]
+    names = compiled.event_names
+    for row in events.tolist():
+        for m, e in zip(machines, row):
+            m.dispatch(names[e])
+    interpreted = time.perf_counter() - start
+
+    total = instances * steps
+    print(f"{instances} instances x {steps} steps")
+    print(f"interpreter: {interpreted:.3f}s ({total / interpreted:,.0f} events/s)")
+    print(f"simulation:  {vectorized:.3f}s ({total / vectorized:,.0f} events/s)")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
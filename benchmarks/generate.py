@@ -0,0 +1,118 @@
+import argparse
+import random
+import sys
+
+
+class _Node:
+    __slots__ = ('name', 'children', 'regions', 'alias')
+
+    def __init__(self, name):
+        self.name = name
+        # Substates of a composite state
+        self.children = None
+        # Substates of every region of a parallel state
+        self.regions = None
+        self.alias = False
+
+
+def generate(states: int = 100, depth: int = 2, regions: int = 0, density: float = 1.5, notes: float = 0.0,
+             aliases: float = 0.0, seed: int = 0) -> str:
+    """
+    Returns a synthetic PlantUML state diagram, the same parameters always give the same text.
+
+    states is the number of regular states named S0, S1, ...; up to depth levels of them are composite states, and
+    if regions is at least 2 some composite states are parallel states with that many regions. Every state has on
+    average density outgoing transitions to states of the same region, each with an event, some with a guard or
+    an action. notes and aliases are the fractions of states with a note and of leaf states declared with an
+    alias. Every container gets an initial transition, some states a description or a final transition.
+    """
+    rng = random.Random(seed)
+    names = iter(range(states))
+
+    def build(level, budget):
+        nodes = []
+        while budget > 0:
+            budget -= 1
+            node = _Node(f"S{next(names)}")
+            if level < depth and budget >= 2 and rng.random() < 0.3:
+                size = min(budget, rng.randint(2, 8))
+                budget -= size
+                if regions >= 2 and size >= regions and rng.random() < 0.3:
+                    cuts = sorted(rng.sample(range(1, size), regions - 1))
+                    node.regions = [build(level + 1, b - a) for a, b in zip([0] + cuts, cuts + [size])]
+                else:
+                    node.children = build(level + 1, size)
+            elif rng.random() < aliases:
+                node.alias = True
+            nodes.append(node)
+        return nodes
+
+    lines = ["@startuml"]
+    if notes:
+        lines.append("scale 800 width")
+
+    def emit(nodes, indent):
+        pad = "  " * indent
+        for node in nodes:
+            if node.alias:
+                lines.append(f'{pad}state "Long name of {node.name}" as {node.name}')
+        lines.append(f"{pad}[*] --> {nodes[0].name}")
+        for node in nodes:
+            if node.children:
+                lines.append(f"{pad}state {node.name} {{")
+                emit(node.children, indent + 1)
+                lines.append(f"{pad}}}")
+            elif node.regions:
+                lines.append(f"{pad}state {node.name} {{")
+                for i, region in enumerate(node.regions):
+                    if i:
+                        lines.append(f"{pad}  --")
+                    emit(region, indent + 1)
+                lines.append(f"{pad}}}")
+        for node in nodes:
+            count = int(density) + (rng.random() < density % 1)
+            for _ in range(count):
+                target = rng.choice(nodes).name
+                label = f"Ev{rng.randrange(16)}"
+                if rng.random() < 0.2:
+                    label += f" [x > {rng.randrange(10)}]"
+                if rng.random() < 0.2:
+                    label += f" / count{rng.randrange(4)}()"
+                lines.append(f"{pad}{node.name} --> {target} : {label}")
+            if rng.random() < 0.1:
+                lines.append(f"{pad}{node.name} : does {node.name.lower()}")
+            if rng.random() < notes:
+                kind = rng.random()
+                if kind < 0.5:
+                    lines.append(f"{pad}note right of {node.name} : short note\\non {node.name}")
+                elif kind < 0.8:
+                    lines.append(f"{pad}note left of {node.name}")
+                    lines.append(f"{pad}  long note on {node.name}")
+                    lines.append(f"{pad}  over several lines")
+                    lines.append(f"{pad}end note")
+                else:
+                    lines.append(f'{pad}note "floating note {node.name}" as N{node.name}')
+        if rng.random() < 0.5:
+            lines.append(f"{pad}{nodes[-1].name} --> [*]")
+
+    if states > 0:
+        emit(build(0, states), 0)
+    lines.append("@enduml")
+    return "\n".join(lines) + "\n"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Writes a synthetic PlantUML state diagram to stdout")
+    parser.add_argument("--states", type=int, default=100)
+    parser.add_argument("--depth", type=int, default=2)
+    parser.add_argument("--regions", type=int, default=0)
+    parser.add_argument("--density", type=float, default=1.5)
+    parser.add_argument("--notes", type=float, default=0.0)
+    parser.add_argument("--aliases", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    sys.stdout.write(generate(**vars(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import textx  # noqa: E402
+
+import pusta  # noqa: E402
+from pusta.statechart import Region, State, Transition  # noqa: E402
+from generate import generate  # noqa: E402
+
+RESULTS = os.path.join(os.path.dirname(__file__), "results")
+
+# name -> generator parameters, the state count is added per size
+CASES = {
+    "flat": dict(depth=0),
+    "nested": dict(depth=3),
+    "parallel": dict(depth=2, regions=3),
+    "annotated": dict(depth=2, notes=0.3, aliases=0.3),
+}
+
+
+def measure(function, repeat, min_time=0.05):
+    """
+    Returns the seconds per call of every repetition, each repetition calls function often enough to run for
+    at least min_time.
+    """
+    timer = timeit.Timer(function)
+    number = 1
+    while timer.timeit(number) < min_time and number < 1 << 20:
+        number *= 2
+    return [t / number for t in timer.repeat(repeat, number)]
+
+
+def record(results, name, case, params, times, **extra):
+    results.append(dict(name=name, case=case, params=params, min=min(times), median=statistics.median(times),
+                        mean=statistics.mean(times), repeat=len(times), **extra))
+    print(f"{name:<36} {case:<24} {statistics.median(times) * 1e3:12.3f} ms")
+
+
+def bench_grammar(results, repeat):
+    path = pusta.Pusta._grammar_path
+    times = measure(lambda: textx.metamodel_from_file(path, use_regexp_group=True), repeat)
+    record(results, "grammar_load", "-", {}, times)
+    pusta.Pusta()
+    record(results, "grammar_load_cached", "-", {}, measure(pusta.Pusta, repeat))
+
+
+def bench_case(results, case, params, engines, repeat):
+    text = generate(**params)
+    extra = dict(lines=text.count("\n"))
+    label = f"{case}-{params['states']}"
+    for engine in engines:
+        parser = pusta.Pusta(engine=engine)
+        record(results, f"parse[{engine}]", label, params, measure(lambda: parser.parse(text), repeat), **extra)
+    diagram = pusta.Pusta(engine="fast").parse(text)
+    record(results, "transform", label, params, measure(lambda: pusta.builder.StatechartBuilder().consume_diagram(
+        diagram), repeat), **extra)
+    statechart = diagram.transform()
+    record(results, "str", label, params, measure(lambda: str(statechart), repeat), **extra)
+    for cls in (State, Transition, Region):
+        record(results, f"get_contents_of_type[{cls.__name__}]", label, params,
+               measure(lambda: statechart.get_contents_of_type(cls), repeat), **extra)
+    data = pusta.serialize.dumps(statechart)
+    record(results, "serialize", label, params, measure(lambda: pusta.serialize.dumps(statechart), repeat),
+           bytes=len(data), **extra)
+    record(results, "deserialize", label, params, measure(lambda: pusta.serialize.loads(data), repeat), **extra)
+    composite = max(statechart.get_states(), key=lambda s: len(s.get_contents()))
+    record(results, "subtree_get_contents_of_type[State]", label, params,
+           measure(lambda: composite.get_contents_of_type(State), repeat), **extra)
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(__file__) or ".",
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    """
+    Prints the median of every result relative to the baseline and returns the number of regressions, results
+    more than threshold (a fraction) slower than the baseline.
+    """
+    old = {(r["name"], r["case"]): r for r in baseline["results"]}
+    regressions = 0
+    print(f"\ncompared to {baseline['meta'].get('revision')} ({baseline['meta'].get('date')})")
+    for r in results:
+        b = old.get((r["name"], r["case"]))
+        if b is None:
+            continue
+        ratio = r["median"] / b["median"]
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        print(f"{r['name']:<36} {r['case']:<24} {ratio:8.2f}x{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Runs the pusta benchmarks and stores the results as JSON")
+    parser.add_argument("--sizes", default="100,1000", help="comma separated state counts")
+    parser.add_argument("--cases", default=",".join(CASES), help="comma separated subset of " + ", ".join(CASES))
+    parser.add_argument("--engines", default="textx,fast")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help=f"result file, defaults to a new file in {RESULTS}")
+    parser.add_argument("--compare", metavar="BASELINE", help="result file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="relative slowdown reported as regression (default 0.1)")
+    args = parser.parse_args(argv)
+
+    # The builder logs an error for every note, keep the records but not the output
+    logging.getLogger().addHandler(logging.NullHandler())
+
+    results = []
+    bench_grammar(results, args.repeat)
+    for size in map(int, args.sizes.split(",")):
+        for case in args.cases.split(","):
+            params = dict(CASES[case], states=size, seed=args.seed)
+            bench_case(results, case, params, args.engines.split(","), args.repeat)
+
+    revision = git_revision()
+    now = datetime.datetime.now(datetime.timezone.utc)
+    meta = dict(date=now.isoformat(timespec="seconds"), revision=revision, pusta=pusta.__version__,
+                python=platform.python_version(), implementation=platform.python_implementation(),
+                machine=platform.machine(), system=platform.system())
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS, exist_ok=True)
+        output = os.path.join(RESULTS, f"{now:%Y%m%d-%H%M%S}-{revision or 'unknown'}.json")
+    with open(output, "w") as f:
+        json.dump(dict(meta=meta, results=results), f, indent=1)
+    print(f"\nresults written to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,39 +1,318 @@
 import textx
 import textx.export
 import os
+import hashlib
 import logging
+import threading
+import concurrent.futures
 import pusta.builder
+import pusta.fastparse
+import pusta.cache
+import pusta.aio
+import pusta.delta
+import pusta.instrument
+import pusta.preprocess
+import pusta.serialize
+import pusta.stream
+
+__version__ = "0.1.0"
 
 _logger = logging.getLogger(__name__)
 
+diff = pusta.delta.diff
+
+
+class MetamodelCache:
+    """
+    Compiled grammars by path and content digest, shared by the Pusta instances of a process.
+
+    The cache lives in memory only: textX metamodels can not be pickled, so there is no disk persistence and
+    every new process compiles the grammar again on first use. See pusta.cache.ParseCache for caching parse
+    results across processes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metamodels = dict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def digest(path):
+        with open(path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+
+    def get(self, path):
+        key = (os.path.abspath(path), self.digest(path))
+        with self._lock:
+            metamodel = self._metamodels.get(key)
+            if metamodel is not None:
+                self.hits += 1
+                return metamodel
+            self.misses += 1
+            _logger.debug(f"Compiling grammar {path}")
+            with pusta.instrument.phase("grammar", path=path):
+                metamodel = textx.metamodel_from_file(path, use_regexp_group=True)
+            self._metamodels[key] = metamodel
+            return metamodel
+
+    def clear(self):
+        with self._lock:
+            self._metamodels.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+metamodel_cache = MetamodelCache()
+
 
 class Diagram:
-    def __init__(self, model):
-        self._model = model
+    def __init__(self, model=None, statechart=None, loader=None, cache=None, cache_key=None):
+        self._loaded_model = model
+        self._statechart = statechart
+        self._loader = loader
+        self._cache = cache
+        self._cache_key = cache_key
+
+    @property
+    def _model(self):
+        if self._loaded_model is None and self._loader:
+            self._loaded_model = self._loader()
+        return self._loaded_model
 
     def export(self, path):
         textx.export.model_export(self._model, path)
 
     def transform(self):
+        """
+        Returns the statechart of the diagram, it is built on the first call and the same object afterwards.
+        """
+        if self._statechart is not None:
+            return self._statechart
         builder = pusta.builder.StatechartBuilder()
-        builder.consume_diagram(self)
-        return builder.statechart
+        with pusta.instrument.phase("transform"):
+            builder.consume_diagram(self)
+        self._statechart = builder.statechart
+        if self._cache is not None:
+            with pusta.instrument.phase("cache_put"):
+                self._cache.put(self._cache_key, self._statechart)
+        return self._statechart
+
+
+class ParseResult:
+    def __init__(self, path, statechart=None, error=None):
+        self.path = path
+        self.statechart = statechart
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        return f"ParseResult({self.path!r}, ok={self.ok})"
+
+    def __reduce__(self):
+        # Ship the statechart in the compact format (see pusta.serialize) from parse_files workers
+        data = None if self.statechart is None else pusta.serialize.dumps(self.statechart)
+        return _load_parse_result, (self.path, data, self.error)
+
+
+def _load_parse_result(path, data, error):
+    return ParseResult(path, None if data is None else pusta.serialize.loads(data), error)
+
+
+_worker_parser = None
+
+
+def _init_worker(*args):
+    global _worker_parser
+    _worker_parser = Pusta(*args)
+
+
+def _parse_and_transform(path, parser=None):
+    parser = parser or _worker_parser or Pusta()
+    try:
+        statechart = parser.transform_file(path)
+    except Exception as e:
+        return ParseResult(path, error=f"{e.__class__.__name__}: {e}")
+    return ParseResult(path, statechart)
 
 
 class Pusta:
     _grammar_path = os.path.join(os.path.dirname(__file__), 'state.tx')
 
-    def __init__(self):
-        self._parser = textx.metamodel_from_file(self._grammar_path, use_regexp_group=True)
+    _engines = ("textx", "fast")
+
+    def __init__(self, engine="textx", cache_dir=None, cache_size=pusta.cache.DEFAULT_CACHE_SIZE):
+        if engine not in self._engines:
+            raise ValueError(f"Unknown engine {engine}, expected one of {self._engines}")
+        self._engine = engine
+        self._parser = metamodel_cache.get(self._grammar_path)
+        self._cache_dir = cache_dir
+        self._cache_size = cache_size
+        self._cache = None
+        self._async = None
+        self._preprocessor = pusta.preprocess.Preprocessor()
+        if cache_dir:
+            self._cache = pusta.cache.ParseCache(cache_dir, cache_size)
+            self._cache_salt = f"{__version__}:{metamodel_cache.digest(self._grammar_path)}".encode()
+
+    @property
+    def engine(self):
+        return self._engine
+
+    @property
+    def cache(self):
+        return self._cache
+
+    @property
+    def preprocessor(self) -> 'pusta.preprocess.Preprocessor':
+        """
+        Resolves !include and !define directives, the included files are read once for everything parsed with
+        this Pusta.
+        """
+        return self._preprocessor
+
+    def _init_args(self):
+        return self._engine, self._cache_dir, self._cache_size
+
+    def _model_from_str(self, s, path=None):
+        with pusta.instrument.phase("parse", engine=self._engine):
+            return self._parse_model(s, path)
+
+    def _parse_model(self, s, path):
+        if self._engine == "fast":
+            try:
+                return pusta.fastparse.FastParser().parse(s)
+            except pusta.fastparse.FastParseError as e:
+                _logger.debug(f"Fast parser failed ({e}), falling back to textX")
+        # Always from the text that was read (and hashed for the cache), the file may have changed since
+        return self._parser.model_from_str(s, file_name=path)
+
+    def _cached_diagram(self, s, path=None):
+        key = self._cache.key(self._cache_salt, s.encode('utf-8'))
+        with pusta.instrument.phase("cache_get"):
+            statechart = self._cache.get(key)
+        if statechart is not None:
+            return Diagram(statechart=statechart, loader=lambda: self._model_from_str(s, path))
+        return Diagram(self._model_from_str(s, path), cache=self._cache, cache_key=key)
+
+    def _parse_text(self, s, path=None):
+        if pusta.preprocess.has_directives(s):
+            with pusta.instrument.phase("preprocess", path=path):
+                s = self._preprocessor.process_text(s, path)
+            # The model is parsed from the preprocessed text, not from the file
+            path = None
+        elif path is not None:
+            self._preprocessor.forget(path)
+        if self._cache:
+            return self._cached_diagram(s, path)
+        return Diagram(self._model_from_str(s, path))
 
     def parse(self, s):
-        return Diagram(self._parser.model_from_str(s))
+        return self._parse_text(s)
 
     def parse_file(self, p):
         _logger.info(f"Parsing file {p}")
-        return Diagram(self._parser.model_from_file(p))
+        with pusta.instrument.phase("read", path=p):
+            with pusta.stream.map_file(p) as data:
+                s = str(data, 'utf-8')
+        if self._engine == "textx" and not self._cache and not pusta.preprocess.has_directives(s):
+            self._preprocessor.forget(p)
+            with pusta.instrument.phase("parse", engine=self._engine, path=p):
+                return Diagram(self._parser.model_from_str(s, file_name=p))
+        return self._parse_text(s, p)
 
     def transform(self, diagram):
-        builder = pusta.builder.StatechartBuilder()
-        builder.consume_diagram(diagram)
-        return builder.statechart
+        return diagram.transform()
+
+    def configure_async(self, executor="thread", max_workers=None, max_concurrency=None,
+                        timeout=None) -> 'pusta.aio.AsyncParser':
+        """
+        Sets up the executor used by aparse and aparse_file, see pusta.aio.AsyncParser. Without a call, they use a
+        thread pool.
+        """
+        if self._async is not None:
+            self._async.close(wait=False)
+        self._async = pusta.aio.AsyncParser(self, executor, max_workers, max_concurrency, timeout)
+        return self._async
+
+    def _async_parser(self) -> 'pusta.aio.AsyncParser':
+        if self._async is None:
+            self._async = pusta.aio.AsyncParser(self)
+        return self._async
+
+    async def aparse(self, s, timeout=pusta.aio._default) -> Diagram:
+        """
+        Parses and transforms s in the executor set up by configure_async, returns the transformed Diagram.
+        """
+        return await self._async_parser().parse(s, timeout)
+
+    async def aparse_file(self, p, timeout=pusta.aio._default) -> Diagram:
+        return await self._async_parser().parse_file(p, timeout)
+
+    def transform_file(self, p) -> 'pusta.statechart.Statechart':
+        """
+        Returns the statechart of the diagram file at path p like parse_file(p).transform(), but the file is memory
+        mapped and parsed and transformed block by block (see pusta.stream), so neither the text nor the model of
+        the whole diagram are held in memory. With a parse cache the mapped file is hashed for the lookup.
+        """
+        _logger.info(f"Transforming file {p}")
+        with pusta.stream.map_file(p) as data:
+            if not pusta.preprocess.has_directives(data):
+                self._preprocessor.forget(p)
+                return self._transform_buffer(data, p)
+            # Includes and macros are resolved on the whole text
+            s = str(data, 'utf-8')
+        return self._parse_text(s, p).transform()
+
+    def _transform_buffer(self, data, p):
+        if not self._cache:
+            with pusta.instrument.phase("transform", path=p):
+                return pusta.stream.transform_stream(pusta.stream.iter_buffer(data), self, path=p)
+        key = self._cache.key(self._cache_salt, data)
+        with pusta.instrument.phase("cache_get"):
+            statechart = self._cache.get(key)
+        if statechart is not None:
+            return statechart
+        with pusta.instrument.phase("transform", path=p):
+            statechart = pusta.stream.transform_stream(pusta.stream.iter_buffer(data), self, path=p)
+        with pusta.instrument.phase("cache_put"):
+            self._cache.put(key, statechart)
+        return statechart
+
+    def transform_stream(self, source) -> 'pusta.statechart.Statechart':
+        """
+        Parses and transforms a diagram read from a file-like object (text or binary, e.g. sys.stdin) or an
+        iterable of lines block by block, the parsed expressions are released as soon as they are transformed.
+        """
+        return pusta.stream.transform_stream(source, self)
+
+    def profile(self, callback=None, events=True) -> 'pusta.instrument.Profiler':
+        """
+        Returns a Profiler to use as context manager, it collects time and allocations per phase of everything
+        parsed, transformed and rendered inside the with block::
+
+            with parser.profile() as profiler:
+                str(parser.parse_file(path).transform())
+            profiler.report()
+            profiler.write_chrome_trace("trace.json")
+        """
+        return pusta.instrument.Profiler(callback, events)
+
+    def parse_files(self, paths, workers=None, ordered=True):
+        paths = list(paths)
+        if workers == 1:
+            for p in paths:
+                yield _parse_and_transform(p, self)
+            return
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                                    initargs=self._init_args()) as executor:
+            if ordered:
+                yield from executor.map(_parse_and_transform, paths, chunksize=max(1, len(paths) // 64))
+            else:
+                futures = [executor.submit(_parse_and_transform, p) for p in paths]
+                for future in concurrent.futures.as_completed(futures):
+                    yield future.result()
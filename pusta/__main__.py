@@ -0,0 +1,5 @@
+import sys
+
+from pusta.cli import main
+
+sys.exit(main())
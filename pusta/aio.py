@@ -0,0 +1,172 @@
+import asyncio
+import concurrent.futures
+import logging
+import weakref
+from typing import Dict, Union
+
+import pusta
+
+_logger = logging.getLogger(__name__)
+
+# Marks the timeout argument as not given, None means no timeout
+_default = object()
+
+
+def _transform_in_worker(text, path):
+    # Runs in a process pool initialized with pusta._init_worker, ships the statechart in the compact format
+    statechart = pusta._worker_parser._parse_text(text, path).transform()
+    return pusta.serialize.dumps(statechart)
+
+
+def _read(path):
+    with pusta.stream.map_file(path) as data:
+        return str(data, 'utf-8')
+
+
+class _Job:
+    __slots__ = ('task', 'waiters')
+
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class _LoopState:
+    """
+    Concurrency bound and in-flight requests of an AsyncParser in one event loop.
+    """
+    __slots__ = ('semaphore', 'in_flight')
+
+    def __init__(self, max_concurrency):
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.in_flight: Dict[tuple, _Job] = dict()
+
+
+class AsyncParser:
+    """
+    Parses and transforms diagrams of a Pusta in an executor, without blocking the event loop.
+
+    executor is "thread", "process" or a concurrent.futures.Executor, which is not shut down by close(). At most
+    max_concurrency diagrams (default: max_workers, or the executor's worker count) are handed to the executor
+    at once, further requests wait without occupying it. Requests for the same input (the same text, or the same
+    file with the same content) while one is in flight share its result. A request is cancelled or timed out
+    individually, the work itself is cancelled once no request waits for it anymore; work already running in
+    the executor can not be interrupted, its result is dropped. Files are read in the executor as well. The
+    parser can be used from several event loops, the bound and the sharing apply per loop.
+
+    With a process executor the workers transform the diagram and send the statechart back (see
+    pusta.serialize), the model is parsed again in this process if the Diagram needs it.
+    """
+
+    def __init__(self, parser: 'pusta.Pusta', executor: Union[str, concurrent.futures.Executor] = "thread",
+                 max_workers: int = None, max_concurrency: int = None, timeout: float = None):
+        self._parser = parser
+        self._owned = isinstance(executor, str)
+        if executor == "thread":
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers, thread_name_prefix="pusta")
+        elif executor == "process":
+            executor = concurrent.futures.ProcessPoolExecutor(max_workers, initializer=pusta._init_worker,
+                                                              initargs=parser._init_args())
+        elif isinstance(executor, str):
+            raise ValueError(f"Unknown executor {executor}, expected 'thread', 'process' or an Executor")
+        self._executor = executor
+        self._process = isinstance(executor, concurrent.futures.ProcessPoolExecutor)
+        self._max_concurrency = max_concurrency or max_workers or getattr(executor, '_max_workers', None) or 1
+        self._timeout = timeout
+        # Event loop -> _LoopState
+        self._loops = weakref.WeakKeyDictionary()
+
+    @property
+    def executor(self) -> concurrent.futures.Executor:
+        return self._executor
+
+    def close(self, wait: bool = True):
+        """
+        Shuts the executor down if this parser created it.
+        """
+        if self._owned:
+            self._executor.shutdown(wait=wait, cancel_futures=True)
+
+    async def parse(self, text: str, timeout=_default) -> 'pusta.Diagram':
+        """
+        Parses and transforms text, returns a transformed Diagram. timeout (seconds, default: the parser's) raises
+        asyncio.TimeoutError.
+        """
+        key = ("text", pusta.cache.ParseCache.key(text.encode('utf-8')))
+        return await self._request(key, text, None, timeout)
+
+    async def parse_file(self, path, timeout=_default) -> 'pusta.Diagram':
+        """
+        Reads, parses and transforms the diagram file at path, see parse.
+        """
+        text = await self._submit(_read, path)
+        key = ("file", str(path), pusta.cache.ParseCache.key(text.encode('utf-8')))
+        return await self._request(key, text, path, timeout)
+
+    async def _request(self, key, text, path, timeout):
+        if timeout is _default:
+            timeout = self._timeout
+        in_flight = self._state().in_flight
+        job = in_flight.get(key)
+        if job is None:
+            job = _Job(asyncio.ensure_future(self._run(text, path)))
+            in_flight[key] = job
+            job.task.add_done_callback(lambda _: self._forget(in_flight, key, job))
+        else:
+            _logger.debug("Joining in-flight request %s", key[-1])
+        job.waiters += 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(job.task), timeout)
+        finally:
+            job.waiters -= 1
+            if not job.waiters and not job.task.done():
+                job.task.cancel()
+                self._forget(in_flight, key, job)
+
+    @staticmethod
+    def _forget(in_flight, key, job):
+        if in_flight.get(key) is job:
+            del in_flight[key]
+
+    def _state(self) -> _LoopState:
+        # Semaphores are bound to the loop they are first contended in
+        loop = asyncio.get_running_loop()
+        state = self._loops.get(loop)
+        if state is None:
+            state = self._loops[loop] = _LoopState(self._max_concurrency)
+        return state
+
+    async def _run(self, text, path):
+        if self._process:
+            data = await self._submit(_transform_in_worker, text, path)
+            parser = self._parser
+            return pusta.Diagram(statechart=pusta.serialize.loads(data),
+                                 loader=lambda: parser._model_from_str(text, path))
+        return await self._submit(self._transform, text, path)
+
+    async def _submit(self, function, *args):
+        # The slot is released when the executor is done with the work, not when the request is cancelled
+        semaphore = self._state().semaphore
+        await semaphore.acquire()
+        loop = asyncio.get_running_loop()
+        try:
+            future = self._executor.submit(function, *args)
+        except BaseException:
+            semaphore.release()
+            raise
+
+        def release(_):
+            try:
+                loop.call_soon_threadsafe(semaphore.release)
+            except RuntimeError:
+                # The event loop is closed
+                pass
+
+        future.add_done_callback(release)
+        return await asyncio.wrap_future(future)
+
+    def _transform(self, text, path):
+        diagram = self._parser._parse_text(text, path)
+        # Kept by the diagram, awaiting callers get it built
+        diagram.transform()
+        return diagram
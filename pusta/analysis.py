@@ -0,0 +1,328 @@
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
+
+from pusta.runtime import CHOICE, DEEP_HISTORY, FINAL, FORK, HISTORY, STATE, CompiledStatechart, compile_statechart
+from pusta.statechart import Statechart
+
+
+class Issue(NamedTuple):
+    kind: str
+    vertex: str
+    message: str
+
+
+# Issue kinds in the order lint() reports them
+UNREACHABLE = "unreachable"
+DEADLOCK = "deadlock"
+TRAP = "trap"
+CHOICE_WITHOUT_ELSE = "choice-without-else"
+UNMATCHED_FORK = "unmatched-fork"
+UNMATCHED_JOIN = "unmatched-join"
+
+
+class Analysis:
+    """
+    Reachability and liveness checks of a statechart over the tables of its CompiledStatechart.
+
+    Guards and events are assumed to be satisfiable, so every transition of an active state can fire. A state is
+    reachable if it is entered by a transition or by default entry, or if it is the ancestor of an entered state;
+    entering a state enters the initial states of all its regions, entering a state inside a region enters the
+    initial states of the other regions of the ancestor. A history state enters the states active before, which
+    have been reached already, or its default transition (the initial state of its region if it has none).
+
+    The other checks work on the move graph: a vertex leads to the targets of its transitions, to the initial
+    states of its regions and, if any ancestor has transitions, to the exit node of its parent state, which
+    leads to the targets of the parent's transitions and to the exit node of its own parent. All checks run in
+    time linear in the number of vertices, regions and transitions, except for fork/join matching, which visits
+    the states between a fork and its joins once per branch.
+    """
+
+    def __init__(self, chart: Union[Statechart, CompiledStatechart]):
+        if isinstance(chart, Statechart):
+            chart = compile_statechart(chart)
+        self._chart = chart
+        self._reachable: Optional[bytearray] = None
+        self._edges: Optional[List[List[int]]] = None
+        self._exit_owner: List[int] = []
+        self._components: Optional[List[List[int]]] = None
+
+    @property
+    def compiled(self) -> CompiledStatechart:
+        return self._chart
+
+    def _parent_state(self, v: int) -> int:
+        return self._chart.region_parent[self._chart.region_of[v]]
+
+    def _targets(self, v: int):
+        chart = self._chart
+        return [chart.t_target[t] for t in chart.outgoing[v]]
+
+    def reachable(self) -> List[str]:
+        reachable = self._reachable_vertices()
+        return sorted(name for v, name in enumerate(self._chart.names) if reachable[v])
+
+    def unreachable(self) -> List[str]:
+        reachable = self._reachable_vertices()
+        return sorted(name for v, name in enumerate(self._chart.names) if not reachable[v])
+
+    def _reachable_vertices(self) -> bytearray:
+        if self._reachable is not None:
+            return self._reachable
+        chart = self._chart
+        reachable = bytearray(len(chart.names))
+        entered = bytearray(len(chart.names))
+        fired = bytearray(len(chart.names))
+        active_regions = bytearray(len(chart.region_names))
+        # Vertices to enter
+        stack = []
+
+        def default_entry(region):
+            active_regions[region] = 1
+            initial = chart.region_initial[region]
+            if initial >= 0:
+                stack.append(initial)
+
+        def fire(v):
+            if not fired[v]:
+                fired[v] = 1
+                stack.extend(self._targets(v))
+
+        def activate(region):
+            # A region entered explicitly through one of its vertices, activates the ancestors
+            while not active_regions[region]:
+                active_regions[region] = 1
+                parent = chart.region_parent[region]
+                if parent < 0:
+                    break
+                reachable[parent] = 1
+                fire(parent)
+                for r in chart.regions_of[parent]:
+                    if r != region:
+                        default_entry(r)
+                region = chart.region_of[parent]
+
+        default_entry(0)
+        while stack:
+            v = stack.pop()
+            if entered[v]:
+                continue
+            entered[v] = reachable[v] = 1
+            fire(v)
+            region = chart.region_of[v]
+            activate(region)
+            kind = chart.kinds[v]
+            if kind in (STATE, FINAL):
+                for r in chart.regions_of[v]:
+                    default_entry(r)
+            elif kind in (HISTORY, DEEP_HISTORY) and not chart.outgoing[v]:
+                default_entry(region)
+        self._reachable = reachable
+        return reachable
+
+    def _move_graph(self) -> List[List[int]]:
+        """
+        Successors of the vertices followed by the exit nodes, _exit_owner holds the state of every exit node.
+        """
+        if self._edges is not None:
+            return self._edges
+        chart = self._chart
+        n = len(chart.names)
+        # Exit node of every state that has transitions itself or through an ancestor, vertices are in tree order
+        exit_node = [-1] * n
+        owners: List[int] = []
+        for v in range(n):
+            parent = self._parent_state(v)
+            if chart.regions_of[v] and (chart.outgoing[v] or (parent >= 0 and exit_node[parent] >= 0)):
+                exit_node[v] = n + len(owners)
+                owners.append(v)
+
+        edges: List[List[int]] = []
+        for v in range(n):
+            successors = self._targets(v)
+            for r in chart.regions_of[v]:
+                if chart.region_initial[r] >= 0:
+                    successors.append(chart.region_initial[r])
+            if chart.kinds[v] in (HISTORY, DEEP_HISTORY) and not chart.outgoing[v]:
+                initial = chart.region_initial[chart.region_of[v]]
+                if initial >= 0:
+                    successors.append(initial)
+            parent = self._parent_state(v)
+            if parent >= 0 and exit_node[parent] >= 0:
+                successors.append(exit_node[parent])
+            edges.append(successors)
+        for p in owners:
+            successors = self._targets(p)
+            parent = self._parent_state(p)
+            if parent >= 0 and exit_node[parent] >= 0:
+                successors.append(exit_node[parent])
+            edges.append(successors)
+        self._edges = edges
+        self._exit_owner = owners
+        return edges
+
+    def _node_vertex(self, node: int) -> int:
+        n = len(self._chart.names)
+        return node if node < n else self._exit_owner[node - n]
+
+    def components(self) -> List[List[int]]:
+        """
+        Strongly connected components of the move graph (Tarjan), in reverse topological order. Exit nodes are
+        numbered after the vertices.
+        """
+        if self._components is not None:
+            return self._components
+        edges = self._move_graph()
+        count = len(edges)
+        index = [-1] * count
+        low = [0] * count
+        on_stack = bytearray(count)
+        stack: List[int] = []
+        components: List[List[int]] = []
+        counter = 0
+        for root in range(count):
+            if index[root] >= 0:
+                continue
+            work = [(root, 0)]
+            index[root] = low[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack[root] = 1
+            while work:
+                node, i = work[-1]
+                successors = edges[node]
+                if i < len(successors):
+                    work[-1] = (node, i + 1)
+                    succ = successors[i]
+                    if index[succ] < 0:
+                        index[succ] = low[succ] = counter
+                        counter += 1
+                        stack.append(succ)
+                        on_stack[succ] = 1
+                        work.append((succ, 0))
+                    elif on_stack[succ] and index[succ] < low[node]:
+                        low[node] = index[succ]
+                    continue
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    if low[node] < low[parent]:
+                        low[parent] = low[node]
+                if low[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack[member] = 0
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(component)
+        self._components = components
+        return components
+
+    def deadlocks(self) -> List[str]:
+        """
+        Reachable simple states that can not be left: neither they nor any ancestor have a transition.
+        """
+        chart = self._chart
+        edges = self._move_graph()
+        reachable = self._reachable_vertices()
+        return sorted(chart.names[v] for v in range(len(chart.names))
+                      if reachable[v] and chart.kinds[v] == STATE and not edges[v])
+
+    def traps(self) -> List[List[str]]:
+        """
+        Groups of reachable states that can reach each other but never leave the group nor reach a final state.
+        """
+        chart = self._chart
+        edges = self._move_graph()
+        reachable = self._reachable_vertices()
+        component_of: Dict[int, int] = dict()
+        traps = []
+        for c, component in enumerate(self.components()):
+            for node in component:
+                component_of[node] = c
+            # Components are in reverse topological order: successors outside were numbered before
+            if len(component) == 1 and component[0] not in edges[component[0]]:
+                continue
+            if any(component_of[succ] != c for node in component for succ in edges[node]):
+                continue
+            vertices = {self._node_vertex(node) for node in component}
+            if any(chart.kinds[v] == FINAL for v in vertices) or not any(reachable[v] for v in vertices):
+                continue
+            traps.append(sorted(chart.names[v] for v in vertices))
+        return sorted(traps)
+
+    def choices_without_else(self) -> List[str]:
+        """
+        Choices without a transition that is taken when all guards fail: one with an "else" guard or none.
+        """
+        chart = self._chart
+        choices = []
+        for v, kind in enumerate(chart.kinds):
+            if kind != CHOICE:
+                continue
+            guards = [chart.t_guard[t] for t in chart.outgoing[v]]
+            if not any(guard is None or guard.strip() == "else" for guard in guards):
+                choices.append(chart.names[v])
+        return sorted(choices)
+
+    def _fork_joins(self) -> Tuple[List[str], List[str]]:
+        chart = self._chart
+        edges = self._move_graph()
+        joins = {v for v in range(len(chart.names)) if chart.is_join(v)}
+        forks = [v for v, kind in enumerate(chart.kinds) if kind == FORK and v not in joins]
+        unmatched_forks = []
+        matched_joins = set()
+        for fork in forks:
+            common = None
+            for branch in self._targets(fork):
+                reached = set()
+                seen = {fork, branch}
+                stack = [branch]
+                while stack:
+                    node = stack.pop()
+                    if node in joins:
+                        reached.add(node)
+                        continue
+                    for succ in edges[node]:
+                        if succ not in seen:
+                            seen.add(succ)
+                            stack.append(succ)
+                common = reached if common is None else common & reached
+            if common:
+                matched_joins |= common
+            else:
+                unmatched_forks.append(chart.names[fork])
+        unmatched_joins = [chart.names[v] for v in joins - matched_joins]
+        return sorted(unmatched_forks), sorted(unmatched_joins)
+
+    def unmatched_forks(self) -> List[str]:
+        """
+        Forks whose branches do not all lead to a common join.
+        """
+        return self._fork_joins()[0]
+
+    def unmatched_joins(self) -> List[str]:
+        """
+        Joins that are not the common join of the branches of any fork.
+        """
+        return self._fork_joins()[1]
+
+    def lint(self) -> List[Issue]:
+        issues = [Issue(UNREACHABLE, name, "State is not reachable") for name in self.unreachable()]
+        issues.extend(Issue(DEADLOCK, name, "State can not be left") for name in self.deadlocks())
+        issues.extend(Issue(TRAP, trap[0], f"States {', '.join(trap)} can not be left and do not finish")
+                      for trap in self.traps())
+        issues.extend(Issue(CHOICE_WITHOUT_ELSE, name, "Choice has no else path")
+                      for name in self.choices_without_else())
+        forks, joins = self._fork_joins()
+        issues.extend(Issue(UNMATCHED_FORK, name, "Branches of the fork do not meet in a join") for name in forks)
+        issues.extend(Issue(UNMATCHED_JOIN, name, "Join does not match a fork") for name in joins)
+        return issues
+
+
+def lint(statechart: Union[Statechart, CompiledStatechart]) -> List[Issue]:
+    """
+    Checks a statechart for unreachable states, deadlocks, traps, choices without else and unmatched forks and
+    joins, see Analysis.
+    """
+    return Analysis(statechart).lint()
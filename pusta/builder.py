@@ -1,13 +1,30 @@
 from pusta.statechart import *
-from typing import Dict
+from pusta import instrument
+from typing import Callable, Dict, Optional
 import logging
 
+# Kinds of transition endpoints by model class, the textX and the fast parser model use different classes of the
+# same name
+_INITIAL_FINAL, _REGULAR, _HISTORY, _UNKNOWN = range(4)
+_endpoint_kinds: Dict[type, int] = {str: _INITIAL_FINAL}
+_endpoint_kind_names = {"RegularState": _REGULAR, "HistoryState": _HISTORY}
+
+
+def _endpoint_kind(cls):
+    kind = _endpoint_kinds.get(cls)
+    if kind is None:
+        kind = _endpoint_kinds[cls] = _endpoint_kind_names.get(cls.__name__, _UNKNOWN)
+    return kind
+
 
 class StatechartBuilder:
     def __init__(self):
+        # Expression class -> consume_<ClassName> method of the builder (None if there is none), filled on first use
+        self._consumers: Dict[type, Optional[Callable]] = dict()
         self._statechart = Statechart()
         self._states: Dict[str, State] = dict()
         self._logger = logging.getLogger(self.__class__.__name__)
+        self._debug = self._logger.isEnabledFor(logging.DEBUG)
         self._active_parent = self._statechart
 
     @staticmethod
@@ -33,13 +50,21 @@ class StatechartBuilder:
         return self.remove_empty_regions()
 
     def remove_empty_regions(self):
-        for r in self._statechart.get_contents_of_type(Region):
-            if len(r.children) == 0:
-                r.parent.remove_child(r)
+        with instrument.phase("remove_empty_regions", "builder"):
+            for r in self._statechart.get_contents_of_type(Region, ordered=False):
+                if len(r.children) == 0:
+                    r.parent.remove_child(r)
 
     def consume_diagram(self, diagram):
+        self.consume_expressions(diagram._model.expressions)
+
+    def consume_expressions(self, expressions):
+        """
+        Consumes the top-level expressions of a diagram, expressions can be any iterable, e.g. a generator that
+        parses them on demand.
+        """
         try:
-            for expression in diagram._model.expressions:
+            for expression in expressions:
                 self.consume_expression(expression)
             self.after_transformation_cleanup()
         except Exception:
@@ -47,14 +72,20 @@ class StatechartBuilder:
             raise
 
     def consume_expression(self, expression):
-        clsname = expression.__class__.__name__
-        self._logger.debug(f"Consuming {clsname}")
-        consumer_name = f"consume_{clsname}"
-        consumer = getattr(self, consumer_name, None)
-        if not consumer:
-            self._logger.error(f"No consumer for {clsname}!")
-        else:
+        cls = expression.__class__
+        try:
+            consumer = self._consumers[cls]
+        except KeyError:
+            consumer = self._consumers[cls] = getattr(self, f"consume_{cls.__name__}", None)
+        if self._debug:
+            self._logger.debug("Consuming %s", cls.__name__)
+        if consumer is None:
+            self._logger.error("No consumer for %s!", cls.__name__)
+        elif instrument._active is None:
             consumer(expression)
+        else:
+            with instrument._active.phase(f"consume_{cls.__name__}", "builder"):
+                consumer(expression)
 
     def create_history_state(self, state):
         if state.parent_name:
@@ -73,33 +104,33 @@ class StatechartBuilder:
 
     def consume_TransitionExpression(self, transition):
         src = transition.src
-        src_type = self.tname(src)
+        src_type = _endpoint_kind(src.__class__)
         src_state = None
-        if src_type == "str":
+        if src_type == _REGULAR:
+            src_state = self.get_or_add_state(src.name)
+        elif src_type == _INITIAL_FINAL:
             if src == "[*]":
                 src_state = self._active_parent.create_initial_state()
-        elif src_type == "RegularState":
-            src_state = self.get_or_add_state(src.name)
-        elif src_type == "HistoryState":
+        elif src_type == _HISTORY:
             src_state = self.create_history_state(src)
         if not src_state:
-            raise TypeError(f"Source state type {src_type} of state {src} not handled!")
+            raise TypeError(f"Source state type {self.tname(src)} of state {src} not handled!")
 
         dst = transition.dest
-        dst_type = self.tname(dst)
+        dst_type = _endpoint_kind(dst.__class__)
         dst_state = None
-        if dst_type == "str":
-            if dst == "[*]":
-                dst_state = self._active_parent.create_final_state()
-        elif dst_type == "RegularState":
+        if dst_type == _REGULAR:
             if dst.type:
                 dst_state = self.create_pseudo_state(dst.name, dst.type.type)
             else:
                 dst_state = self.get_or_add_state(dst.name)
-        elif dst_type == "HistoryState":
+        elif dst_type == _INITIAL_FINAL:
+            if dst == "[*]":
+                dst_state = self._active_parent.create_final_state()
+        elif dst_type == _HISTORY:
             dst_state = self.create_history_state(dst)
         if not dst_state:
-            raise TypeError(f"Destination state type {dst_type} of state {dst} not handled!")
+            raise TypeError(f"Destination state type {self.tname(dst)} of state {dst} not handled!")
 
         t = Transition(transition.description)
         t.source = src_state
@@ -157,7 +188,7 @@ class StatechartBuilder:
 
         if name in self._states:
             old_state = self._states[name]
-            for c in old_state.children:
+            for c in list(old_state.children):
                 old_state.remove_child(c)
                 state.add_child(c)
             old_state.parent.remove_child(old_state)
@@ -189,13 +220,17 @@ class StatechartBuilder:
                 self._active_parent = region
                 for expr in r.expressions:
                     self.consume_expression(expr)
+            self._active_parent = prev_parent
         elif tname == "PseudoState":
             self.create_pseudo_state(state_name, type.type)
         else:
-            self._logger.error(f"State type {tname} of state {state_name} not handled!")
+            self._logger.error("State type %s of state %s not handled!", tname, state_name)
 
     def consume_StateAliasExpression(self, expression):
         self.add_state(expression.name)
 
     def consume_ScaleExpression(self, expression):
         pass
+
+    # Notes have no meaning for the statechart
+    consume_ShortNote = consume_FloatingNote = consume_LongNote = consume_ScaleExpression
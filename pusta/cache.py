@@ -0,0 +1,163 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import zlib
+from typing import Optional
+
+from pusta import serialize
+from pusta.statechart import Statechart
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_SIZE = 256 * 1024 * 1024
+
+
+def dumps(statechart: Statechart) -> bytes:
+    return zlib.compress(serialize.dumps(statechart))
+
+
+def loads(data: bytes) -> Statechart:
+    return serialize.loads(zlib.decompress(data))
+
+
+class ParseCache:
+    """
+    Directory of transformed statecharts, keyed by content hash.
+
+    Entries are written atomically (temporary file + rename), so several processes can share one directory.
+    Reading an entry refreshes its modification time; once the directory grows beyond max_size bytes, the least
+    recently used entries are evicted until it is below low_water * max_size. The size of the written entries is
+    tracked in memory, the directory is only listed when it exceeds max_size and every rescan_interval writes,
+    to count the entries of other processes.
+    """
+
+    suffix = ".pusta"
+    low_water = 0.9
+    rescan_interval = 256
+
+    def __init__(self, directory, max_size=DEFAULT_CACHE_SIZE):
+        self._directory = directory
+        self._max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # Total size of the entries, None until the directory is listed
+        self._size: Optional[int] = None
+        self._writes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def directory(self):
+        return self._directory
+
+    @staticmethod
+    def key(*parts: bytes) -> str:
+        h = hashlib.sha256()
+        for part in parts:
+            h.update(len(part).to_bytes(8, 'little'))
+            h.update(part)
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self._directory, key + self.suffix)
+
+    def get(self, key) -> Optional[Statechart]:
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+
+        try:
+            statechart = loads(data)
+        except Exception:
+            _logger.warning(f"Discarding unreadable cache entry {path}")
+            self._remove(path)
+            self._grow(-len(data))
+            self.misses += 1
+            return None
+
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self.hits += 1
+        return statechart
+
+    def put(self, key, statechart: Statechart):
+        data = dumps(statechart)
+        path = self._path(key)
+        try:
+            replaced = os.stat(path).st_size
+        except FileNotFoundError:
+            replaced = 0
+        fd, tmp = tempfile.mkstemp(dir=self._directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            self._remove(tmp)
+            raise
+        with self._lock:
+            self._writes += 1
+            if self._size is not None and self._writes < self.rescan_interval:
+                self._size += len(data) - replaced
+                if self._size <= self._max_size:
+                    return
+            self._evict()
+
+    def _grow(self, size):
+        with self._lock:
+            if self._size is not None:
+                self._size += size
+
+    def _entries(self):
+        entries = []
+        with os.scandir(self._directory) as it:
+            for entry in it:
+                if not entry.name.endswith(self.suffix):
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime_ns, st.st_size, entry.path))
+        return entries
+
+    def size(self):
+        size = sum(size for _, size, _ in self._entries())
+        with self._lock:
+            self._size = size
+        return size
+
+    def _evict(self):
+        # Lists the directory, called with the lock held
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        if total > self._max_size:
+            limit = self._max_size * self.low_water
+            for _, size, path in sorted(entries):
+                self._remove(path)
+                total -= size
+                if total <= limit:
+                    break
+        self._size = total
+        self._writes = 0
+
+    def clear(self):
+        for _, _, path in self._entries():
+            self._remove(path)
+        with self._lock:
+            self._size = 0
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
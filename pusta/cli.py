@@ -0,0 +1,449 @@
+import argparse
+import concurrent.futures
+import ctypes
+import ctypes.util
+import json
+import logging
+import os
+import select
+import struct
+import sys
+import time
+from typing import Dict, Iterable, List, Optional, Set
+
+import textx.export
+
+import pusta
+import pusta.codegen.c
+from pusta.codegen import identifier
+
+_logger = logging.getLogger(__name__)
+
+# Files transformed as diagrams, other files are only followed as includes
+DIAGRAM_SUFFIXES = (".pu", ".puml", ".plantuml")
+
+# Output file suffix per export format, "c" writes a header and a source file into a directory
+FORMATS = {"text": ".txt", "scxml": ".scxml", "dot": ".dot", "c": None}
+
+
+def is_diagram(path) -> bool:
+    return str(path).endswith(DIAGRAM_SUFFIXES)
+
+
+def _scan(root) -> Iterable[str]:
+    for directory, directories, files in os.walk(root):
+        directories[:] = [d for d in directories if not d.startswith(".")]
+        for name in files:
+            yield os.path.join(directory, name)
+
+
+def export(diagram: 'pusta.Diagram', fmt: str, target=None, name: str = None) -> List[str]:
+    """
+    Writes diagram in format fmt (see FORMATS) to the file target, or to stdout if target is None. For "c" target
+    is the directory (default: the working directory) of the generated files, named after name. Returns the
+    written paths.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt}, expected one of {tuple(FORMATS)}")
+    # "dot" exports the model, the others the statechart
+    statechart = None if fmt == "dot" else diagram.transform()
+    if fmt == "c":
+        target = target or "."
+        os.makedirs(target, exist_ok=True)
+        return list(pusta.codegen.c.generate(statechart, target, prefix=identifier(name or "statechart")))
+    if target is None:
+        _write(diagram, statechart, fmt, sys.stdout, name)
+        return []
+    os.makedirs(os.path.dirname(os.path.abspath(target)), exist_ok=True)
+    with open(target, "w") as f:
+        _write(diagram, statechart, fmt, f, name)
+    return [target]
+
+
+def _write(diagram, statechart, fmt, stream, name):
+    if fmt == "dot":
+        textx.export.model_export_to_file(stream, diagram._model)
+    elif fmt == "scxml":
+        statechart.to_scxml(stream, name)
+    else:
+        stream.write(str(statechart))
+
+
+def _build(path, transform=True, fmt=None, target=None, parser=None):
+    """
+    Parses (and transforms, and exports) the diagram at path, returns its timing record and included files. Runs
+    in the worker processes of Watch, with the parser set up by pusta._init_worker.
+    """
+    parser = parser or pusta._worker_parser or pusta.Pusta()
+    record = dict(event="build", path=path)
+    error = None
+    start = time.perf_counter()
+    with pusta.instrument.Profiler(events=False) as profiler:
+        try:
+            diagram = parser.parse_file(path)
+            if transform:
+                diagram.transform()
+            if fmt:
+                record["output"] = export(diagram, fmt, target, os.path.splitext(os.path.basename(path))[0])
+        except Exception as e:
+            error = f"{e.__class__.__name__}: {e}"
+    record["ok"] = error is None
+    record["ms"] = round((time.perf_counter() - start) * 1e3, 3)
+    record["phases"] = {s.name: round(s.seconds * 1e3, 3) for s in profiler.summary() if s.category == "pusta"}
+    if error:
+        record["error"] = error
+    return record, sorted(parser.preprocessor.dependencies(path))
+
+
+class PollingWatcher:
+    """
+    Detects changed files below root by comparing their modification time and size every interval seconds.
+    """
+
+    def __init__(self, root, interval: float = 0.5):
+        self.root = os.path.abspath(root)
+        self.interval = interval
+        self._stamps = self._snapshot()
+
+    def _snapshot(self) -> Dict[str, tuple]:
+        stamps = dict()
+        for path in _scan(self.root):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            stamps[path] = (st.st_mtime_ns, st.st_size)
+        return stamps
+
+    def poll(self, timeout: float) -> Set[str]:
+        """
+        Waits up to timeout seconds for changes, returns the created, modified and removed files.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            stamps = self._snapshot()
+            changes = {p for p in stamps.keys() | self._stamps.keys() if stamps.get(p) != self._stamps.get(p)}
+            self._stamps = stamps
+            remaining = deadline - time.monotonic()
+            if changes or remaining <= 0:
+                return changes
+            time.sleep(min(self.interval, remaining))
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    """
+    Detects changed files below root with Linux inotify, raises OSError or AttributeError where it is not available.
+    """
+
+    _event = struct.Struct("iIII")
+
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_Q_OVERFLOW = 0x4000
+    IN_IGNORED = 0x8000
+    IN_ISDIR = 0x40000000
+
+    _mask = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self._watches: Dict[int, str] = dict()
+        self._add_tree(self.root)
+
+    def _add_tree(self, root):
+        for directory, directories, _ in os.walk(root):
+            directories[:] = [d for d in directories if not d.startswith(".")]
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), self._mask)
+            if wd >= 0:
+                self._watches[wd] = directory
+
+    def poll(self, timeout: float) -> Set[str]:
+        """
+        Waits up to timeout seconds for changes, returns the created, modified and removed files and directories.
+        """
+        if not select.select([self._fd], [], [], timeout)[0]:
+            return set()
+        changes = set()
+        while True:
+            try:
+                data = os.read(self._fd, 65536)
+            except BlockingIOError:
+                return changes
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = self._event.unpack_from(data, offset)
+                name = os.fsdecode(data[offset + self._event.size:offset + self._event.size + length].rstrip(b"\0"))
+                offset += self._event.size + length
+                if mask & self.IN_Q_OVERFLOW:
+                    # Events were lost
+                    changes.update(_scan(self.root))
+                    continue
+                directory = self._watches.get(wd)
+                if directory is None:
+                    continue
+                if mask & self.IN_IGNORED:
+                    del self._watches[wd]
+                    continue
+                path = os.path.join(directory, name)
+                if mask & self.IN_ISDIR and mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                    self._add_tree(path)
+                    changes.update(_scan(path))
+                elif mask & self.IN_ISDIR or not name.startswith("."):
+                    changes.add(path)
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+def watcher(root, poll: bool = False, interval: float = 0.5):
+    """
+    An InotifyWatcher for root, or a PollingWatcher if poll is set or inotify is not available.
+    """
+    if not poll:
+        try:
+            return InotifyWatcher(root)
+        except (OSError, AttributeError) as e:
+            _logger.info(f"inotify not available ({e}), polling for changes")
+    return PollingWatcher(root, interval)
+
+
+class Watch:
+    """
+    Keeps the diagrams below root transformed: after the initial build, every change (collected until no further
+    change follows within debounce seconds) rebuilds the changed diagrams and the diagrams including a changed
+    file. Diagrams are built in a pool of workers processes (workers=1: in this process) which stay alive
+    between builds and keep the grammar and the included files loaded. A JSON record with the timing of every
+    diagram and of every batch is written to stream.
+
+    With fmt every built diagram is exported (see export) to the same relative path below output.
+    """
+
+    def __init__(self, parser: 'pusta.Pusta', root, workers: int = None, fmt: str = None, output=None,
+                 debounce: float = 0.2, poll: bool = False, interval: float = 0.5, stream=None):
+        self.root = os.path.abspath(root)
+        self._parser = parser
+        self._format = fmt
+        self._output = os.path.abspath(output) if output else None
+        self._debounce = debounce
+        self._stream = stream or sys.stdout
+        self._watcher = watcher(self.root, poll, interval)
+        self._executor = None
+        if workers != 1:
+            self._executor = concurrent.futures.ProcessPoolExecutor(workers, initializer=pusta._init_worker,
+                                                                    initargs=parser._init_args())
+        # Built diagram -> the files it includes, and the reverse
+        self._includes: Dict[str, Set[str]] = dict()
+        self._dependents: Dict[str, Set[str]] = dict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def close(self):
+        self._watcher.close()
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+    def diagrams(self) -> List[str]:
+        return sorted(p for p in _scan(self.root) if is_diagram(p))
+
+    def _target(self, path):
+        if not self._format or not self._output:
+            return None
+        relative = os.path.relpath(path, self.root)
+        if self._format == "c":
+            return os.path.join(self._output, os.path.dirname(relative))
+        return os.path.join(self._output, os.path.splitext(relative)[0] + FORMATS[self._format])
+
+    def _emit(self, record):
+        self._stream.write(json.dumps(record) + "\n")
+        self._stream.flush()
+
+    def _set_includes(self, path, included: Iterable[str]):
+        for dependency in self._includes.pop(path, ()):
+            self._dependents[dependency].discard(path)
+        if included is not None:
+            self._includes[path] = set(included)
+            for dependency in included:
+                self._dependents.setdefault(dependency, set()).add(path)
+
+    def dependents(self, path) -> Set[str]:
+        """
+        The built diagrams including the file at path.
+        """
+        return set(self._dependents.get(os.path.abspath(path), ()))
+
+    def build(self, paths) -> List[dict]:
+        """
+        Builds the diagrams at paths, returns and writes their records.
+        """
+        paths = [os.path.abspath(p) for p in paths]
+        if not paths:
+            return []
+        start = time.perf_counter()
+        targets = [self._target(p) for p in paths]
+        if self._executor is None:
+            results = (_build(p, True, self._format, t, self._parser) for p, t in zip(paths, targets))
+        else:
+            results = self._executor.map(_build, paths, [True] * len(paths), [self._format] * len(paths), targets)
+        records = []
+        for record, included in results:
+            self._set_includes(record["path"], included)
+            self._emit(record)
+            records.append(record)
+        self._emit(dict(event="batch", files=len(records), failed=sum(not r["ok"] for r in records),
+                        ms=round((time.perf_counter() - start) * 1e3, 3)))
+        return records
+
+    def update(self, changes: Iterable[str]) -> List[dict]:
+        """
+        Rebuilds the diagrams affected by the changed files or directories, returns the records of the rebuilt
+        diagrams.
+        """
+        rebuild = set()
+        for path in map(os.path.abspath, changes):
+            rebuild.update(self._dependents.get(path, ()))
+            if os.path.isdir(path):
+                rebuild.update(p for p in _scan(path) if is_diagram(p))
+            elif is_diagram(path):
+                rebuild.add(path)
+            for built in [p for p in self._includes if p == path or p.startswith(path + os.sep)]:
+                if not os.path.exists(built):
+                    self._set_includes(built, None)
+                    self._emit(dict(event="removed", path=built))
+        return self.build(sorted(p for p in rebuild if os.path.isfile(p)))
+
+    def changes(self, timeout: float = None) -> Set[str]:
+        """
+        Waits up to timeout seconds (forever if None) for a change and returns it with the changes following it
+        within the debounce time.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        changes = set()
+        while not changes:
+            wait = 1.0 if deadline is None else deadline - time.monotonic()
+            if wait <= 0:
+                return changes
+            changes = self._watcher.poll(min(wait, 1.0))
+        while True:
+            more = self._watcher.poll(self._debounce)
+            if not more:
+                return changes
+            changes |= more
+
+    def run(self, stop=None):
+        """
+        Builds all diagrams, then rebuilds on changes until stop (a threading.Event) is set or KeyboardInterrupt.
+        """
+        self.build(self.diagrams())
+        try:
+            while stop is None or not stop.is_set():
+                changes = self.changes(timeout=1.0)
+                if changes:
+                    self.update(changes)
+        except KeyboardInterrupt:
+            pass
+
+
+def _parser(args) -> 'pusta.Pusta':
+    return pusta.Pusta(engine=args.engine, cache_dir=args.cache_dir)
+
+
+def _parse(args) -> int:
+    parser = _parser(args)
+    failed = 0
+    for path in args.files:
+        record, _ = _build(path, transform=False, parser=parser)
+        failed += not record["ok"]
+        print(json.dumps(record))
+    return 1 if failed else 0
+
+
+def _transform(args) -> int:
+    failed = 0
+    for result in _parser(args).parse_files(args.files, workers=args.workers):
+        if result.ok:
+            sys.stdout.write(str(result.statechart))
+        else:
+            failed += 1
+            print(f"{result.path}: {result.error}", file=sys.stderr)
+    return 1 if failed else 0
+
+
+def _export(args) -> int:
+    name = args.name or os.path.splitext(os.path.basename(args.file))[0]
+    try:
+        paths = export(_parser(args).parse_file(args.file), args.format, args.output, name)
+    except Exception as e:
+        print(f"{args.file}: {e.__class__.__name__}: {e}", file=sys.stderr)
+        return 1
+    for path in paths:
+        print(path, file=sys.stderr)
+    return 0
+
+
+def _watch(args) -> int:
+    with Watch(_parser(args), args.directory, args.workers, args.format, args.output, args.debounce, args.poll,
+               args.interval) as watch:
+        watch.run()
+    return 0
+
+
+def arguments() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="pusta", description="Parses and transforms PlantUML state diagrams")
+    parser.add_argument("--engine", choices=pusta.Pusta._engines, default="fast",
+                        help="parser, fast falls back to textx for unsupported input (default: fast)")
+    parser.add_argument("--cache-dir", help="directory of the parse cache")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser("parse", help="parse diagrams, write a JSON record per file")
+    command.add_argument("files", nargs="+")
+    command.set_defaults(run=_parse)
+
+    command = commands.add_parser("transform", help="transform diagrams, write their statecharts")
+    command.add_argument("files", nargs="+")
+    command.add_argument("--workers", type=int, default=1, help="worker processes (default: 1, in this process)")
+    command.set_defaults(run=_transform)
+
+    command = commands.add_parser("export", help="transform a diagram and export it")
+    command.add_argument("file")
+    command.add_argument("-f", "--format", choices=tuple(FORMATS), default="scxml")
+    command.add_argument("-o", "--output", help="output file (directory for c, default: stdout or .)")
+    command.add_argument("--name", help="name of the statechart (default: the file name)")
+    command.set_defaults(run=_export)
+
+    command = commands.add_parser("watch", help="rebuild the diagrams below a directory when they change, "
+                                                "write a JSON timing record per file")
+    command.add_argument("directory", nargs="?", default=".")
+    command.add_argument("-f", "--format", choices=tuple(FORMATS), help="export every built diagram")
+    command.add_argument("-o", "--output", help="directory of the exported files")
+    command.add_argument("--workers", type=int, help="worker processes (default: CPU count, 1: in this process)")
+    command.add_argument("--debounce", type=float, default=0.2, help="seconds to wait for further changes")
+    command.add_argument("--poll", action="store_true", help="poll instead of using inotify")
+    command.add_argument("--interval", type=float, default=0.5, help="polling interval in seconds")
+    command.set_defaults(run=_watch)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = arguments().parse_args(argv)
+    if getattr(args, "format", None) and args.command == "watch" and not args.output:
+        arguments().error("watch --format needs --output")
+    return args.run(args)
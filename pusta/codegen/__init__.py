@@ -0,0 +1,31 @@
+import re
+
+_non_identifier = re.compile(r'\W+')
+
+
+def identifier(name: str) -> str:
+    """
+    Turns a state or event name into an identifier valid in C-like languages.
+    """
+    s = _non_identifier.sub('_', name).strip('_') or '_'
+    if s[0].isdigit():
+        s = '_' + s
+    return s
+
+
+def unique_identifiers(names, prefix=""):
+    """
+    Maps every name to a distinct identifier, colliding identifiers get a numeric suffix.
+    """
+    result = dict()
+    used = set()
+    for name in names:
+        base = prefix + identifier(name)
+        ident = base
+        n = 1
+        while ident in used:
+            n += 1
+            ident = f"{base}_{n}"
+        used.add(ident)
+        result[name] = ident
+    return result
@@ -0,0 +1,554 @@
+import os
+from string import Template
+from typing import Dict, Union
+
+from pusta.codegen import identifier, unique_identifiers
+from pusta.runtime import COMPLETION, DEEP_HISTORY, FINAL, FORK, HISTORY, STATE, CompiledStatechart, \
+    compile_statechart
+from pusta.statechart import Statechart
+
+_c_types = ((0xff, "uint8_t"), (0xffff, "uint16_t"), (0xffffffff, "uint32_t"))
+
+
+def _c_type(max_value):
+    return next(t for limit, t in _c_types if max_value <= limit)
+
+
+def _c_string(s):
+    escaped = s.replace("\\", "\\\\").replace('"', '\\"').replace("?", "\\?")
+    return '"' + "".join(c if c >= " " else f"\\{ord(c):03o}" for c in escaped) + '"'
+
+
+_header = Template("""\
+/* Generated by pusta, do not edit. */
+#ifndef ${M}_H
+#define ${M}_H
+
+#include <stddef.h>
+#include <stdint.h>
+
+${enums}\
+typedef int (*${p}_guard_fn)(void *context, ${p}_guard_t guard, ${p}_event_t event);
+typedef void (*${p}_action_fn)(void *context, ${p}_action_t action, ${p}_event_t event);
+
+typedef struct {
+    uint8_t active[${M}_STATE_BYTES];
+    uint8_t history[${M}_STATE_BYTES];
+    ${p}_guard_fn guard;
+    ${p}_action_fn action;
+    void *context;
+    ${p}_event_t event;
+    int error;
+    /* Scratch space of state entry, entries started while entering states stack their states on top */
+    ${vertex} entered[${M}_STATE_COUNT];
+    ${vertex} targets[${M}_STATE_COUNT];
+    uint8_t restored[${M}_REGION_COUNT];
+    size_t entering;
+} ${p}_t;
+
+extern const char *const ${p}_guard_names[];
+extern const char *const ${p}_action_names[];
+
+void ${p}_init(${p}_t *machine, ${p}_guard_fn guard, ${p}_action_fn action, void *context);
+int ${p}_dispatch(${p}_t *machine, ${p}_event_t event);
+void ${p}_run(${p}_t *machine, const ${p}_event_t *events, size_t count);
+int ${p}_is_in(const ${p}_t *machine, ${p}_state_t state);
+
+#endif /* ${M}_H */
+""")
+
+_source = Template("""\
+/* Generated by pusta, do not edit. */
+#include <string.h>
+#include "${header}"
+
+#define NONE ${M}_STATE_COUNT
+#define NO_TRANSITION ${transitions}
+#define COMPLETION ${M}_EVENT_COUNT
+#define ELSE (${M}_GUARD_COUNT + 1)
+#define NO_ACTION ${M}_ACTION_COUNT
+#define MAX_STEPS 10000
+#define COMPLETIONS ${completions}
+
+#define KIND_STATE ${STATE}
+#define KIND_FINAL ${FINAL}
+#define KIND_HISTORY ${HISTORY}
+#define KIND_DEEP_HISTORY ${DEEP_HISTORY}
+#define KIND_FORK ${FORK}
+
+#define BIT(set, v) (((set)[(v) >> 3] >> ((v) & 7)) & 1)
+#define SET(set, v) ((set)[(v) >> 3] |= (uint8_t)(1u << ((v) & 7)))
+#define CLEAR(set, v) ((set)[(v) >> 3] &= (uint8_t)~(1u << ((v) & 7)))
+
+${tables}
+static void ${p}_enter(${p}_t *m, size_t domain, const ${vertex} *targets, size_t count);
+
+static int ${p}_active(const ${p}_t *m, size_t v)
+{
+    return BIT(m->active, v);
+}
+
+static int ${p}_complete(const ${p}_t *m, size_t v)
+{
+    /* All regions of v reached a final state */
+    for (size_t i = ${p}_regions[v]; i < ${p}_regions[v + 1]; i++) {
+        size_t r = ${p}_child_regions[i], a = ${p}_first[r];
+        while (a < ${p}_first[r + 1] && !(BIT(m->active, a) && ${p}_kind[a] == KIND_FINAL))
+            a++;
+        if (a == ${p}_first[r + 1])
+            return 0;
+    }
+    return 1;
+}
+
+static int ${p}_enabled(${p}_t *m, size_t t)
+{
+    /* Signed, so that the check is dropped without a warning if there are no guards */
+    int guard = ${p}_guard[t];
+    if (guard < ${M}_GUARD_COUNT && m->guard && !m->guard(m->context, (${p}_guard_t)guard, m->event))
+        return 0;
+    /* A join is enabled once all its sources are active */
+    size_t target = ${p}_target[t];
+    for (size_t i = ${p}_join[target]; i < ${p}_join[target + 1]; i++)
+        if (!${p}_active(m, ${p}_join_sources[i]))
+            return 0;
+    return 1;
+}
+
+static size_t ${p}_select(${p}_t *m, size_t v)
+{
+    size_t otherwise = NO_TRANSITION;
+    for (size_t t = ${p}_out[v]; t < ${p}_out[v + 1]; t++) {
+        if (${p}_guard[t] == ELSE)
+            otherwise = t;
+        else if (${p}_enabled(m, t))
+            return t;
+    }
+    if (otherwise == NO_TRANSITION)
+        m->error = 1;
+    return otherwise;
+}
+
+static void ${p}_exit(${p}_t *m, size_t domain)
+{
+    /* Regions and their states are numbered in tree order, the regions inside domain follow it */
+    for (size_t r = domain + 1; r < ${p}_end[domain]; r++) {
+        if (!${p}_active(m, ${p}_parent[r]))
+            continue;
+        for (size_t v = ${p}_first[r]; v < ${p}_first[r + 1]; v++) {
+            if (BIT(m->active, v))
+                SET(m->history, v);
+            else
+                CLEAR(m->history, v);
+        }
+    }
+    size_t v = ${p}_first[domain], end = ${p}_first[${p}_end[domain]];
+    for (; v < end && (v & 7); v++)
+        CLEAR(m->active, v);
+    memset(m->active + (v >> 3), 0, (end - v) >> 3);
+    for (v += (end - v) & ~(size_t)7; v < end; v++)
+        CLEAR(m->active, v);
+}
+
+static void ${p}_perform(${p}_t *m, size_t t)
+{
+    if (${p}_action[t] != NO_ACTION && m->action)
+        m->action(m->context, (${p}_action_t)${p}_action[t], m->event);
+}
+
+static void ${p}_fire(${p}_t *m, size_t t)
+{
+    ${p}_exit(m, ${p}_domain[t]);
+    ${p}_perform(m, t);
+    ${p}_enter(m, ${p}_domain[t], &${p}_target[t], 1);
+}
+
+static void ${p}_follow(${p}_t *m, size_t v)
+{
+    size_t t = ${p}_select(m, v);
+    if (t != NO_TRANSITION)
+        ${p}_fire(m, t);
+}
+
+static void ${p}_default_entry(${p}_t *m, size_t r)
+{
+    size_t initial = ${p}_initial[r];
+    if (initial != NONE && ${p}_out[initial] != ${p}_out[initial + 1])
+        ${p}_follow(m, initial);
+}
+
+static int ${p}_recorded(const ${p}_t *m, size_t r)
+{
+    for (size_t v = ${p}_first[r]; v < ${p}_first[r + 1]; v++)
+        if (BIT(m->history, v))
+            return 1;
+    return 0;
+}
+
+static void ${p}_enter_history(${p}_t *m, size_t r, int deep)
+{
+    /* The states that were active in r, or in r and the regions inside r, when r was exited */
+    ${vertex} *targets = m->targets;
+    uint8_t *restored = m->restored;
+    size_t count = 0;
+    for (size_t s = r; s < (deep ? ${p}_end[r] : r + 1); s++) {
+        size_t parent = ${p}_parent[s];
+        restored[s] = s == r || (restored[${p}_region[parent]] && BIT(m->history, parent));
+        if (!restored[s])
+            continue;
+        for (size_t v = ${p}_first[s]; v < ${p}_first[s + 1]; v++)
+            if (BIT(m->history, v))
+                targets[count++] = (${vertex})v;
+    }
+    ${p}_enter(m, r, targets, count);
+}
+
+static void ${p}_enter_pseudo_state(${p}_t *m, size_t v)
+{
+    size_t kind = ${p}_kind[v], region = ${p}_region[v];
+    size_t first = ${p}_out[v], end = ${p}_out[v + 1];
+    if (kind == KIND_HISTORY || kind == KIND_DEEP_HISTORY) {
+        if (${p}_recorded(m, region))
+            ${p}_enter_history(m, region, kind == KIND_DEEP_HISTORY);
+        else if (first != end)
+            ${p}_follow(m, v);
+        else
+            ${p}_default_entry(m, region);
+    } else if (kind == KIND_FORK) {
+        if (first == end)
+            return;
+        /* Regions are numbered in tree order, the outermost domain has the lowest number */
+        size_t domain = ${p}_domain[first];
+        for (size_t t = first; t < end; t++) {
+            ${p}_perform(m, t);
+            if (${p}_domain[t] < domain)
+                domain = ${p}_domain[t];
+        }
+        ${p}_exit(m, domain);
+        ${p}_enter(m, domain, &${p}_target[first], end - first);
+    } else if (first != end) {
+        ${p}_follow(m, v);
+    }
+}
+
+static int ${p}_explicit(const ${vertex} *entered, size_t n, size_t r)
+{
+    /* A region is entered explicitly if one of the entered states is in it */
+    for (size_t i = 0; i < n; i++)
+        if (${p}_region[entered[i]] == r)
+            return 1;
+    return 0;
+}
+
+static void ${p}_enter(${p}_t *m, size_t domain, const ${vertex} *targets, size_t count)
+{
+    /* Enter the targets and their ancestors up to domain, outermost first */
+    size_t base = m->entering, n = 0;
+    ${vertex} *entered = m->entered + base;
+    for (size_t i = 0; i < count; i++) {
+        size_t v = targets[i];
+        for (;;) {
+            size_t r = ${p}_region[v], j = n;
+            while (j > 0 && entered[j - 1] != v)
+                j--;
+            if (j == 0) {
+                if (base + n == ${M}_STATE_COUNT) {
+                    m->error = 1;
+                    return;
+                }
+                entered[n++] = (${vertex})v;
+            }
+            if (r == domain)
+                break;
+            v = ${p}_parent[r];
+            if (v == NONE) {
+                m->error = 1;
+                return;
+            }
+        }
+    }
+    m->entering = base + n;
+    for (size_t i = 1; i < n; i++) {
+        ${vertex} v = entered[i];
+        size_t j = i;
+        for (; j > 0 && ${p}_depth[${p}_region[entered[j - 1]]] > ${p}_depth[${p}_region[v]]; j--)
+            entered[j] = entered[j - 1];
+        entered[j] = v;
+    }
+    for (size_t i = 0; i < n; i++) {
+        size_t v = entered[i];
+        if (${p}_kind[v] != KIND_STATE && ${p}_kind[v] != KIND_FINAL) {
+            ${p}_enter_pseudo_state(m, v);
+            continue;
+        }
+        SET(m->active, v);
+        for (size_t k = ${p}_regions[v]; k < ${p}_regions[v + 1]; k++)
+            if (!${p}_explicit(entered, n, ${p}_child_regions[k]))
+                ${p}_default_entry(m, ${p}_child_regions[k]);
+    }
+    m->entering = base;
+}
+
+static int ${p}_step(${p}_t *m, size_t event)
+{
+    /* Innermost states first, a state does not fire once a state inside it fired */
+    uint8_t candidates[${M}_STATE_BYTES];
+    uint8_t blocked[${M}_STATE_BYTES] = {0};
+    int fired = 0;
+    memcpy(candidates, m->active, sizeof(candidates));
+    for (size_t i = 0; i < ${M}_REGION_COUNT; i++) {
+        size_t r = ${p}_order[i];
+        for (size_t v = ${p}_first[r]; v < ${p}_first[r + 1]; v++) {
+            if ((v & 7) == 0 && !candidates[v >> 3]) {
+                v += 7;
+                continue;
+            }
+            if (!BIT(candidates, v) || BIT(blocked, v) || !BIT(m->active, v))
+                continue;
+            if (event == COMPLETION && !${p}_complete(m, v))
+                continue;
+            /* An else guard only holds if no other guard for the event does */
+            size_t t = ${p}_out[v], otherwise = NO_TRANSITION;
+            for (; t < ${p}_out[v + 1]; t++) {
+                if (${p}_event[t] != event)
+                    continue;
+                if (${p}_guard[t] == ELSE)
+                    otherwise = t;
+                else if (${p}_enabled(m, t))
+                    break;
+            }
+            if (t == ${p}_out[v + 1]) {
+                if (otherwise == NO_TRANSITION || !${p}_enabled(m, otherwise))
+                    continue;
+                t = otherwise;
+            }
+            ${p}_fire(m, t);
+            fired = 1;
+            for (size_t s = r; s > 0; s = ${p}_region[${p}_parent[s]])
+                SET(blocked, ${p}_parent[s]);
+        }
+    }
+    return fired;
+}
+
+static void ${p}_settle(${p}_t *m)
+{
+    if (!COMPLETIONS)
+        return;
+    for (int i = 0; i < MAX_STEPS; i++) {
+        m->event = (${p}_event_t)COMPLETION;
+        if (!${p}_step(m, COMPLETION))
+            return;
+    }
+    m->error = 1;
+}
+
+void ${p}_init(${p}_t *machine, ${p}_guard_fn guard, ${p}_action_fn action, void *context)
+{
+    memset(machine->active, 0, sizeof(machine->active));
+    memset(machine->history, 0, sizeof(machine->history));
+    machine->guard = guard;
+    machine->action = action;
+    machine->context = context;
+    machine->event = (${p}_event_t)COMPLETION;
+    machine->error = 0;
+    machine->entering = 0;
+    ${p}_default_entry(machine, 0);
+    ${p}_settle(machine);
+}
+
+int ${p}_dispatch(${p}_t *machine, ${p}_event_t event)
+{
+    machine->event = event;
+    machine->error = 0;
+    int fired = ${p}_step(machine, event);
+    if (fired)
+        ${p}_settle(machine);
+    return machine->error ? -1 : fired;
+}
+
+void ${p}_run(${p}_t *machine, const ${p}_event_t *events, size_t count)
+{
+    for (size_t i = 0; i < count; i++)
+        ${p}_dispatch(machine, events[i]);
+}
+
+int ${p}_is_in(const ${p}_t *machine, ${p}_state_t state)
+{
+    return ${p}_active(machine, state);
+}
+""")
+
+
+class CGenerator:
+    """
+    Generates a table-driven C implementation of a statechart.
+
+    The State/Region hierarchy is emitted as const tables (see pusta.runtime.CompiledStatechart): vertices with
+    their kind, region and ranges of outgoing transitions and child regions, regions with their parent and
+    initial state, and transitions grouped by source with event, guard, action, target and domain. A small
+    generic run-to-completion loop over these tables implements the semantics of pusta.runtime.Machine, including
+    parallel regions, history, choices and forks/joins, without branching on states.
+
+    For a prefix "door" the header declares the door_event_t, door_state_t, door_guard_t and door_action_t
+    enums (DOOR_EVENT_<name>, DOOR_STATE_<name>, ...), the door_t machine struct and door_init, door_dispatch,
+    door_run and door_is_in. Guards and actions are decided at runtime by the callbacks passed to door_init,
+    guard(context, guard, event) and action(context, action, event), completion transitions have the event
+    DOOR_EVENT_COUNT. door_guard_names and door_action_names hold their text, without a guard callback all guards
+    hold. door_dispatch returns -1 if a choice had no enabled branch or no stable configuration was reached.
+    door_t also holds the scratch space of state entry, the functions keep no arrays sized by the chart on the
+    stack.
+    """
+
+    def __init__(self, chart: Union[Statechart, CompiledStatechart], prefix: str = "statechart"):
+        if isinstance(chart, Statechart):
+            chart = compile_statechart(chart)
+        self._chart = chart
+        self._prefix = identifier(prefix).lower()
+        self._macro = self._prefix.upper()
+
+        guards = dict()
+        actions = dict()
+        for guard, action in zip(chart.t_guard, chart.t_action):
+            if guard is not None and guard != "else":
+                guards.setdefault(guard, len(guards))
+            if action is not None:
+                actions.setdefault(action, len(actions))
+        self._guards = guards
+        self._actions = actions
+        self._state_ids = unique_identifiers(chart.names, f"{self._macro}_STATE_")
+        self._event_ids = unique_identifiers(chart.event_names, f"{self._macro}_EVENT_")
+        self._guard_ids = unique_identifiers(guards, f"{self._macro}_GUARD_")
+        self._action_ids = unique_identifiers(actions, f"{self._macro}_ACTION_")
+        self._vertex = _c_type(len(chart.names))
+
+    @property
+    def compiled(self) -> CompiledStatechart:
+        return self._chart
+
+    @property
+    def state_identifiers(self) -> Dict[str, str]:
+        return dict(self._state_ids)
+
+    @property
+    def event_identifiers(self) -> Dict[str, str]:
+        return dict(self._event_ids)
+
+    @property
+    def guard_identifiers(self) -> Dict[str, str]:
+        return dict(self._guard_ids)
+
+    @property
+    def action_identifiers(self) -> Dict[str, str]:
+        return dict(self._action_ids)
+
+    @property
+    def header_name(self) -> str:
+        return f"{self._prefix}.h"
+
+    @property
+    def source_name(self) -> str:
+        return f"{self._prefix}.c"
+
+    def write_header(self, stream):
+        m = self._macro
+        enums = [self._enum(f"{self._prefix}_{kind}_t", ids.values(), f"{m}_{kind.upper()}_COUNT")
+                 for kind, ids in (("event", self._event_ids), ("state", self._state_ids),
+                                   ("guard", self._guard_ids), ("action", self._action_ids))]
+        enums.append(f"#define {m}_REGION_COUNT {len(self._chart.region_names)}\n"
+                     f"#define {m}_STATE_BYTES (({m}_STATE_COUNT >> 3) + 1)\n\n")
+        stream.write(_header.substitute(p=self._prefix, M=m, vertex=self._vertex, enums="".join(enums)))
+
+    @staticmethod
+    def _enum(name, values, count):
+        return "typedef enum {\n" + "".join(f"    {value},\n" for value in values) + f"    {count}\n}} {name};\n\n"
+
+    def write_source(self, stream):
+        chart = self._chart
+        # Completion transitions of states, without them events are never followed by completion steps
+        completions = sum(1 for e, v in zip(chart.t_event, chart.t_source)
+                          if e == COMPLETION and chart.kinds[v] in (STATE, FINAL))
+        stream.write(_source.substitute(p=self._prefix, M=self._macro, vertex=self._vertex, header=self.header_name,
+                                        transitions=len(chart.t_source), tables=self._tables(), completions=completions,
+                                        STATE=STATE, FINAL=FINAL, HISTORY=HISTORY, DEEP_HISTORY=DEEP_HISTORY,
+                                        FORK=FORK))
+
+    def _tables(self):
+        chart = self._chart
+        p = self._prefix
+        vertices = len(chart.names)
+        regions = range(len(chart.region_names))
+
+        # Transitions grouped by source, in their order in the chart
+        transitions = sorted(range(len(chart.t_source)), key=lambda t: chart.t_source[t])
+        out = [0]
+        for v in range(vertices):
+            out.append(out[-1] + len(chart.outgoing[v]))
+        joins = [[chart.t_source[t] for t in chart.incoming[v]] if chart.is_join(v) else [] for v in range(vertices)]
+        region_end = list(regions)
+        for r in reversed(regions):
+            if chart.region_parent[r] >= 0:
+                outer = chart.region_of[chart.region_parent[r]]
+                region_end[outer] = max(region_end[outer], region_end[r])
+        # The states of a region are numbered together, empty regions start where the next region starts
+        first = [vertices] * (len(regions) + 1)
+        for v in reversed(range(vertices)):
+            first[chart.region_of[v]] = v
+        for r in reversed(regions):
+            first[r] = min(first[r], first[r + 1])
+        events = [len(chart.event_names) if e == COMPLETION else e for e in chart.t_event]
+        guards = [len(self._guards) + 1 if g == "else" else self._guards.get(g, len(self._guards))
+                  for g in chart.t_guard]
+        actions = [self._actions.get(a, len(self._actions)) for a in chart.t_action]
+
+        vertex, region = self._vertex, _c_type(len(chart.region_names))
+        transition = _c_type(len(chart.t_source))
+        tables = [
+            ("uint8_t", "kind", chart.kinds),
+            (region, "region", chart.region_of),
+            (transition, "out", out),
+            (region, "regions", self._ranges(chart.regions_of)),
+            (region, "child_regions", [r for rs in chart.regions_of for r in rs]),
+            (transition, "join", self._ranges(joins)),
+            (vertex, "join_sources", [s for sources in joins for s in sources]),
+            (vertex, "parent", [vertices if v < 0 else v for v in chart.region_parent]),
+            (region, "end", [e + 1 for e in region_end]),
+            (region, "depth", chart.region_depth),
+            (vertex, "first", first),
+            (vertex, "initial", [vertices if v < 0 else v for v in chart.region_initial]),
+            (region, "order", sorted(regions, key=lambda r: -chart.region_depth[r])),
+            (_c_type(len(chart.event_names)), "event", [events[t] for t in transitions]),
+            (_c_type(len(self._guards) + 1), "guard", [guards[t] for t in transitions]),
+            (_c_type(len(self._actions)), "action", [actions[t] for t in transitions]),
+            (vertex, "target", [chart.t_target[t] for t in transitions]),
+            (region, "domain", [chart.domains[t] for t in transitions]),
+        ]
+        # C has no empty arrays
+        lines = [f"static const {t} {p}_{name}[] = {{{', '.join(map(str, values or [0]))}}};\n"
+                 for t, name, values in tables]
+        for kind, names in (("guard", self._guards), ("action", self._actions)):
+            lines.append(f"const char *const {p}_{kind}_names[] = {{{', '.join(map(_c_string, names)) or '0'}}};\n")
+        return "".join(lines)
+
+    @staticmethod
+    def _ranges(lists):
+        ranges = [0]
+        for items in lists:
+            ranges.append(ranges[-1] + len(items))
+        return ranges
+
+    def write(self, directory):
+        """
+        Writes <prefix>.h and <prefix>.c into directory and returns both paths.
+        """
+        header = os.path.join(directory, self.header_name)
+        source = os.path.join(directory, self.source_name)
+        with open(header, "w") as f:
+            self.write_header(f)
+        with open(source, "w") as f:
+            self.write_source(f)
+        return header, source
+
+
+def generate(chart, directory, prefix: str = "statechart"):
+    return CGenerator(chart, prefix).write(directory)
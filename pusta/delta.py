@@ -0,0 +1,196 @@
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from pusta.statechart import *
+
+
+class Delta(NamedTuple):
+    """
+    Structural difference between two statecharts a and b. added lists nodes of b and removed nodes of a (states,
+    pseudo states, regions and transitions, not their labels). moved and relabelled list (node of a, node of b)
+    pairs of the same state or transition: moved states have another parent, relabelled nodes another label.
+    """
+    added: List[BaseNode]
+    removed: List[BaseNode]
+    moved: List[Tuple[BaseNode, BaseNode]]
+    relabelled: List[Tuple[BaseNode, BaseNode]]
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.moved or self.relabelled)
+
+    def __str__(self):
+        lines = [f"+ {describe(n)}" for n in self.added]
+        lines += [f"- {describe(n)}" for n in self.removed]
+        lines += [f"> {describe(b)}: {describe(a.parent)} -> {describe(b.parent)}" for a, b in self.moved]
+        lines += [f"~ {describe(b)}: {_label(a)!r} -> {_label(b)!r}" for a, b in self.relabelled]
+        return "\n".join(lines)
+
+
+def describe(node: BaseNode) -> str:
+    if isinstance(node, Transition):
+        return f"Transition {_name(node.source)} -> {_name(node.destination)}"
+    if isinstance(node, NamedNode):
+        return f"{node.__class__.__name__} {node.fqn()}"
+    return node.__class__.__name__
+
+
+def _name(node) -> Optional[str]:
+    return node.fqn() if node is not None else None
+
+
+def _label(node) -> Optional[str]:
+    return node.label._label if node.label is not None else None
+
+
+_MASK = (1 << 64) - 1
+
+
+def fingerprint(root: BaseNode) -> int:
+    """
+    Structural hash of the tree of root (the root of the tree, e.g. a Statechart), equal for equal trees
+    regardless of the order of the children. The hashes of all nodes are kept until their subtree changes, so
+    only changed paths are hashed again.
+    """
+    if root._fingerprint is not None:
+        return root._fingerprint
+    stack = [(root, False)]
+    while stack:
+        node, ready = stack.pop()
+        if not ready:
+            stack.append((node, True))
+            stack.extend((c, False) for c in node._children if c._fingerprint is None)
+            continue
+        # A sum does not depend on the order of the children
+        children = sum(c._fingerprint for c in node._children) & _MASK
+        if isinstance(node, Label):
+            node._fingerprint = hash((Label, node._label))
+        elif isinstance(node, Transition):
+            node._fingerprint = hash((Transition, node._dst.fqn() if node._dst else None, children))
+        elif isinstance(node, NamedNode):
+            node._fingerprint = hash((node.__class__, node._name, children))
+        else:
+            node._fingerprint = hash((node.__class__, children))
+    return root._fingerprint
+
+
+def _key(node: BaseNode):
+    return node.fqn() if isinstance(node, NamedNode) else None
+
+
+class _Differ:
+    def __init__(self):
+        self.delta = Delta([], [], [], [])
+        # Changed nodes not matched yet, by fully qualified name
+        self.only_a: Dict[str, BaseNode] = dict()
+        self.only_b: Dict[str, BaseNode] = dict()
+        self.pairs: List[Tuple[BaseNode, BaseNode]] = []
+        # Nodes whose children were all put into the pools
+        self.expanded = set()
+
+    def run(self, a, b):
+        self.pairs.append((a, b))
+        while True:
+            while self.pairs:
+                self.compare(*self.pairs.pop())
+            self.match()
+            # Unmatched nodes are gone or were replaced, their descendants may be found elsewhere
+            if not self.pairs and not self.expand():
+                break
+        for pool, result in ((self.only_a, self.delta.removed), (self.only_b, self.delta.added)):
+            for node in pool.values():
+                result.append(node)
+                result.extend(c for c in node._children if isinstance(c, Transition))
+
+    def match(self):
+        for key in [k for k in self.only_a if k in self.only_b]:
+            x = self.only_a[key]
+            y = self.only_b[key]
+            if x.__class__ is not y.__class__:
+                continue
+            del self.only_a[key], self.only_b[key]
+            if _key(x.parent) != _key(y.parent):
+                self.delta.moved.append((x, y))
+            if id(x) in self.expanded or id(y) in self.expanded:
+                # Some children are in the pools already, match all of them there
+                self.expand_node(x, self.only_a)
+                self.expand_node(y, self.only_b)
+            if x._fingerprint != y._fingerprint:
+                self.pairs.append((x, y))
+
+    def expand(self) -> bool:
+        expanded = False
+        for pool in (self.only_a, self.only_b):
+            for node in list(pool.values()):
+                expanded |= self.expand_node(node, pool)
+        return expanded
+
+    def expand_node(self, node, pool) -> bool:
+        if id(node) in self.expanded:
+            return False
+        self.expanded.add(id(node))
+        for child in node._children:
+            if isinstance(child, NamedNode):
+                pool[child.fqn()] = child
+        return True
+
+    def compare(self, x, y):
+        if isinstance(x, LabeledNode) and _label(x) != _label(y):
+            self.delta.relabelled.append((x, y))
+        if isinstance(x, AbstractState):
+            # Transitions may be duplicated, they are compared as lists
+            self.compare_transitions(x.get_transitions(), y.get_transitions())
+        if id(x) in self.expanded:
+            return
+        # A named child with the fingerprint of a child of the other node is the same, unchanged node
+        in_x = {c._fingerprint for c in x._children}
+        in_y = {c._fingerprint for c in y._children}
+        for c in x._children:
+            if c._fingerprint not in in_y and isinstance(c, NamedNode):
+                self.only_a[c.fqn()] = c
+        for c in y._children:
+            if c._fingerprint not in in_x and isinstance(c, NamedNode):
+                self.only_b[c.fqn()] = c
+
+    def compare_transitions(self, xs, ys):
+        # Unchanged transitions first, then transitions to the same destination are relabelled
+        unchanged: Dict[int, List[Transition]] = dict()
+        for t in xs:
+            unchanged.setdefault(t._fingerprint, []).append(t)
+        remaining_y = []
+        for t in ys:
+            same = unchanged.get(t._fingerprint)
+            if same:
+                same.pop()
+            else:
+                remaining_y.append(t)
+        by_destination: Dict[Optional[str], List[Transition]] = dict()
+        for ts in unchanged.values():
+            for t in ts:
+                by_destination.setdefault(_key(t.destination) if t.destination else None, []).append(t)
+        for t in remaining_y:
+            same = by_destination.get(_key(t.destination) if t.destination else None)
+            if same:
+                self.delta.relabelled.append((same.pop(0), t))
+            else:
+                self.delta.added.append(t)
+        for ts in by_destination.values():
+            self.delta.removed.extend(ts)
+
+
+def diff(a: BaseNode, b: BaseNode) -> Delta:
+    """
+    Computes the structural difference between the statecharts a and b. States and regions are
+    matched by fully qualified name, transitions by source, destination and label. Subtrees with equal
+    fingerprints are skipped, so similar statecharts are compared in time proportional to their differences
+    once their fingerprints are known.
+    """
+    fingerprint(a)
+    fingerprint(b)
+    differ = _Differ()
+    if a._fingerprint != b._fingerprint:
+        differ.run(a, b)
+    delta = differ.delta
+    for nodes in (delta.added, delta.removed):
+        nodes.sort(key=describe)
+    delta.moved.sort(key=lambda p: describe(p[1]))
+    delta.relabelled.sort(key=lambda p: describe(p[1]))
+    return delta
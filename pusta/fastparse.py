@@ -0,0 +1,372 @@
+import re
+
+
+class FastParseError(Exception):
+    def __init__(self, message, position):
+        super().__init__(f"{message} at position {position}")
+        self.position = position
+
+
+class Expression:
+    __slots__ = ()
+
+    def __init__(self, *values):
+        for attr, value in zip(self.__slots__, values):
+            setattr(self, attr, value)
+
+    def __repr__(self):
+        attrs = ", ".join(f"{a}={getattr(self, a)!r}" for a in self.__slots__)
+        return f"{self.__class__.__name__}({attrs})"
+
+
+class Diagram(Expression):
+    __slots__ = ('expressions',)
+
+
+class TransitionExpression(Expression):
+    __slots__ = ('src', 'dest', 'description')
+
+
+class StateDescriptionExpression(Expression):
+    __slots__ = ('state', 'description')
+
+
+class StateDeclarationExpression(Expression):
+    __slots__ = ('name', 'color', 'type')
+
+
+class CompositeState(Expression):
+    __slots__ = ('expressions',)
+
+
+class ParallelState(Expression):
+    __slots__ = ('regions',)
+
+
+class Region(Expression):
+    __slots__ = ('expressions',)
+
+
+class StateAliasExpression(Expression):
+    __slots__ = ('longname', 'name')
+
+
+class ScaleExpression(Expression):
+    __slots__ = ('scale',)
+
+
+class ShortNote(Expression):
+    __slots__ = ('direction', 'target', 'text')
+
+
+class FloatingNote(Expression):
+    __slots__ = ('text', 'target')
+
+
+class LongNote(Expression):
+    __slots__ = ('direction', 'target', 'lines')
+
+
+class RegularState(Expression):
+    __slots__ = ('name', 'type')
+
+
+class PseudoState(Expression):
+    __slots__ = ('type',)
+
+
+class HistoryState(Expression):
+    __slots__ = ('parent_name', 'is_deep')
+
+
+# Terminals of state.tx, matched with the same regular expressions textX uses
+_ws = re.compile(r'[\t\n\r ]*')
+_id = re.compile(r'[^\d\W]\w*\b', re.MULTILINE)
+_int = re.compile(r'[-+]?[0-9]+', re.MULTILINE)
+_string = re.compile(r'("(\\"|[^"])*")|(\'(\\\'|[^\'])*\')', re.MULTILINE)
+_text = re.compile(r'(.*?)\n', re.MULTILINE)
+_arrow = re.compile(r'-+((up|down|right|left)?(\[.*\])?-)?>', re.MULTILINE)
+_color = re.compile(r'#\w*\b', re.MULTILINE)
+_direction = re.compile(r'(\w+)\b', re.MULTILINE)
+_history_parent = re.compile(r'[^\d\W]\w*', re.MULTILINE)
+
+_pseudo_state_types = ('<<fork>>', '<<join>>', '<<choice>>', '<<end>>', '<<entryPoint>>', '<<exitPoint>>',
+                       '<<inputPin>>', '<<outputPin>>', '<<expansionInput>>', '<<expansionOutput>>')
+_region_separators = ('--', '||')
+
+
+class FastParser:
+    """
+    Hand-written recursive descent parser for state.tx.
+
+    Mirrors the PEG semantics of the textX grammar (ordered choice, greedy optionals, whitespace skipping
+    before every terminal) and produces objects with the same class and attribute names as the textX model,
+    so StatechartBuilder consumes them unchanged. Raises FastParseError on any input it can not parse.
+    """
+
+    def __init__(self):
+        self._text = ""
+        self._pos = 0
+
+    def parse(self, text: str) -> Diagram:
+        self._text = text
+        self._pos = 0
+        if not self._literal('@startuml'):
+            self._fail("Expected '@startuml'")
+        expressions = self._expressions()
+        if not self._literal('@enduml'):
+            self._fail("Expected expression or '@enduml'")
+        self._skip_ws()
+        if self._pos != len(text):
+            self._fail("Expected end of input")
+        return Diagram(expressions)
+
+    def _fail(self, message):
+        self._skip_ws()
+        raise FastParseError(message, self._pos)
+
+    def _skip_ws(self):
+        self._pos = _ws.match(self._text, self._pos).end()
+
+    def _literal(self, s):
+        self._skip_ws()
+        if self._text.startswith(s, self._pos):
+            self._pos += len(s)
+            return True
+        return False
+
+    def _regex(self, regex, group=False):
+        self._skip_ws()
+        m = regex.match(self._text, self._pos)
+        if not m or m.end() == self._pos:
+            return None
+        self._pos = m.end()
+        if group and regex.groups == 1:
+            return m.group(1)
+        return m.group()
+
+    def _expressions(self):
+        expressions = []
+        while True:
+            expression = self._expression()
+            if expression is None:
+                return expressions
+            expressions.append(expression)
+
+    def _expression(self):
+        start = self._pos
+        for rule in (self._transition, self._state_description, self._meta, self._state_declaration,
+                     self._state_alias, self._note):
+            expression = rule()
+            if expression is not None:
+                return expression
+            self._pos = start
+        return None
+
+    def _transition(self):
+        src = self._state_identifier()
+        if src is None or self._regex(_arrow) is None:
+            return None
+        dest = self._state_identifier()
+        if dest is None:
+            return None
+        return TransitionExpression(src, dest, self._description())
+
+    def _description(self):
+        start = self._pos
+        if self._literal(':'):
+            text = self._regex(_text, group=True)
+            if text is not None:
+                return text
+        self._pos = start
+        return None
+
+    def _state_identifier(self):
+        start = self._pos
+        state = self._history_state()
+        if state is not None:
+            return state
+        self._pos = start
+        state = self._regular_state()
+        if state is not None:
+            return state
+        self._pos = start
+        if self._literal('[*]'):
+            return '[*]'
+        return None
+
+    def _history_state(self):
+        start = self._pos
+        parent_name = self._regex(_history_parent)
+        if parent_name is None:
+            self._pos = start
+            parent_name = ''
+        if not self._literal('[H'):
+            return None
+        is_deep = self._literal('*')
+        if not self._literal(']'):
+            return None
+        return HistoryState(parent_name, is_deep)
+
+    def _regular_state(self):
+        name = self._regex(_id)
+        if name is None:
+            return None
+        return RegularState(name, self._pseudo_state())
+
+    def _pseudo_state(self):
+        self._skip_ws()
+        if not self._text.startswith('<<', self._pos):
+            return None
+        for t in _pseudo_state_types:
+            if self._text.startswith(t, self._pos):
+                self._pos += len(t)
+                return PseudoState(t)
+        return None
+
+    def _state_description(self):
+        state = self._regular_state()
+        if state is None or not self._literal(':'):
+            return None
+        description = self._regex(_text, group=True)
+        if description is None:
+            return None
+        return StateDescriptionExpression(state, description)
+
+    def _meta(self):
+        if self._literal('hide empty description'):
+            return 'hide empty description'
+        if self._literal('scale'):
+            scale = self._regex(_int)
+            if scale is not None and self._literal('width'):
+                return ScaleExpression(int(scale))
+        return None
+
+    def _state_declaration(self):
+        if not self._literal('state'):
+            return None
+        name = self._regex(_id)
+        if name is None:
+            return None
+        start = self._pos
+        color = self._regex(_color)
+        if color is None:
+            self._pos = start
+            color = ''
+        return StateDeclarationExpression(name, color, self._state_type())
+
+    def _state_type(self):
+        start = self._pos
+        for rule in (self._composite_state, self._parallel_state, self._pseudo_state):
+            state_type = rule()
+            if state_type is not None:
+                return state_type
+            self._pos = start
+        return None
+
+    def _composite_state(self):
+        if not self._literal('{'):
+            return None
+        expressions = self._expressions()
+        if not self._literal('}'):
+            return None
+        return CompositeState(expressions)
+
+    def _parallel_state(self):
+        if not self._literal('{'):
+            return None
+        regions = []
+        while True:
+            start = self._pos
+            expressions = self._expressions()
+            if not self._region_separator() and self._pos == start:
+                break
+            regions.append(Region(expressions))
+        if not self._literal('}'):
+            return None
+        return ParallelState(regions)
+
+    def _region_separator(self):
+        start = self._pos
+        for separator in _region_separators:
+            if self._literal(separator):
+                return True
+            self._pos = start
+        return False
+
+    def _state_alias(self):
+        if not self._literal('state'):
+            return None
+        longname = self._string()
+        if longname is None or not self._literal('as'):
+            return None
+        name = self._regex(_id)
+        if name is None:
+            return None
+        return StateAliasExpression(longname, name)
+
+    def _string(self):
+        s = self._regex(_string)
+        if s is None:
+            return None
+        return s[1:-1].replace(r"\"", r'"').replace(r"\'", "'")
+
+    def _note(self):
+        start = self._pos
+        for rule in (self._short_note, self._floating_note, self._long_note):
+            note = rule()
+            if note is not None:
+                return note
+            self._pos = start
+        return None
+
+    def _note_header(self):
+        if not self._literal('note'):
+            return None
+        direction = self._regex(_direction, group=True)
+        if direction is None or not self._literal('of'):
+            return None
+        target = self._regex(_id)
+        if target is None:
+            return None
+        return direction, target
+
+    def _short_note(self):
+        header = self._note_header()
+        if header is None or not self._literal(':'):
+            return None
+        text = self._regex(_text, group=True)
+        if text is None:
+            return None
+        return ShortNote(header[0], header[1], text)
+
+    def _floating_note(self):
+        if not self._literal('note'):
+            return None
+        text = self._string()
+        if text is None:
+            return None
+        start = self._pos
+        target = None
+        if self._literal('as'):
+            target = self._regex(_id)
+        if target is None:
+            self._pos = start
+            target = ''
+        return FloatingNote(text, target)
+
+    def _long_note(self):
+        header = self._note_header()
+        if header is None:
+            return None
+        lines = []
+        while True:
+            self._skip_ws()
+            if self._text.startswith('end note', self._pos):
+                break
+            line = self._regex(_text)
+            if line is None:
+                return None
+            lines.append(line)
+        self._pos += len('end note')
+        return LongNote(header[0], header[1], lines)
@@ -0,0 +1,939 @@
+import bisect
+import logging
+import re
+from typing import Dict, List, Optional, Tuple
+
+import pusta
+from pusta.builder import StatechartBuilder
+from pusta.statechart import *
+from pusta.stream import MAX_JOINED_BLOCKS, BlockSplitter
+
+_logger = logging.getLogger(__name__)
+
+_header = re.compile(r'[\t\n\r ]*@startuml')
+_footer = re.compile(r'@enduml[\t\n\r ]*\Z')
+
+# Pseudo states of a StateContainer, cleared when they are detached
+_pseudo_fields = ('_initial_state', '_final_state', '_history_state', '_deep_history_state')
+
+
+def split_blocks(text: str, pos: int, end: int):
+    """
+    Yields (start, stop) of the top-level blocks of text[pos:end] (see pusta.stream.BlockSplitter), pos must be
+    at a block boundary. A block that is split wrongly fails to parse on its own and is reported like any other
+    syntax error.
+    """
+    splitter = BlockSplitter()
+    start = pos
+    while pos < end:
+        nl = text.find('\n', pos, end)
+        stop = end if nl < 0 else nl + 1
+        block_end = splitter.feed(text, pos, stop)
+        pos = stop
+        if block_end:
+            yield start, pos
+            start = pos
+    if start < end:
+        yield start, end
+
+
+class _Block:
+    """
+    A top-level block of the diagram body and everything its expressions did to the statechart.
+    """
+    __slots__ = ('text', 'expressions', 'created', 'names', 'lookups', 'refs', 'contexts', 'plain', 'descriptions',
+                 'local', 'parent_before', 'parent_after')
+
+    def __init__(self, text: str):
+        self.text = text
+        self.expressions = None
+        self.reset()
+
+    def reset(self):
+        # Subtrees attached to the statechart, in order
+        self.created: List[BaseNode] = []
+        # Names registered with the builder
+        self.names: List[str] = []
+        # Names looked up that were already registered
+        self.lookups: List[str] = []
+        # Nodes created by other blocks that this block used
+        self.refs: List[BaseNode] = []
+        # Active parent at the first lookup of every node in refs
+        self.contexts: Dict[int, BaseNode] = dict()
+        # Nodes created or used in the order of their first use, and whether that was get_or_add_state, which
+        # creates a state in the active parent if it does not exist
+        self.plain: Dict[int, bool] = dict()
+        # (state, description) for every state description
+        self.descriptions: List[Tuple[State, str]] = []
+        # False if the block moved, replaced or shadowed nodes of other blocks
+        self.local = True
+        self.parent_before = None
+        self.parent_after = None
+
+
+class _Journal:
+    """
+    Undo log of the changes an incremental update makes to the statechart.
+    """
+
+    def __init__(self):
+        # (added, parent, node) for every subtree attached or detached
+        self.changes: List[Tuple[bool, BaseNode, BaseNode]] = []
+        # Children and fields of every parent before its first change
+        self.parents: Dict[int, Tuple[BaseNode, List[BaseNode], Dict[str, object]]] = dict()
+        # Text of every label before its first change
+        self.labels: Dict[int, Tuple[Label, str]] = dict()
+
+    def _save(self, parent, node, added):
+        if id(parent) not in self.parents:
+            children = [c for c in parent._children if not (added and c is node)]
+            fields = dict()
+            if isinstance(parent, StateContainer):
+                for name in _pseudo_fields:
+                    fields[name] = getattr(parent, name)
+            if isinstance(parent, LabeledNode):
+                fields['_label'] = parent._label
+            self.parents[id(parent)] = (parent, children, fields)
+        self.changes.append((added, parent, node))
+
+    def added(self, node):
+        self._save(node.parent, node, True)
+
+    def removed(self, node):
+        self._save(node.parent, node, False)
+
+    def relabel(self, label: Label):
+        self.labels.setdefault(id(label), (label, label._label))
+
+    def rollback(self, statechart: Statechart):
+        for added, parent, node in reversed(self.changes):
+            if added:
+                parent.remove_child(node)
+            else:
+                parent.add_child(node)
+        for parent, children, fields in self.parents.values():
+            parent._children = ChildList(children)
+            parent._invalidate_fingerprint()
+            for name, value in fields.items():
+                setattr(parent, name, value)
+        for label, text in self.labels.values():
+            label._label = text
+            label._invalidate_fingerprint()
+        statechart._tree_index = None
+
+
+class _RecordingBuilder(StatechartBuilder):
+    """
+    StatechartBuilder recording the effects of every top-level block.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.block: Optional[_Block] = None
+        # Names registered more than once resolve differently depending on the position of the lookup
+        self.rebound = set()
+        # Nodes other blocks moved or replaced
+        self.displaced: Dict[int, BaseNode] = dict()
+        # Records the changes of an incremental update until it is applied
+        self.journal: Optional[_Journal] = None
+        self._statechart.observer = self
+
+    def node_added(self, node):
+        if self.journal is not None:
+            self.journal.added(node)
+        if self.block is not None:
+            self.block.created.append(node)
+            self.block.plain.setdefault(id(node), False)
+
+    def node_removed(self, node):
+        if self.journal is not None:
+            self.journal.removed(node)
+        if self.block is not None:
+            self.block.local = False
+            self.displaced[id(node)] = node
+
+    def consume_block(self, block: _Block, parent):
+        block.reset()
+        block.parent_before = parent
+        self._active_parent = parent
+        self.block = block
+        try:
+            for expression in block.expressions:
+                self.consume_expression(expression)
+        finally:
+            self.block = None
+        block.parent_after = self._active_parent
+
+    def _ref(self, name, plain=False):
+        state = self._states.get(name)
+        if state is not None and self.block is not None:
+            self.block.refs.append(state)
+            self.block.lookups.append(name)
+            self.block.contexts.setdefault(id(state), self._active_parent)
+            self.block.plain.setdefault(id(state), plain)
+        return state
+
+    def _register_name(self, name):
+        if name in self._states:
+            self.rebound.add(name)
+            self.block.local = False
+        self.block.names.append(name)
+
+    def forget(self, name):
+        del self._states[name]
+
+    def has_state(self, name):
+        return name in self._states
+
+    def add_state(self, name: str) -> State:
+        if self.block is not None:
+            self._register_name(name)
+        return super().add_state(name)
+
+    def get_or_add_state(self, name: str) -> State:
+        state = self._ref(name, plain=True)
+        if state is None:
+            state = self.add_state(name)
+            if self.block is not None:
+                self.block.plain[id(state)] = True
+        return state
+
+    def create_composite_state(self, name):
+        self._ref(name)
+        return super().create_composite_state(name)
+
+    def create_parallel_state(self, name):
+        self._ref(name)
+        return super().create_parallel_state(name)
+
+    def create_pseudo_state(self, name: str, type: str):
+        if self.block is not None:
+            self._ref(name)
+            self._register_name(name)
+        return super().create_pseudo_state(name, type)
+
+    def consume_StateDescriptionExpression(self, expression):
+        state = self._states.get(expression.state.name)
+        if self.journal is not None and state is not None and state.label:
+            self.journal.relabel(state.label)
+        super().consume_StateDescriptionExpression(expression)
+        if self.block is not None:
+            self.block.descriptions.append((self._states[expression.state.name], expression.description))
+
+
+def _declared_names(expressions):
+    """
+    Yields (name, top_level_parallel) for every state declaration with a type and every alias, recursively.
+    """
+    stack = [(e, True) for e in expressions]
+    while stack:
+        expression, top = stack.pop()
+        cls = expression.__class__.__name__
+        if cls == "StateAliasExpression":
+            yield expression.name, False
+        elif cls == "StateDeclarationExpression" and expression.type:
+            tname = expression.type.__class__.__name__
+            yield expression.name, top and tname == "ParallelState"
+            if tname == "CompositeState":
+                stack.extend((e, False) for e in expression.type.expressions)
+            elif tname == "ParallelState":
+                stack.extend((e, False) for r in expression.type.regions for e in r.expressions)
+
+
+def _endpoint(identifier):
+    cls = identifier.__class__.__name__
+    if cls == "RegularState":
+        return cls, identifier.name, identifier.type.type if identifier.type else None
+    if cls == "HistoryState":
+        return cls, identifier.parent_name, bool(identifier.is_deep)
+    return identifier
+
+
+def _shape(expressions, labels):
+    """
+    Structure of the expressions with transition and state descriptions left out, the descriptions are appended
+    to labels in the order the builder consumes them. Returns None for expressions without a known shape.
+    """
+    shape = []
+    for expression in expressions:
+        cls = expression.__class__.__name__
+        if cls == "TransitionExpression":
+            labels.append(expression.description)
+            shape.append((cls, _endpoint(expression.src), _endpoint(expression.dest)))
+        elif cls == "StateDescriptionExpression":
+            labels.append(expression.description)
+            shape.append((cls, expression.state.name))
+        elif cls == "StateDeclarationExpression":
+            state_type = expression.type
+            tname = state_type.__class__.__name__
+            if tname == "CompositeState":
+                inner = _shape(state_type.expressions, labels)
+            elif tname == "ParallelState":
+                inner = tuple(_shape(r.expressions, labels) for r in state_type.regions)
+                if None in inner:
+                    return None
+            else:
+                inner = state_type.type if state_type else None
+            if inner is None and state_type is not None:
+                return None
+            shape.append((cls, expression.name, tname, inner))
+        elif cls in ("ShortNote", "FloatingNote", "LongNote", "ScaleExpression", "HideEmptyDescriptionExpression"):
+            shape.append((cls,))
+        else:
+            return None
+    return tuple(shape)
+
+
+def _flatten(expressions):
+    """
+    Yields the transition and state description expressions in the order the builder consumes them.
+    """
+    for expression in expressions:
+        cls = expression.__class__.__name__
+        if cls in ("TransitionExpression", "StateDescriptionExpression"):
+            yield expression
+        elif cls == "StateDeclarationExpression" and expression.type is not None:
+            tname = expression.type.__class__.__name__
+            if tname == "CompositeState":
+                yield from _flatten(expression.type.expressions)
+            elif tname == "ParallelState":
+                for region in expression.type.regions:
+                    yield from _flatten(region.expressions)
+
+
+class EditResult:
+    """
+    Outcome of IncrementalDiagram.apply_edit.
+
+    added and removed hold the subtrees attached to and detached from the statechart, changed holds nodes that
+    stayed but gained or lost transitions or changed their label. If rebuilt is set the edit could not be applied
+    locally and the statechart was transformed from scratch, added and removed then hold the states that only
+    exist in the new or the old statechart.
+    """
+
+    def __init__(self, added=(), removed=(), changed=(), rebuilt=False):
+        self.added: List[BaseNode] = list(added)
+        self.removed: List[BaseNode] = list(removed)
+        self.changed: List[BaseNode] = list(changed)
+        self.rebuilt = rebuilt
+
+    def __repr__(self):
+        return (f"EditResult(added={len(self.added)}, removed={len(self.removed)}, changed={len(self.changed)}, "
+                f"rebuilt={self.rebuilt})")
+
+
+class IncrementalDiagram:
+    """
+    A diagram text kept in sync with its statechart under edits.
+
+    The body between @startuml and @enduml is split into top-level blocks (see split_blocks). An edit re-splits
+    only the blocks around it and parses only blocks whose text is new, parsed blocks are cached by text. A block
+    that only parses together with its neighbours (an expression continued on the next line) is joined with them
+    like in pusta.stream.iter_expressions. The blocks that differ from the previous version are then patched
+    into the existing Statechart: the nodes the removed blocks created are detached, the added blocks are run
+    through the builder in place and their transitions are moved to the position a full transformation would give
+    them.
+
+    Edits that only change transition labels or state descriptions relabel the existing nodes. Other edits are
+    patched if they are local, e.g. adding or removing transitions, also those that first mention a state: a
+    state the removed blocks created and other blocks use is taken over by the first block using it, a state of
+    a later block is taken over by an added block using it first, as long as a full transformation creates it in
+    the same parent. Added and taken over states are moved to the place a full transformation gives them.
+
+    These edits fall back to transforming all cached blocks, which still skips parsing: removing a state nested
+    in a composite or parallel state other blocks use, aliasing, redeclaring or moving a state of other blocks,
+    declaring a parallel state at the top level, edits after which a state is first used in another parent (e.g.
+    in a composite state), and every edit of a diagram whose transformation depends on declaration order in other
+    ways (e.g. a name declared twice). The rebuilt statechart replaces the statechart, changes made to the old one
+    before the edit turned out not to be local are undone. EditResult.rebuilt tells which way an edit went.
+    """
+
+    def __init__(self, text: str, parser: 'pusta.Pusta' = None):
+        self._parser = parser or pusta.Pusta(engine="fast")
+        self._text = ""
+        self._body = (0, 0)
+        self._blocks: List[_Block] = []
+        self._starts: List[int] = []
+        self._built: Optional[List[_Block]] = None
+        self._builder: Optional[_RecordingBuilder] = None
+        self._owners: Dict[int, Tuple[BaseNode, _Block]] = dict()
+        self._refcounts: Dict[int, List] = dict()
+        self._name_refcounts: Dict[str, int] = dict()
+        self._parsed: Dict[str, list] = dict()
+        self._set_text(text)
+        self._update()
+
+    @property
+    def text(self) -> str:
+        return self._text
+
+    @property
+    def statechart(self) -> Statechart:
+        return self._builder.statechart
+
+    def apply_edit(self, range: Tuple[int, int], text: str) -> EditResult:
+        """
+        Replaces self.text[start:end] with text and updates the statechart.
+
+        Raises the parser's error if the edited diagram does not parse, the statechart then stays at the last
+        version that did and the next edit is diffed against that version.
+        """
+        start, end = range
+        if not 0 <= start <= end <= len(self._text):
+            raise ValueError(f"Invalid edit range {range!r} for text of length {len(self._text)}")
+        body_start, body_end = self._body
+        new_text = self._text[:start] + text + self._text[end:]
+        if body_start <= start and end <= body_end and '@' not in text:
+            self._resplit(new_text, start, end, len(text))
+        else:
+            self._set_text(new_text)
+        return self._update()
+
+    def _set_text(self, text):
+        header = _header.match(text)
+        footer = _footer.search(text)
+        if not header or not footer or footer.start() < header.end():
+            # Let the parser report the error
+            self._parser._model_from_str(text)
+            raise ValueError("Diagram must start with @startuml and end with @enduml")
+        self._text = text
+        self._body = (header.end(), footer.start())
+        self._blocks = []
+        self._starts = []
+        for s, e in split_blocks(text, *self._body):
+            self._starts.append(s)
+            self._blocks.append(_Block(text[s:e]))
+
+    def _resplit(self, text, start, end, length):
+        delta = length - (end - start)
+        starts, blocks = self._starts, self._blocks
+        i = max(0, bisect.bisect_right(starts, start) - 2)
+        pos = starts[i] if starts else self._body[0]
+        body_end = self._body[1] + delta
+        edited_end = start + length
+        new_starts, new_blocks = [], []
+        k = len(starts)
+        for s, e in split_blocks(text, pos, body_end):
+            new_starts.append(s)
+            new_blocks.append(_Block(text[s:e]))
+            if e >= edited_end:
+                k = bisect.bisect_left(starts, e - delta)
+                if k < len(starts) and starts[k] == e - delta and starts[k] >= end:
+                    break
+                k = len(starts)
+        self._text = text
+        self._body = (self._body[0], body_end)
+        self._starts = starts[:i] + new_starts + [s + delta for s in starts[k:]]
+        self._blocks = blocks[:i] + new_blocks + blocks[k:]
+
+    def _parse(self, block: _Block):
+        if block.expressions is None:
+            expressions = self._parsed.get(block.text)
+            if expressions is None:
+                model = self._parser._model_from_str(f"@startuml\n{block.text}@enduml")
+                expressions = list(model.expressions)
+                self._parsed[block.text] = expressions
+            block.expressions = expressions
+
+    def _parse_blocks(self, i, stop) -> bool:
+        """
+        Parses self._blocks[i:stop]. Like pusta.stream.iter_expressions, a block that does not parse on its own
+        is joined with the previous and the following blocks (an expression continued on the next line), the
+        block's error is raised if no joined block parses either. Returns whether blocks were joined.
+        """
+        joined = False
+        blocks = self._blocks
+        while i < stop:
+            try:
+                self._parse(blocks[i])
+            except Exception as e:
+                span = self._join(i)
+                if span is None:
+                    raise e
+                start, end = span
+                stop = max(start + 1, stop - (end - start - 1))
+                i = start
+                joined = True
+            i += 1
+        return joined
+
+    def _join(self, i) -> Optional[Tuple[int, int]]:
+        """
+        Replaces the blocks around block i with one block that parses, returns the range of the replaced blocks
+        or None if no joined block parses.
+        """
+        blocks, starts = self._blocks, self._starts
+        # The previous expression, across blank lines
+        previous = i - 1
+        while previous > 0 and not blocks[previous].text.strip():
+            previous -= 1
+        candidates = [(previous, i + 1)] if i else []
+        for stop in range(i + 2, min(len(blocks), i + MAX_JOINED_BLOCKS) + 1):
+            candidates.append((i, stop))
+            if i:
+                candidates.append((previous, stop))
+        for start, stop in candidates:
+            block = _Block("".join(b.text for b in blocks[start:stop]))
+            try:
+                self._parse(block)
+            except Exception:
+                continue
+            blocks[start:stop] = [block]
+            starts[start:stop] = [starts[start]]
+            return start, stop
+        return None
+
+    def _changed(self) -> Tuple[int, int]:
+        """
+        Number of blocks before and after the blocks that differ from the built ones.
+        """
+        built, blocks = self._built, self._blocks
+        # Blocks outside the re-split range are the built ones, re-split blocks with unchanged text take over the
+        # records of the built block they replace
+        n = min(len(built), len(blocks))
+        s = 0
+        while s < n and blocks[-1 - s] is built[-1 - s]:
+            s += 1
+        k = 0
+        while k < n - s and blocks[k] is built[k]:
+            k += 1
+        if k + s < n:
+            built_ids = set(map(id, built))
+            while k + s < n and id(blocks[k]) not in built_ids and blocks[k].text == built[k].text:
+                blocks[k] = built[k]
+                k += 1
+            while k + s < n and id(blocks[-1 - s]) not in built_ids and blocks[-1 - s].text == built[-1 - s].text:
+                blocks[-1 - s] = built[-1 - s]
+                s += 1
+        return k, s
+
+    def _update(self) -> EditResult:
+        built = self._built
+        if built is None:
+            self._parse_blocks(0, len(self._blocks))
+            return self._rebuild()
+        k, s = self._changed()
+        # Joining blocks changes the range
+        while self._parse_blocks(k, len(self._blocks) - s):
+            k, s = self._changed()
+        blocks = self._blocks
+        removed = built[k:len(built) - s]
+        added = blocks[k:len(blocks) - s]
+        if not removed and not added:
+            self._built = list(blocks)
+            return EditResult()
+
+        builder = self._builder
+        builder.journal = _Journal()
+        try:
+            result = self._relabel_blocks(k, removed, added)
+            if result is None:
+                result = self._patch(k, removed, added)
+        except Exception:
+            _logger.debug("Incremental update failed, rebuilding", exc_info=True)
+            result = None
+        finally:
+            journal, builder.journal = builder.journal, None
+        if result is None:
+            # The rebuild replaces the statechart, leave the old one as it was
+            journal.rollback(builder.statechart)
+            return self._rebuild()
+        self._built = list(blocks)
+        self._prune_cache()
+        return result
+
+    def _prune_cache(self):
+        if len(self._parsed) > 2 * len(self._blocks) + 1024:
+            self._parsed = {b.text: b.expressions for b in self._blocks if b.expressions is not None}
+
+    def _rebuild(self) -> EditResult:
+        old = self._builder.statechart if self._builder else None
+        self._built = None
+        builder = _RecordingBuilder()
+        parent = builder.statechart
+        try:
+            for block in self._blocks:
+                builder.consume_block(block, parent)
+                parent = block.parent_after
+            builder.after_transformation_cleanup()
+        except Exception:
+            _logger.exception("Exception during diagram transformation")
+            raise
+        self._builder = builder
+        self._owners = dict()
+        self._refcounts = dict()
+        self._name_refcounts = dict()
+        statechart = builder.statechart
+        for block in self._blocks:
+            block.created = [n for n in block.created if n.root is statechart]
+            self._register(block)
+        self._built = list(self._blocks)
+        self._prune_cache()
+        if old is None:
+            return EditResult(statechart.get_states(), rebuilt=True)
+        return self._compare(old, statechart)
+
+    @staticmethod
+    def _signature(state):
+        transitions = tuple((t.destination.fqn(), t.label._label if t.label else None)
+                            for t in state.get_transitions())
+        parent = state.parent.fqn() if isinstance(state.parent, NamedNode) else None
+        return state.__class__, parent, state.label._label if state.label else None, transitions
+
+    def _compare(self, old, new):
+        old_states = {s.fqn(): s for s in old.get_contents_of_type(AbstractState)}
+        new_states = {s.fqn(): s for s in new.get_contents_of_type(AbstractState)}
+        added = [s for name, s in new_states.items() if name not in old_states]
+        removed = [s for name, s in old_states.items() if name not in new_states]
+        changed = [s for name, s in new_states.items()
+                   if name in old_states and self._signature(s) != self._signature(old_states[name])]
+        return EditResult(added, removed, changed, rebuilt=True)
+
+    def _subtree(self, block):
+        for node in block.created:
+            yield node
+            yield from node.iter_contents()
+
+    def _owner(self, node) -> Optional[_Block]:
+        owner = self._owners.get(id(node))
+        return owner[1] if owner is not None else None
+
+    def _roots(self, block):
+        """
+        Nodes the block attached to nodes of other blocks (or the statechart itself).
+        """
+        return [n for n in block.created if self._owner(n.parent) is not block]
+
+    def _register(self, block):
+        owners = self._owners
+        for node in self._subtree(block):
+            owners[id(node)] = (node, block)
+        refs = {id(n): n for n in block.refs if self._owner(n) is not block}
+        for node in block.created:
+            if not isinstance(node.parent, Statechart) and self._owner(node.parent) is not block:
+                refs[id(node.parent)] = node.parent
+            if isinstance(node, Transition) and self._owner(node.destination) is not block:
+                refs[id(node.destination)] = node.destination
+        block.refs = refs = list(refs.values())
+        for node in refs:
+            entry = self._refcounts.setdefault(id(node), [node, 0])
+            entry[1] += 1
+        block.lookups = [name for name in block.lookups if name not in block.names]
+        for name in block.lookups:
+            self._name_refcounts[name] = self._name_refcounts.get(name, 0) + 1
+
+    def _unregister(self, block):
+        for node in block.refs:
+            entry = self._refcounts[id(node)]
+            entry[1] -= 1
+            if not entry[1]:
+                del self._refcounts[id(node)]
+        for name in block.lookups:
+            self._name_refcounts[name] -= 1
+            if not self._name_refcounts[name]:
+                del self._name_refcounts[name]
+        for node in self._subtree(block):
+            if self._owner(node) is block:
+                del self._owners[id(node)]
+
+    def _used(self, removed) -> Optional[Dict[int, State]]:
+        """
+        States of the removed blocks that other blocks use, None if other blocks use anything else.
+
+        Used states can be kept if they are attached to nodes of other blocks, the added blocks then have to
+        take them over.
+        """
+        names = dict()
+        for block in removed:
+            for name in block.lookups:
+                names[name] = names.get(name, 0) + 1
+        used = [self._builder._states[name] for block in removed for name in block.names
+                if self._name_refcounts.get(name, 0) > names.get(name, 0)]
+        for block in removed:
+            for node in block.refs:
+                self._refcounts[id(node)][1] -= 1
+        try:
+            used.extend(node for block in removed for node in self._subtree(block)
+                        if id(node) in self._refcounts and self._refcounts[id(node)][1] > 0)
+        finally:
+            for block in removed:
+                for node in block.refs:
+                    self._refcounts[id(node)][1] += 1
+        kept = dict()
+        for node in used:
+            block = self._owner(node)
+            if not isinstance(node, State) or block is None or node.name not in block.names:
+                return None
+            if node not in self._roots(block):
+                return None
+            kept[id(node)] = node
+        return kept
+
+    def _first_use(self, node, block) -> bool:
+        """
+        Whether block used the state node first through get_or_add_state in its parent, a full transformation
+        would then create it there if no earlier block does.
+        """
+        builder = self._builder
+        if type(node) is not State or not block.plain.get(id(node), False):
+            return False
+        if block.contexts.get(id(node)) is not node.parent:
+            return False
+        return node.name not in builder.rebound and id(node) not in builder.displaced
+
+    def _foreign(self, block) -> Dict[int, Tuple[BaseNode, _Block]]:
+        """
+        Owners of the nodes of other blocks in the subtrees of block, registering block again takes them over.
+        """
+        owners = (self._owners.get(id(n)) for n in self._subtree(block))
+        return {id(owner[0]): owner for owner in owners if owner is not None and owner[1] is not block}
+
+    def _release(self, node, block):
+        """
+        Turns the state node block created into a state it uses, an earlier block takes it over.
+        """
+        foreign = self._foreign(block)
+        self._unregister(block)
+        block.created = [n for n in block.created if n is not node]
+        block.names.remove(node.name)
+        block.refs.append(node)
+        block.lookups.append(node.name)
+        block.contexts[id(node)] = node.parent
+        self._register(block)
+        self._owners.update(foreign)
+
+    def _settle(self, node, block, positions):
+        """
+        Moves a state or pseudo state block created or took over to where a full transformation creates it, behind
+        the nodes of earlier blocks and the nodes block created before. The other children of its parent are in
+        block order.
+        """
+        order = {key: i for i, key in enumerate(block.plain)}
+        key = (positions[id(block)], order[id(node)])
+        parent = node.parent
+        children = list(parent.children)
+        index = children.index(node)
+        del children[index]
+        lo, hi = 0, len(children)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            owner = self._owner(children[mid])
+            rank = order.get(id(children[mid]), -1) if owner is block else -1
+            if (positions.get(id(owner), -1), rank) <= key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo != index:
+            fields = [(name, getattr(parent, name)) for name in _pseudo_fields if getattr(parent, name) is node]
+            parent.remove_child(node)
+            parent.add_child(node, lo)
+            for name, value in fields:
+                setattr(parent, name, value)
+
+    def _place(self, transition, position, positions):
+        """
+        Moves a transition added to a state of another block behind the transitions of earlier blocks.
+        """
+        source = transition.source
+        siblings = source.children
+        index = None
+        for i, sibling in enumerate(s for s in siblings if s is not transition):
+            if isinstance(sibling, Transition) and positions.get(id(self._owner(sibling)), -1) > position:
+                index = i
+                break
+        if index is None:
+            return
+        source.remove_child(transition)
+        transition.attach(source, index)
+
+    def _relabel(self, states) -> List[State]:
+        descriptions = {id(s): [] for s in states}
+        for block in self._blocks:
+            for state, description in block.descriptions:
+                if id(state) in descriptions:
+                    descriptions[id(state)].append(description)
+        changed = []
+        for state in states:
+            lines = descriptions[id(state)]
+            label = None
+            if lines:
+                label = Label(lines[0])
+                for line in lines[1:]:
+                    label.append_line(line)
+            if label != state.label and not (label is None and state.label is None):
+                state.label = label
+                changed.append(state)
+        return changed
+
+    def _relabel_blocks(self, k, removed, added) -> Optional[EditResult]:
+        """
+        Applies edits that only change transition labels or state descriptions by relabelling the nodes of the
+        removed blocks, which then take over the text of the added blocks.
+        """
+        if len(removed) != len(added):
+            return None
+        updates = []
+        for old, new in zip(removed, added):
+            old_labels, new_labels = [], []
+            shape = _shape(old.expressions, old_labels)
+            if shape is None or shape != _shape(new.expressions, new_labels):
+                return None
+            transitions = [n for n in old.created if isinstance(n, Transition)]
+            if len(transitions) + len(old.descriptions) != len(old_labels):
+                return None
+            updates.append((old, new, transitions, new_labels))
+
+        result = EditResult()
+        described = dict()
+        for old, new, transitions, labels in updates:
+            transitions = iter(transitions)
+            descriptions = iter(old.descriptions)
+            new_descriptions = []
+            for expression, label in zip(_flatten(new.expressions), labels):
+                if expression.__class__.__name__ == "TransitionExpression":
+                    transition = next(transitions)
+                    if (Label(label) if label else None) != transition.label:
+                        transition.label = label or None
+                        result.changed.append(transition)
+                else:
+                    state, _ = next(descriptions)
+                    new_descriptions.append((state, label))
+                    described[id(state)] = state
+            old.descriptions = new_descriptions
+            old.text = new.text
+            old.expressions = new.expressions
+        self._blocks[k:k + len(added)] = removed
+        result.changed.extend(self._relabel(list(described.values())))
+        return result
+
+    def _patch(self, k, removed, added) -> Optional[EditResult]:
+        builder = self._builder
+        statechart = builder.statechart
+
+        # Removed blocks must not have changed nodes of other blocks, nor anything other blocks use
+        for block in removed:
+            if not block.local or block.parent_after is not block.parent_before:
+                return None
+            if any(name in builder.rebound for name in block.names):
+                return None
+            if any(id(node) in builder.displaced for node in block.created):
+                return None
+        kept = self._used(removed)
+        if kept is None:
+            return None
+        kept_names = {node.name for node in kept.values()}
+        # Added blocks must not move or redeclare existing states, nor leak a parallel state's region
+        for block in added:
+            for name, parallel in _declared_names(block.expressions):
+                if parallel or (builder.has_state(name) and name not in kept_names):
+                    return None
+
+        result = EditResult()
+        changed = dict()
+        described = dict()
+
+        for block in removed:
+            for state, _ in block.descriptions:
+                described[id(state)] = state
+            for node in reversed(self._roots(block)):
+                if isinstance(node, Label):
+                    continue
+                if id(node) in kept:
+                    # Keep the state for the blocks using it, but drop everything this block added to it
+                    for child in list(node.children):
+                        if self._owner(child) is block and not isinstance(child, Label):
+                            node.remove_child(child)
+                            result.removed.append(child)
+                    changed[id(node)] = node
+                    continue
+                parent = node.parent
+                parent.remove_child(node)
+                changed[id(parent)] = parent
+                result.removed.append(node)
+            self._unregister(block)
+            for name in block.names:
+                if name not in kept_names:
+                    builder.forget(name)
+        for parent in changed.values():
+            if isinstance(parent, Region) and not parent.children:
+                return None
+        parents = {id(node): node.parent for node in kept.values()}
+        foreign = {id(node): [(n, self._owners[id(n)]) for n in node.iter_contents() if id(n) in self._owners]
+                   for node in kept.values()}
+        pending = dict(kept)
+
+        context = self._built[k - 1].parent_after if k else statechart
+        positions = {id(b): p for p, b in enumerate(self._blocks)}
+        for position, block in enumerate(added, k):
+            builder.consume_block(block, context)
+            if not block.local or any(name in builder.rebound for name in block.lookups):
+                return None
+            # The first added block using a kept state takes it over
+            taken = [node for node in block.refs if pending.pop(id(node), None) is not None]
+            # As well as the states of later blocks it now uses first
+            for node in block.refs:
+                owner = self._owner(node)
+                if positions.get(id(owner), -1) <= position or id(node) in parents:
+                    continue
+                if node not in self._roots(owner) or not self._first_use(node, block):
+                    return None
+                if not self._first_use(node, owner) or node.name not in owner.names:
+                    return None
+                self._release(node, owner)
+                parents[id(node)] = node.parent
+                foreign[id(node)] = [(n, self._owners[id(n)]) for n in node.iter_contents() if id(n) in self._owners]
+                kept[id(node)] = changed[id(node)] = node
+                taken.append(node)
+            for node in taken:
+                if node.parent is not parents[id(node)] or block.contexts[id(node)] is not node.parent:
+                    return None
+                block.created.insert(0, node)
+                block.names.append(node.name)
+            taken_ids = set(map(id, taken))
+            block.refs = [node for node in block.refs if id(node) not in taken_ids]
+            self._register(block)
+            for node in taken:
+                self._owners.update((id(n), owner) for n, owner in foreign[id(node)])
+                self._settle(node, block, positions)
+                for child in list(node.children):
+                    if self._owner(child) is block and not isinstance(child, Label):
+                        if isinstance(child, Transition):
+                            self._place(child, position, positions)
+                        result.added.append(child)
+            for node in block.refs:
+                if positions.get(id(self._owner(node)), -1) >= position:
+                    return None
+            for state, _ in block.descriptions:
+                described[id(state)] = state
+            for node in self._roots(block):
+                if isinstance(node, Label):
+                    continue
+                if isinstance(node, Transition) and self._owner(node.source) is not None:
+                    self._place(node, position, positions)
+                elif isinstance(node, AbstractState):
+                    self._settle(node, block, positions)
+                changed[id(node.parent)] = node.parent
+                result.added.append(node)
+            for region in [n for n in self._subtree(block) if isinstance(n, Region) and not n.children]:
+                region.parent.remove_child(region)
+        # Kept states no added block uses go to the first later block using them
+        later = self._blocks[k + len(added):]
+        for node in pending.values():
+            block = next((b for b in later if any(n is node for n in b.refs)), None)
+            if block is None or not self._first_use(node, block):
+                return None
+            owners = self._foreign(block)
+            self._unregister(block)
+            block.created.insert(0, node)
+            block.names.append(node.name)
+            self._register(block)
+            self._owners.update(owners)
+            self._owners.update((id(n), owner) for n, owner in foreign[id(node)])
+            self._settle(node, block, positions)
+
+        for state in self._relabel([s for s in described.values() if s.root is statechart]):
+            changed[id(state)] = state
+        changed = [n for n in changed.values() if n.root is statechart and not isinstance(n, Statechart)]
+        owners = [(n, self._owner(n)) for n in changed]
+        result.changed = [n for n, owner in owners if owner is not None and (id(n) in kept or owner not in added)]
+        return result
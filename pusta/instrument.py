@@ -0,0 +1,169 @@
+import json
+import os
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+# Net number of memory blocks allocated by the interpreter, not available on every Python implementation
+_allocated_blocks: Callable[[], int] = getattr(sys, "getallocatedblocks", lambda: 0)
+
+_active: Optional['Profiler'] = None
+
+
+class Event(NamedTuple):
+    """
+    A finished phase. start and duration are in nanoseconds since the profiler was created, allocations is the
+    change of the number of allocated memory blocks during the phase.
+    """
+    name: str
+    category: str
+    start: int
+    duration: int
+    allocations: int
+    thread: int
+    args: Optional[dict]
+
+
+class PhaseStats(NamedTuple):
+    category: str
+    name: str
+    count: int
+    seconds: float
+    allocations: int
+
+
+class _NullPhase:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_null_phase = _NullPhase()
+
+
+class _Phase:
+    __slots__ = ('_profiler', '_name', '_category', '_args', '_start', '_blocks')
+
+    def __init__(self, profiler, name, category, args):
+        self._profiler = profiler
+        self._name = name
+        self._category = category
+        self._args = args
+
+    def __enter__(self):
+        self._blocks = _allocated_blocks()
+        self._start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        self._profiler.add(self._name, self._category, self._start, end - self._start,
+                           _allocated_blocks() - self._blocks, self._args)
+        return False
+
+
+class Profiler:
+    """
+    Collects the wall time and allocation count of the phases pusta runs while the profiler is active.
+
+    Activate it with a with statement (or Pusta.profile()). Phases are reported for grammar compilation, reading
+    and parsing, the parse cache, transformation with one phase per consume_<Expression> handler call and
+    remove_empty_regions, and rendering. Nested phases are included in the time of the enclosing phase. Only
+    the calling process is profiled, Pusta.parse_files workers are not.
+
+    callback is called with every finished Event, events=False drops the events after updating the statistics.
+    """
+
+    def __init__(self, callback: Callable[[Event], None] = None, events: bool = True):
+        self.events: List[Event] = []
+        self._callback = callback
+        self._keep_events = events
+        self._stats: Dict[tuple, list] = dict()
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter_ns()
+        self._previous = None
+
+    def __enter__(self):
+        global _active
+        self._previous = _active
+        _active = self
+        return self
+
+    def __exit__(self, *exc):
+        global _active
+        _active = self._previous
+        self._previous = None
+        return False
+
+    def phase(self, name: str, category: str = "pusta", **args):
+        return _Phase(self, name, category, args or None)
+
+    def add(self, name, category, start, duration, allocations, args=None):
+        event = Event(name, category, start - self._origin, duration, allocations, threading.get_ident(), args)
+        with self._lock:
+            stats = self._stats.get((category, name))
+            if stats is None:
+                stats = self._stats[(category, name)] = [0, 0, 0]
+            stats[0] += 1
+            stats[1] += duration
+            stats[2] += allocations
+            if self._keep_events:
+                self.events.append(event)
+        if self._callback is not None:
+            self._callback(event)
+
+    def summary(self) -> List[PhaseStats]:
+        """
+        Statistics per phase, the phases with the most time first.
+        """
+        with self._lock:
+            stats = [PhaseStats(category, name, count, total / 1e9, allocations)
+                     for (category, name), (count, total, allocations) in self._stats.items()]
+        return sorted(stats, key=lambda s: s.seconds, reverse=True)
+
+    def report(self, stream=None):
+        stream = stream or sys.stdout
+        stream.write(f"{'phase':<48} {'count':>8} {'total ms':>12} {'blocks':>10}\n")
+        for s in self.summary():
+            stream.write(f"{s.category + ':' + s.name:<48} {s.count:>8} {s.seconds * 1e3:>12.3f} {s.allocations:>10}\n")
+
+    def chrome_trace(self) -> dict:
+        """
+        The events in the Chrome trace event format, loadable in chrome://tracing or Perfetto.
+        """
+        pid = os.getpid()
+        events = []
+        for e in self.events:
+            args = dict(e.args or {}, allocations=e.allocations)
+            events.append(dict(name=e.name, cat=e.category, ph="X", ts=e.start / 1e3, dur=e.duration / 1e3,
+                               pid=pid, tid=e.thread, args=args))
+        return dict(traceEvents=events, displayTimeUnit="ms")
+
+    def write_chrome_trace(self, file):
+        """
+        Writes chrome_trace() as JSON to file, a path or a text stream.
+        """
+        if isinstance(file, (str, os.PathLike)):
+            with open(file, "w") as f:
+                json.dump(self.chrome_trace(), f)
+        else:
+            json.dump(self.chrome_trace(), file)
+
+
+def active() -> Optional[Profiler]:
+    return _active
+
+
+def phase(name: str, category: str = "pusta", **args):
+    """
+    Context manager timing a phase with the active profiler, does nothing if none is active.
+    """
+    profiler = _active
+    if profiler is None:
+        return _null_phase
+    return profiler.phase(name, category, **args)
@@ -0,0 +1,267 @@
+import os
+import re
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+
+_directives = re.compile(r'^[\t ]*!', re.MULTILINE)
+_directives_bytes = re.compile(rb'^[\t ]*!', re.MULTILINE)
+_directive = re.compile(r'[\t ]*!(\w+)[\t ]*(.*?)[\t ]*$')
+_define = re.compile(r'(\w+)(?:\(([^)]*)\))?(?:[\t ]+(.*))?$')
+_start = re.compile(r'[\t ]*@startuml\b')
+_end = re.compile(r'[\t ]*@enduml\b')
+
+# Passes over a line to expand macros used in the replacement of other macros
+MAX_EXPANSIONS = 16
+
+
+class PreprocessorError(ValueError):
+    def __init__(self, message, path=None, line=None):
+        super().__init__(f"{path or '<string>'}:{line}: {message}" if line else message)
+        self.path = path
+        self.line = line
+
+
+def has_directives(text) -> bool:
+    """
+    Whether text (a str, or a buffer of UTF-8 encoded text) contains preprocessor directives.
+    """
+    pattern = _directives if isinstance(text, str) else _directives_bytes
+    return pattern.search(text) is not None
+
+
+class _Source:
+    """
+    A file read and split into lines once: the lines between @startuml and @enduml (or all lines if it has none)
+    and the line ranges of its !startsub sections.
+    """
+    __slots__ = ('path', 'stamp', 'lines', 'first', 'subs')
+
+    def __init__(self, path: str, stamp, text: str, diagram: bool):
+        self.path = path
+        self.stamp = stamp
+        self.lines = text.splitlines()
+        # Number of the first line in the file
+        self.first = 1
+        if not diagram:
+            start = next((i for i, line in enumerate(self.lines) if _start.match(line)), None)
+            if start is not None:
+                end = next((i for i in range(start + 1, len(self.lines)) if _end.match(self.lines[i])),
+                           len(self.lines))
+                self.lines = self.lines[start + 1:end]
+                self.first = start + 2
+        self.subs: Dict[str, Tuple[int, int]] = dict()
+        open_subs = dict()
+        for i, line in enumerate(self.lines):
+            m = _directive.match(line)
+            if m and m.group(1) == "startsub":
+                open_subs[m.group(2)] = i + 1
+            elif m and m.group(1) == "endsub":
+                if not open_subs:
+                    raise PreprocessorError("!endsub without !startsub", path, self.first + i)
+                name, start = open_subs.popitem()
+                self.subs[name] = (start, i)
+        if open_subs:
+            raise PreprocessorError(f"!startsub {next(iter(open_subs))} without !endsub", path)
+
+
+class _Macro:
+    __slots__ = ('parameters', 'body')
+
+    def __init__(self, parameters: Optional[List[str]], body: str):
+        self.parameters = parameters
+        self.body = body
+
+
+class Preprocessor:
+    """
+    Resolves the preprocessor directives of PlantUML diagrams before parsing.
+
+    Supported are !include file and !include_once file (the part of the file between @startuml and @enduml,
+    or all of it), !includesub file!NAME (the lines between !startsub NAME and !endsub), !define NAME value,
+    !define NAME(a, b) body and !undef NAME. Macros are replaced as whole words in the lines after their
+    definition, including included lines. Relative includes are resolved against the including file, then
+    against include_path.
+
+    Every file is read once and reused for all diagrams processed with the preprocessor as long as its
+    modification time and size do not change. The includes of every processed diagram are recorded, see
+    dependencies and dependents. Diagrams can be processed from several threads at once.
+    """
+
+    def __init__(self, include_path=()):
+        self._include_path = [os.path.abspath(p) for p in include_path]
+        # Guards _sources, _includes and reads, files are read and expanded outside of it
+        self._lock = threading.Lock()
+        self._sources: Dict[str, _Source] = dict()
+        self._includes: Dict[str, Set[str]] = dict()
+        self.reads = 0
+
+    def process_file(self, path) -> str:
+        path = os.path.abspath(path)
+        return self._process(self._load(path, diagram=True), path)
+
+    def process_text(self, text: str, path=None) -> str:
+        """
+        Preprocesses text, the diagram read from path if given (includes are then relative to it and recorded).
+        """
+        if path is not None:
+            path = os.path.abspath(path)
+        return self._process(_Source(path, None, text, diagram=True), path)
+
+    def _process(self, source: _Source, root: Optional[str]) -> str:
+        state = _Expansion()
+        self._expand(source, 0, len(source.lines), state)
+        if root is not None:
+            with self._lock:
+                self._includes[root] = state.included
+        return "\n".join(state.output) + "\n"
+
+    def _load(self, path: str, diagram: bool = False) -> _Source:
+        try:
+            st = os.stat(path)
+        except OSError as e:
+            raise PreprocessorError(f"Can not read {path}: {e.strerror}") from e
+        stamp = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            source = self._sources.get(path)
+        if source is None or source.stamp != stamp or diagram:
+            with open(path, encoding='utf-8', newline='') as f:
+                text = f.read()
+            source = _Source(path, stamp, text, diagram)
+            with self._lock:
+                self.reads += 1
+                if not diagram:
+                    self._sources[path] = source
+        return source
+
+    def _resolve(self, name: str, source: _Source, number: int) -> str:
+        directory = os.path.dirname(source.path) if source.path else os.getcwd()
+        for base in [directory] + self._include_path:
+            path = os.path.abspath(os.path.join(base, name))
+            if os.path.isfile(path):
+                return path
+        raise PreprocessorError(f"Included file {name} not found", source.path, number)
+
+    def _expand(self, source: _Source, start: int, stop: int, state: '_Expansion'):
+        if source.path in state.stack:
+            raise PreprocessorError(f"Include cycle: {' -> '.join(state.stack + [source.path])}")
+        state.stack.append(source.path)
+        for i in range(start, stop):
+            line = source.lines[i]
+            number = source.first + i
+            m = _directive.match(line)
+            if m is None:
+                state.output.append(state.substitute(line) if state.macros else line)
+                continue
+            directive, argument = m.groups()
+            if directive in ("include", "include_once", "includesub"):
+                name, _, sub = argument.partition("!")
+                path = self._resolve(state.substitute(name.strip()), source, number)
+                if directive == "include_once" and path in state.included:
+                    continue
+                state.included.add(path)
+                included = self._load(path)
+                if directive == "includesub":
+                    if sub not in included.subs:
+                        raise PreprocessorError(f"{path} has no sub {sub}", source.path, number)
+                    self._expand(included, *included.subs[sub], state)
+                else:
+                    self._expand(included, 0, len(included.lines), state)
+            elif directive == "define":
+                d = _define.match(argument)
+                if d is None:
+                    raise PreprocessorError(f"Invalid !define {argument}", source.path, number)
+                name, parameters, body = d.groups()
+                if parameters is not None:
+                    parameters = [p.strip() for p in parameters.split(",") if p.strip()]
+                state.define(name, _Macro(parameters, body or ""))
+            elif directive == "undef":
+                state.define(argument, None)
+            elif directive not in ("startsub", "endsub"):
+                raise PreprocessorError(f"Unsupported directive !{directive}", source.path, number)
+        state.stack.pop()
+
+    def dependencies(self, path) -> Set[str]:
+        """
+        The files included, directly or not, by the diagram at path when it was last processed.
+        """
+        path = os.path.abspath(path)
+        with self._lock:
+            return set(self._includes.get(path, ()))
+
+    def dependents(self, path) -> Set[str]:
+        """
+        The processed diagrams that include the file at path, directly or not.
+        """
+        path = os.path.abspath(path)
+        with self._lock:
+            return self._dependents(path)
+
+    def _dependents(self, path: str) -> Set[str]:
+        return {root for root, included in self._includes.items() if path in included}
+
+    def invalidate(self, path) -> Set[str]:
+        """
+        Forgets the content of a changed file and returns the diagrams to process again: its dependents and the
+        file itself if it is a processed diagram.
+        """
+        path = os.path.abspath(path)
+        with self._lock:
+            self._sources.pop(path, None)
+            affected = self._dependents(path)
+            if path in self._includes:
+                affected.add(path)
+        return affected
+
+    def forget(self, path):
+        """
+        Drops the recorded includes of a removed diagram.
+        """
+        path = os.path.abspath(path)
+        with self._lock:
+            self._includes.pop(path, None)
+
+
+class _Expansion:
+    """
+    State of preprocessing one diagram.
+    """
+
+    def __init__(self):
+        self.output: List[str] = []
+        self.stack: List[Optional[str]] = []
+        self.included: Set[str] = set()
+        self.macros: Dict[str, _Macro] = dict()
+        self._pattern = None
+
+    def define(self, name, macro: Optional[_Macro]):
+        if macro is None:
+            self.macros.pop(name, None)
+        else:
+            self.macros[name] = macro
+        self._pattern = None
+
+    def substitute(self, line: str) -> str:
+        if not self.macros:
+            return line
+        if self._pattern is None:
+            names = "|".join(sorted(map(re.escape, self.macros), key=len, reverse=True))
+            self._pattern = re.compile(rf'\b({names})\b(?:\(([^()]*)\))?')
+        for _ in range(MAX_EXPANSIONS):
+            expanded = self._pattern.sub(self._replace, line)
+            if expanded == line:
+                break
+            line = expanded
+        return line
+
+    def _replace(self, m) -> str:
+        macro = self.macros[m.group(1)]
+        if macro.parameters is None:
+            # An object-like macro followed by parentheses keeps them
+            return macro.body + (f"({m.group(2)})" if m.group(2) is not None else "")
+        if m.group(2) is None:
+            return m.group(0)
+        arguments = [a.strip() for a in m.group(2).split(",")] if m.group(2).strip() else []
+        values = dict(zip(macro.parameters, arguments + [""] * (len(macro.parameters) - len(arguments))))
+        if not values:
+            return macro.body
+        return re.sub(rf'\b({"|".join(map(re.escape, values))})\b', lambda p: values[p.group(1)], macro.body)
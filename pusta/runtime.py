@@ -0,0 +1,482 @@
+import re
+from typing import Dict, List, Optional, Tuple
+
+from pusta.statechart import *
+
+STATE = 0
+INITIAL = 1
+FINAL = 2
+HISTORY = 3
+DEEP_HISTORY = 4
+CHOICE = 5
+FORK = 6
+ENTRY = 7
+EXIT = 8
+
+_kinds = [
+    (InitialState, INITIAL),
+    (FinalState, FINAL),
+    (DeepHistoryState, DEEP_HISTORY),
+    (HistoryState, HISTORY),
+    (Choice, CHOICE),
+    (Fork, FORK),
+    (EntryPoint, ENTRY),
+    (ExitPoint, EXIT),
+    (AbstractState, STATE),
+]
+
+COMPLETION = -1
+
+_label_re = re.compile(r'^(?P<event>[^\[/]*?)\s*(?:\[(?P<guard>[^\]]*)\])?\s*(?:/\s*(?P<action>.*?))?\s*$', re.DOTALL)
+
+
+class Binding:
+    def __init__(self, event: Optional[str] = None, guard=None, action=None):
+        self.event = event
+        self.guard = guard
+        self.action = action
+
+    def __repr__(self):
+        return f"Binding(event={self.event!r}, guard={self.guard!r}, action={self.action!r})"
+
+
+def parse_label(label: Optional[str]) -> Binding:
+    """
+    Default label binding, reading labels as UML transition specifications: "event [guard] / action".
+
+    All three parts are optional, a transition without event is a completion transition.
+    """
+    if not label:
+        return Binding()
+    m = _label_re.match(label.strip())
+    if not m:
+        return Binding(label.strip())
+    return Binding(m.group('event') or None, m.group('guard'), m.group('action'))
+
+
+class CompiledStatechart:
+    """
+    Flat, integer indexed tables of a Statechart.
+
+    Vertices (states and pseudo states) and regions are numbered in tree order, region 0 is the top level of the
+    statechart. Transitions are indexed by (source vertex, event id) in `table`.
+    """
+
+    def __init__(self, statechart: Statechart, binder=parse_label):
+        self.names: List[str] = []
+        self.kinds: List[int] = []
+        self.region_of: List[int] = []
+        self.regions_of: List[Tuple[int, ...]] = []
+        self.depth: List[int] = []
+        self.region_names: List[str] = []
+        self.region_parent: List[int] = []
+        self.region_depth: List[int] = []
+        self.region_initial: List[int] = []
+        self.region_history: List[int] = []
+        self.region_deep_history: List[int] = []
+        self.t_source: List[int] = []
+        self.t_target: List[int] = []
+        self.t_event: List[int] = []
+        self.t_guard: List = []
+        self.t_action: List = []
+        self.events: Dict[str, int] = dict()
+        self.event_names: List[str] = []
+        self.outgoing: List[Tuple[int, ...]] = []
+        self.incoming: List[Tuple[int, ...]] = []
+        self.table: Dict[Tuple[int, int], Tuple[int, ...]] = dict()
+        self.vertices: Dict[str, int] = dict()
+
+        ids: Dict[int, int] = dict()
+        transitions = []
+        self._add_region(statechart, "", -1, 0, ids, transitions)
+
+        for t in transitions:
+            binding = binder(t.label._label if t.label else None)
+            if binding.event is None:
+                event = COMPLETION
+            else:
+                event = self.events.setdefault(binding.event, len(self.events))
+                if event == len(self.event_names):
+                    self.event_names.append(binding.event)
+            if id(t.destination) not in ids:
+                raise ValueError(f"Destination {t.destination.fqn()} of {t.parent.fqn()} is not part of the statechart")
+            self.t_source.append(ids[id(t.parent)])
+            self.t_target.append(ids[id(t.destination)])
+            self.t_event.append(event)
+            self.t_guard.append(binding.guard)
+            self.t_action.append(binding.action)
+
+        outgoing = [[] for _ in self.names]
+        incoming = [[] for _ in self.names]
+        for i, (src, dst, event) in enumerate(zip(self.t_source, self.t_target, self.t_event)):
+            outgoing[src].append(i)
+            incoming[dst].append(i)
+            self.table.setdefault((src, event), ())
+            self.table[(src, event)] += (i,)
+        self.outgoing = [tuple(o) for o in outgoing]
+        self.incoming = [tuple(i) for i in incoming]
+
+        # Regions are numbered after the region of their parent state, vertices share the chain of their region
+        chains = []
+        for region, parent in enumerate(self.region_parent):
+            chains.append((region,) + chains[self.region_of[parent]] if parent >= 0 else (region,))
+        chain_sets = [frozenset(c) for c in chains]
+        self.region_chain = [chains[r] for r in self.region_of]
+        self.region_chain_sets = [chain_sets[r] for r in self.region_of]
+        self.domains = [self._domain(t) for t in range(len(self.t_source))]
+
+    def _add_region(self, container, name, parent, depth, ids, transitions):
+        region = len(self.region_names)
+        self.region_names.append(name)
+        self.region_parent.append(parent)
+        self.region_depth.append(depth)
+        self.region_initial.append(-1)
+        self.region_history.append(-1)
+        self.region_deep_history.append(-1)
+
+        states = container.get_states()
+        for state in states:
+            v = len(self.names)
+            ids[id(state)] = v
+            kind = next(k for cls, k in _kinds if isinstance(state, cls))
+            self.names.append(state.fqn())
+            self.vertices[state.fqn()] = v
+            self.kinds.append(kind)
+            self.region_of.append(region)
+            self.regions_of.append(())
+            self.depth.append(depth)
+            if kind == INITIAL:
+                self.region_initial[region] = v
+            elif kind == HISTORY:
+                self.region_history[region] = v
+            elif kind == DEEP_HISTORY:
+                self.region_deep_history[region] = v
+            transitions.extend(state.get_transitions())
+
+        for state in states:
+            v = ids[id(state)]
+            self.regions_of[v] = tuple(self._add_region(r, r.fqn(), v, depth + 1, ids, transitions)
+                                       for r in state.get_regions())
+        return region
+
+    def _domain(self, t):
+        target_regions = self.region_chain_sets[self.t_target[t]]
+        return next(r for r in self.region_chain[self.t_source[t]] if r in target_regions)
+
+    def vertex(self, name: str) -> int:
+        return self.vertices[name]
+
+    def event(self, name: str) -> Optional[int]:
+        return self.events.get(name)
+
+    def is_join(self, v):
+        return self.kinds[v] == FORK and len(self.incoming[v]) > 1
+
+
+def compile_statechart(statechart: Statechart, binder=parse_label) -> CompiledStatechart:
+    return CompiledStatechart(statechart, binder)
+
+
+def _always(guard, event, payload):
+    return True
+
+
+class Machine:
+    """
+    Run-to-completion interpreter of a CompiledStatechart.
+
+    guard(guard, event, payload) decides guarded transitions ("else" guards are taken when no other guard of a
+    choice or of a state for the event holds), action(action, event, payload) is called for every transition
+    with an action. Transitions without event are completion transitions: they fire as soon as their simple
+    source state is entered, or once all regions of a composite source state reached a final state. Among
+    active states the innermost fire first, states of the same depth in tree order.
+    """
+
+    max_steps = 10000
+
+    def __init__(self, compiled: CompiledStatechart, guard=None, action=None):
+        self._chart = compiled
+        self._guard = guard or _always
+        self._action = action
+        self._active = set()
+        self._key = frozenset()
+        self._history: Dict[int, Tuple[Tuple[int, ...], Tuple[int, ...]]] = dict()
+        self._lookup: Dict[Tuple[frozenset, int], Tuple[Tuple[int, Tuple[int, ...]], ...]] = dict()
+        self._steps: Dict[Tuple[frozenset, int], Tuple[frozenset, bool]] = dict()
+        self._pure = True
+        self._event = None
+        self._payload = None
+
+    @property
+    def compiled(self) -> CompiledStatechart:
+        return self._chart
+
+    @property
+    def configuration(self):
+        return {self._chart.names[v] for v in self._active}
+
+    @property
+    def active_vertices(self) -> frozenset:
+        return self._key
+
+    def is_active(self, name: str) -> bool:
+        return self._chart.vertices.get(name) in self._active
+
+    @property
+    def finished(self) -> bool:
+        final = [v for v in self._active if self._chart.region_of[v] == 0]
+        return bool(final) and all(self._chart.kinds[v] == FINAL for v in final)
+
+    def start(self):
+        self._active.clear()
+        self._history.clear()
+        self._default_entry(0)
+        self._commit()
+        self._complete()
+        return self
+
+    def snapshot(self):
+        return self._key, tuple(sorted(self._history.items()))
+
+    def restore(self, snapshot):
+        key, history = snapshot
+        self._active = set(key)
+        self._key = key
+        self._history = dict(history)
+
+    def dispatch(self, event: str, payload=None) -> bool:
+        eid = self._chart.events.get(event)
+        if eid is None:
+            return False
+        key = (self._key, eid)
+        step = self._steps.get(key)
+        if step is not None:
+            if step[0] is not self._key:
+                self._key = step[0]
+                self._active = set(step[0])
+            return step[1]
+
+        self._event = event
+        self._payload = payload
+        self._pure = True
+        fired = self._step(eid)
+        if fired:
+            self._complete()
+        if self._pure:
+            # Neither guards, actions nor history were involved, the step only depends on the configuration
+            self._steps[key] = (self._key, fired)
+        return fired
+
+    def _commit(self):
+        self._key = frozenset(self._active)
+
+    def _candidates(self, eid):
+        key = (self._key, eid)
+        candidates = self._lookup.get(key)
+        if candidates is None:
+            chart = self._chart
+            # Innermost states first, states of the same depth in tree order
+            ordered = sorted(self._active, key=lambda v: (-chart.depth[v], v))
+            candidates = tuple((v, chart.table[(v, eid)]) for v in ordered if (v, eid) in chart.table)
+            self._lookup[key] = candidates
+        return candidates
+
+    def _step(self, eid):
+        candidates = self._candidates(eid)
+        if not candidates:
+            return False
+        chart = self._chart
+        fired = False
+        blocked = set()
+        for v, transitions in candidates:
+            if v in blocked or v not in self._active:
+                continue
+            if eid == COMPLETION and not self._is_complete(v):
+                continue
+            otherwise = None
+            for t in transitions:
+                if chart.t_guard[t] == "else":
+                    otherwise = t
+                elif self._enabled(t):
+                    break
+            else:
+                if otherwise is None or not self._enabled(otherwise):
+                    continue
+                t = otherwise
+            self._fire(t)
+            fired = True
+            region = chart.region_of[v]
+            while region > 0:
+                parent = chart.region_parent[region]
+                blocked.add(parent)
+                region = chart.region_of[parent]
+        if fired:
+            self._commit()
+        return fired
+
+    def _complete(self):
+        for _ in range(self.max_steps):
+            self._event = None
+            self._payload = None
+            if not self._step(COMPLETION):
+                return
+        raise RuntimeError(f"No stable configuration reached after {self.max_steps} completion steps")
+
+    def _is_complete(self, v):
+        chart = self._chart
+        regions = chart.regions_of[v]
+        if not regions:
+            return True
+        finals = {chart.region_of[a] for a in self._active if chart.kinds[a] == FINAL}
+        return all(r in finals for r in regions)
+
+    def _enabled(self, t):
+        chart = self._chart
+        guard = chart.t_guard[t]
+        if guard is not None and guard != "else":
+            self._pure = False
+            if not self._guard(guard, self._event, self._payload):
+                return False
+        target = chart.t_target[t]
+        if chart.is_join(target):
+            return all(chart.t_source[i] in self._active for i in chart.incoming[target])
+        return True
+
+    def _select(self, transitions):
+        chart = self._chart
+        otherwise = None
+        for t in transitions:
+            if chart.t_guard[t] == "else":
+                otherwise = t
+            elif self._enabled(t):
+                return t
+        if otherwise is None:
+            raise RuntimeError(f"No enabled transition in {[chart.names[chart.t_source[t]] for t in transitions]}")
+        return otherwise
+
+    def _fire(self, t):
+        chart = self._chart
+        self._exit(chart.domains[t])
+        if chart.t_action[t] is not None and self._action:
+            self._pure = False
+            self._action(chart.t_action[t], self._event, self._payload)
+        self._enter(chart.domains[t], [chart.t_target[t]])
+
+    def _exit(self, domain):
+        chart = self._chart
+        exited = sorted(a for a in self._active if domain in chart.region_chain_sets[a])
+        if not exited:
+            return
+        for a in exited:
+            for r in chart.regions_of[a]:
+                if chart.region_history[r] >= 0 or chart.region_deep_history[r] >= 0:
+                    shallow = tuple(x for x in exited if chart.region_of[x] == r)
+                    deep = tuple(x for x in exited if r in chart.region_chain_sets[x])
+                    self._history[r] = (shallow, deep)
+                    self._pure = False
+        self._active.difference_update(exited)
+
+    def _enter(self, domain, targets):
+        chart = self._chart
+        # Vertices in the order they are reached from the targets
+        explicit = dict()
+        explicit_regions = set()
+        for target in targets:
+            v = target
+            while v >= 0:
+                region = chart.region_of[v]
+                explicit[v] = None
+                explicit_regions.add(region)
+                if region == domain:
+                    break
+                v = chart.region_parent[region]
+            else:
+                raise RuntimeError(f"{chart.names[target]} is not inside region {chart.region_names[domain]}")
+
+        for v in sorted(explicit, key=lambda x: chart.depth[x]):
+            kind = chart.kinds[v]
+            if kind in (STATE, FINAL):
+                self._active.add(v)
+                for r in chart.regions_of[v]:
+                    if r not in explicit_regions:
+                        self._default_entry(r)
+            else:
+                self._enter_pseudo_state(v)
+
+    def _enter_pseudo_state(self, v):
+        chart = self._chart
+        kind = chart.kinds[v]
+        region = chart.region_of[v]
+        if kind in (HISTORY, DEEP_HISTORY):
+            self._pure = False
+            shallow, deep = self._history.get(region, ((), ()))
+            if shallow:
+                self._enter(region, list(deep) if kind == DEEP_HISTORY else list(shallow))
+            elif chart.outgoing[v]:
+                self._fire(self._select(chart.outgoing[v]))
+            else:
+                self._default_entry(region)
+        elif kind == FORK:
+            transitions = chart.outgoing[v]
+            for t in transitions:
+                if chart.t_action[t] is not None and self._action:
+                    self._pure = False
+                    self._action(chart.t_action[t], self._event, self._payload)
+            if transitions:
+                domain = min((chart.domains[t] for t in transitions), key=lambda r: chart.region_depth[r])
+                self._exit(domain)
+                self._enter(domain, [chart.t_target[t] for t in transitions])
+        elif chart.outgoing[v]:
+            self._fire(self._select(chart.outgoing[v]))
+
+    def _default_entry(self, region):
+        initial = self._chart.region_initial[region]
+        if initial >= 0 and self._chart.outgoing[initial]:
+            self._fire(self._select(self._chart.outgoing[initial]))
+
+
+class FlatStatechart:
+    """
+    Statechart flattened into its reachable configurations.
+
+    transitions[c][e] is the configuration reached from configuration c on event e, configurations that ignore an
+    event map to themselves. Guards are decided once during flattening, so only charts whose guards do not depend
+    on event payloads flatten faithfully.
+    """
+
+    def __init__(self, event_names, configurations, transitions, initial=0):
+        self.event_names: List[str] = event_names
+        self.configurations: List[frozenset] = configurations
+        self.transitions: List[List[int]] = transitions
+        self.initial = initial
+
+    def event(self, name: str) -> int:
+        return self.event_names.index(name)
+
+    def configuration_names(self, index) -> List[str]:
+        return sorted(self.configurations[index])
+
+
+def flatten(compiled: CompiledStatechart, guard=None, max_configurations=100000) -> FlatStatechart:
+    m = Machine(compiled, guard).start()
+    snapshots = [m.snapshot()]
+    ids = {snapshots[0]: 0}
+    configurations = [frozenset(m.configuration)]
+    transitions = []
+    i = 0
+    while i < len(snapshots):
+        row = []
+        for event in compiled.event_names:
+            m.restore(snapshots[i])
+            m.dispatch(event)
+            snapshot = m.snapshot()
+            if snapshot not in ids:
+                if len(snapshots) >= max_configurations:
+                    raise ValueError(f"Statechart has more than {max_configurations} reachable configurations")
+                ids[snapshot] = len(snapshots)
+                snapshots.append(snapshot)
+                configurations.append(frozenset(m.configuration))
+            row.append(ids[snapshot])
+        transitions.append(row)
+        i += 1
+    return FlatStatechart(list(compiled.event_names), configurations, transitions)
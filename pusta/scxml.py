@@ -0,0 +1,156 @@
+from xml.sax.saxutils import XMLGenerator
+
+from pusta.runtime import parse_label
+from pusta.statechart import *
+
+SCXML_NAMESPACE = "http://www.w3.org/2005/07/scxml"
+
+
+class ScxmlWriter:
+    """
+    Writes a Statechart as SCXML in a single walk over the model.
+
+    Elements are emitted through an incremental XML generator straight into the stream, no document tree is
+    built. Mapping:
+
+    - State without regions: <state>, with one region: <state> holding the region's contents,
+      with several regions: <parallel> holding one <state> per region
+    - InitialState: <initial> of the enclosing state, or the initial attribute of <scxml>
+    - FinalState: <final>, HistoryState/DeepHistoryState: <history type="shallow|deep">
+    - Choice, EntryPoint, ExitPoint: <state> with eventless transitions, guards become cond attributes and an
+      "else" guard is emitted last
+    - Fork: <state> with a single eventless transition to all targets
+    """
+
+    def __init__(self, stream, binder=parse_label, indent="  "):
+        self._out = XMLGenerator(stream, encoding="utf-8", short_empty_elements=True)
+        self._binder = binder
+        self._indent = indent
+        self._depth = 0
+        self._open = False
+
+    def write(self, statechart: Statechart, name: str = None):
+        attrs = {"xmlns": SCXML_NAMESPACE, "version": "1.0"}
+        initial = statechart.initial_state
+        if initial and initial.get_transitions():
+            attrs["initial"] = initial.get_transitions()[0].destination.fqn()
+        if name:
+            attrs["name"] = name
+        self._out.startDocument()
+        self._start("scxml", attrs)
+        for state in statechart.get_states():
+            self._write_state(state)
+        self._end("scxml")
+        self._out.ignorableWhitespace("\n")
+        self._out.endDocument()
+
+    def _newline(self):
+        if self._indent is not None:
+            self._out.ignorableWhitespace("\n" + self._indent * self._depth)
+
+    def _start(self, tag, attrs=None):
+        if self._depth or self._open:
+            self._newline()
+        self._out.startElement(tag, attrs or {})
+        self._depth += 1
+        self._open = True
+
+    def _end(self, tag, inline=False):
+        self._depth -= 1
+        if not inline:
+            self._newline()
+        self._out.endElement(tag)
+
+    def _empty(self, tag, attrs):
+        self._newline()
+        self._out.startElement(tag, attrs)
+        self._out.endElement(tag)
+
+    def _write_state(self, state: AbstractState):
+        if isinstance(state, InitialState):
+            return
+        if isinstance(state, FinalState):
+            self._empty("final", {"id": state.fqn()})
+        elif isinstance(state, HistoryState):
+            self._write_history(state, "shallow")
+        elif isinstance(state, DeepHistoryState):
+            self._write_history(state, "deep")
+        elif isinstance(state, Fork):
+            self._start("state", {"id": state.fqn()})
+            targets = [t.destination.fqn() for t in state.get_transitions()]
+            if targets:
+                self._empty("transition", {"target": " ".join(targets)})
+            self._end("state")
+        else:
+            self._write_compound_state(state)
+
+    def _write_history(self, state, history_type):
+        transitions = state.get_transitions()
+        if not transitions:
+            self._empty("history", {"id": state.fqn(), "type": history_type})
+            return
+        self._start("history", {"id": state.fqn(), "type": history_type})
+        self._write_transition(transitions[0])
+        self._end("history")
+
+    def _write_compound_state(self, state):
+        regions = state.get_regions()
+        if len(regions) > 1:
+            self._start("parallel", {"id": state.fqn()})
+            for region in regions:
+                self._start("state", {"id": region.fqn()})
+                self._write_region(region)
+                self._end("state")
+            self._write_transitions(state)
+            self._end("parallel")
+        elif regions or state.get_transitions():
+            self._start("state", {"id": state.fqn()})
+            for region in regions:
+                self._write_region(region)
+            self._write_transitions(state)
+            self._end("state")
+        else:
+            self._empty("state", {"id": state.fqn()})
+
+    def _write_region(self, region: Region):
+        initial = region.initial_state
+        if initial and initial.get_transitions():
+            self._start("initial")
+            self._write_transition(initial.get_transitions()[0])
+            self._end("initial")
+        for state in region.get_states():
+            self._write_state(state)
+
+    def _write_transitions(self, state):
+        transitions = state.get_transitions()
+        otherwise = []
+        for t in transitions:
+            if self._bind(t).guard == "else":
+                otherwise.append(t)
+            else:
+                self._write_transition(t)
+        for t in otherwise:
+            self._write_transition(t)
+
+    def _bind(self, transition):
+        return self._binder(transition.label._label if transition.label else None)
+
+    def _write_transition(self, transition: Transition):
+        binding = self._bind(transition)
+        attrs = {"target": transition.destination.fqn()}
+        if binding.event:
+            attrs["event"] = binding.event
+        if binding.guard and binding.guard != "else":
+            attrs["cond"] = binding.guard
+        if not binding.action:
+            self._empty("transition", attrs)
+            return
+        self._start("transition", attrs)
+        self._start("script")
+        self._out.characters(binding.action)
+        self._end("script", inline=True)
+        self._end("transition")
+
+
+def write_scxml(statechart: Statechart, stream, name: str = None, binder=parse_label):
+    ScxmlWriter(stream, binder).write(statechart, name)
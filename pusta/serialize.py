@@ -0,0 +1,343 @@
+import struct
+import sys
+from array import array
+from typing import Dict, List, Optional
+
+from pusta.statechart import *
+from pusta.statechart import _no_children
+
+# Format:
+#   header      magic, version, string count, node count
+#   offsets     uint32[strings + 1], end offsets of the strings in the string data
+#   parent      int32[nodes], index of the parent node, -1 for the root
+#   string      int32[nodes], index of the name (named nodes) or text (labels), -1 for none
+#   source      int32[nodes], index of the source of a transition, -1 for none
+#   destination int32[nodes], index of the destination of a transition, -1 for none
+#   kind        uint8[nodes], index of the node class in _classes
+#   role        uint8[nodes], _ROLE_* of the node in its parent
+#   string data UTF-8
+# Nodes are stored in pre-order starting with the Statechart, so parents precede their children and children
+# are stored in order. All integers are little-endian.
+_magic = b'PSC\x00'
+_version = 1
+_header = struct.Struct('<4sBxxxII')
+
+# Serializable node classes, the index is stored: only append
+_classes = (Statechart, Region, State, Choice, Fork, EntryPoint, ExitPoint, InitialState, FinalState, HistoryState,
+            DeepHistoryState, Transition, Label)
+_kinds: Dict[type, int] = {cls: kind for kind, cls in enumerate(_classes)}
+
+_ROLE_NONE = 0
+_ROLE_LABEL = 1
+_ROLE_INITIAL = 2
+_ROLE_FINAL = 3
+_ROLE_HISTORY = 4
+_ROLE_DEEP_HISTORY = 5
+
+# Parent attribute referencing a node with the role
+_role_attributes = (None, '_label', '_initial_state', '_final_state', '_history_state', '_deep_history_state')
+
+# How the fields of a node of each class are filled in when it is materialized
+_STATECHART, _REGION, _STATE, _TRANSITION, _LABEL = range(5)
+_shapes = tuple(_STATECHART if cls is Statechart else _REGION if cls is Region else _TRANSITION if cls is Transition
+                else _LABEL if cls is Label else _STATE for cls in _classes)
+
+
+# Role a node of a class can have in its parent
+_class_roles = {Label: _ROLE_LABEL, InitialState: _ROLE_INITIAL, FinalState: _ROLE_FINAL,
+                HistoryState: _ROLE_HISTORY, DeepHistoryState: _ROLE_DEEP_HISTORY}
+
+
+def dumps(statechart: Statechart) -> bytes:
+    """
+    Serializes a statechart into a flat node table with interned strings, see StatechartTable.
+    """
+    nodes = [statechart]
+    nodes.extend(statechart.iter_contents())
+    indices = {id(node): i for i, node in enumerate(nodes)}
+    strings: Dict[str, int] = dict()
+
+    def intern(s):
+        if s is None:
+            return -1
+        if not isinstance(s, str):
+            raise TypeError(f"Can not serialize {s!r}, expected a string")
+        index = strings.get(s)
+        if index is None:
+            index = strings[s] = len(strings)
+        return index
+
+    def index(node):
+        return -1 if node is None else indices[id(node)]
+
+    count = len(nodes)
+    parent = array('i', [-1]) * count
+    string = array('i', [-1]) * count
+    source = array('i', [-1]) * count
+    destination = array('i', [-1]) * count
+    kind = array('B', [0]) * count
+    role = array('B', [_ROLE_NONE]) * count
+    for i, node in enumerate(nodes):
+        cls = node.__class__
+        k = _kinds.get(cls)
+        if k is None:
+            raise TypeError(f"Can not serialize nodes of type {cls.__name__}")
+        kind[i] = k
+        if node._parent is not None:
+            parent[i] = indices[id(node._parent)]
+            r = _class_roles.get(cls)
+            if r is not None and getattr(node._parent, _role_attributes[r], None) is node:
+                role[i] = r
+        if cls is Label:
+            string[i] = intern(node._label)
+        elif cls is Transition:
+            source[i] = index(node._src)
+            destination[i] = index(node._dst)
+        elif cls is not Statechart:
+            string[i] = intern(node._name)
+    if kind[0] != _kinds[Statechart]:
+        raise TypeError(f"Can not serialize {statechart!r}, expected a Statechart")
+
+    encoded = [s.encode('utf-8') for s in strings]
+    offsets = array('I', [0]) * (len(encoded) + 1)
+    end = 0
+    for i, s in enumerate(encoded):
+        end += len(s)
+        offsets[i + 1] = end
+    columns = [offsets, parent, string, source, destination]
+    if sys.byteorder == 'big':
+        for column in columns:
+            column.byteswap()
+    parts = [_header.pack(_magic, _version, len(encoded), count)]
+    parts.extend(column.tobytes() for column in columns)
+    parts.extend((kind.tobytes(), role.tobytes()))
+    parts.extend(encoded)
+    return b"".join(parts)
+
+
+def loads(data) -> Statechart:
+    """
+    Deserializes a statechart serialized with dumps, data can be any bytes-like object.
+    """
+    return StatechartTable(data).materialize()
+
+
+def _column(view: memoryview, offset: int, count: int, code: str):
+    size = count * array(code).itemsize
+    if len(view) < offset + size:
+        raise ValueError("Truncated statechart data")
+    if sys.byteorder == 'little':
+        return view[offset:offset + size].cast(code), offset + size
+    column = array(code, view[offset:offset + size])
+    column.byteswap()
+    return column, offset + size
+
+
+def _check_range(column, low: int, high: int):
+    if len(column) and (min(column) < low or max(column) >= high):
+        raise ValueError("Corrupt statechart data")
+
+
+class StatechartTable:
+    """
+    A statechart serialized with dumps, read without creating its nodes.
+
+    The table is backed by data itself (no copy on little-endian machines) and strings are decoded when used, so
+    it can answer questions about a large statechart, e.g. which nodes have a name, without paying for the object
+    graph. Nodes are identified by their index, 0 is the statechart. materialize() and materialize_node() create
+    all nodes, once, when they are needed.
+    """
+
+    def __init__(self, data):
+        view = memoryview(data).cast('B')
+        if len(view) < _header.size:
+            raise ValueError("Truncated statechart data")
+        magic, version, strings, count = _header.unpack_from(view)
+        if magic != _magic:
+            raise ValueError("Not a serialized statechart")
+        if version != _version:
+            raise ValueError(f"Unsupported statechart format version {version}")
+        offset = _header.size
+        self._offsets, offset = _column(view, offset, strings + 1, 'I')
+        self._parent, offset = _column(view, offset, count, 'i')
+        self._string, offset = _column(view, offset, count, 'i')
+        self._source, offset = _column(view, offset, count, 'i')
+        self._destination, offset = _column(view, offset, count, 'i')
+        self._kind, offset = _column(view, offset, count, 'B')
+        self._role, offset = _column(view, offset, count, 'B')
+        self._data = view[offset:]
+        if len(self._data) < self._offsets[strings]:
+            raise ValueError("Truncated statechart data")
+        if count == 0 or self._kind[0] != _kinds[Statechart]:
+            raise ValueError("Serialized statechart has no root")
+        self._strings: List[Optional[str]] = [None] * strings
+        self._children: Optional[List[List[int]]] = None
+        self._names: Optional[Dict[str, List[int]]] = None
+        self._nodes: Optional[List[BaseNode]] = None
+
+    def __len__(self):
+        return len(self._kind)
+
+    def _node(self, index: int) -> Optional[int]:
+        if not -1 <= index < len(self._kind):
+            raise ValueError("Corrupt statechart data")
+        return None if index < 0 else index
+
+    def _get_string(self, index: int) -> Optional[str]:
+        if index < 0:
+            return None
+        if index >= len(self._strings):
+            raise ValueError("Corrupt statechart data")
+        s = self._strings[index]
+        if s is None:
+            s = self._strings[index] = str(self._data[self._offsets[index]:self._offsets[index + 1]], 'utf-8')
+        return s
+
+    def kind(self, index: int) -> type:
+        kind = self._kind[index]
+        if kind >= len(_classes):
+            raise ValueError("Corrupt statechart data")
+        return _classes[kind]
+
+    def name(self, index: int) -> Optional[str]:
+        """
+        The name of a named node, None for other nodes.
+        """
+        if self._kind[index] in (_kinds[Transition], _kinds[Label]):
+            return None
+        return self._get_string(self._string[index])
+
+    def text(self, index: int) -> Optional[str]:
+        """
+        The text of a Label node, None for other nodes.
+        """
+        if self._kind[index] != _kinds[Label]:
+            return None
+        return self._get_string(self._string[index])
+
+    def parent(self, index: int) -> Optional[int]:
+        return self._node(self._parent[index])
+
+    def children(self, index: int) -> List[int]:
+        if self._children is None:
+            children = [[] for _ in range(len(self))]
+            for i, parent in enumerate(self._parent):
+                if self._node(parent) is not None:
+                    children[parent].append(i)
+            self._children = children
+        return list(self._children[index])
+
+    def source(self, index: int) -> Optional[int]:
+        return self._node(self._source[index])
+
+    def destination(self, index: int) -> Optional[int]:
+        return self._node(self._destination[index])
+
+    def find(self, name: str) -> List[int]:
+        """
+        The indices of the named nodes called name, like Statechart.get_contents_by_name.
+        """
+        if self._names is None:
+            names: Dict[str, List[int]] = dict()
+            unnamed = (_kinds[Statechart], _kinds[Transition], _kinds[Label])
+            for i, string in enumerate(self._string):
+                if string >= 0 and self._kind[i] not in unnamed:
+                    names.setdefault(self._get_string(string), []).append(i)
+            self._names = names
+        return list(self._names.get(name, ()))
+
+    def materialize_node(self, index: int) -> BaseNode:
+        """
+        The node at index of the statechart created by materialize(). The whole statechart is created on first use,
+        every node refers to its root and transitions to states anywhere in it.
+        """
+        return self._materialize()[index]
+
+    def materialize(self) -> Statechart:
+        """
+        Creates the statechart, the same object on every call.
+        """
+        return self._materialize()[0]
+
+    def _materialize(self) -> List[BaseNode]:
+        if self._nodes is not None:
+            return self._nodes
+        offsets = self._offsets.tolist()
+        data = self._data[:offsets[-1]]
+        text = str(data, 'utf-8')
+        if len(text) == len(data):
+            # ASCII only, the byte offsets are character offsets
+            strings = [text[start:end] for start, end in zip(offsets, offsets[1:])]
+        else:
+            strings = [self._get_string(i) for i in range(len(self._strings))]
+        strings.append(None)  # index -1
+        nodes: List[BaseNode] = []
+        append = nodes.append
+        type_index: Dict[type, Dict[int, BaseNode]] = {cls: dict() for cls in _classes[1:]}
+        name_index: Dict[str, Dict[int, NamedNode]] = dict()
+        kinds, parents, roles = self._kind.tolist(), self._parent.tolist(), self._role.tolist()
+        string_indices = self._string.tolist()
+        sources, destinations = self._source.tolist(), self._destination.tolist()
+        # Indices are used without checks from here on
+        count = len(kinds)
+        for column, high in ((string_indices, len(strings) - 1), (sources, count), (destinations, count)):
+            _check_range(column, -1, high)
+        _check_range(kinds, 0, len(_classes))
+        _check_range(roles, 0, len(_role_attributes))
+        columns = zip(kinds, parents, string_indices, roles)
+        for kind, parent, string, role in columns:
+            cls = _classes[kind]
+            shape = _shapes[kind]
+            node = cls.__new__(cls)
+            node._fingerprint = None
+            if shape == _STATE:
+                node._children = ChildList()
+                node._label = node._fqn = node._sort_name = None
+                node._name = name = strings[string]
+            elif shape == _TRANSITION:
+                node._children = ChildList()
+                node._label = node._src = node._dst = None
+            elif shape == _LABEL:
+                node._children = _no_children
+                node._label = strings[string]
+            elif shape == _REGION:
+                node._children = ChildList()
+                node._fqn = node._sort_name = None
+                node._initial_state = node._final_state = node._history_state = node._deep_history_state = None
+                node._name = name = strings[string]
+            else:
+                if nodes:
+                    raise ValueError("Serialized statechart has several roots")
+                node._children = ChildList()
+                node._initial_state = node._final_state = node._history_state = node._deep_history_state = None
+                node._type_index = type_index
+                node._name_index = name_index
+                node._subtypes = dict()
+                node._observer = None
+                node._tree_index = None
+                node._parent = None
+                append(node)
+                continue
+            if not 0 <= parent < len(nodes):
+                raise ValueError("Corrupt statechart data")
+            parent_node = nodes[parent]
+            node._parent = parent_node
+            parent_node._children.append(node)
+            if role:
+                setattr(parent_node, _role_attributes[role], node)
+            if shape == _STATE or shape == _REGION:
+                named = name_index.get(name)
+                if named is None:
+                    named = name_index[name] = dict()
+                named[id(node)] = node
+            type_index[cls][id(node)] = node
+            append(node)
+        for cls in [cls for cls, index in type_index.items() if not index]:
+            del type_index[cls]
+        for i, (source, destination) in enumerate(zip(sources, destinations)):
+            if source >= 0:
+                nodes[i]._src = nodes[source]
+            if destination >= 0:
+                nodes[i]._dst = nodes[destination]
+        self._nodes = nodes
+        return nodes
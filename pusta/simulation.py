@@ -0,0 +1,69 @@
+from typing import List, Sequence, Union
+
+import numpy as np
+
+from pusta.runtime import CompiledStatechart, FlatStatechart, compile_statechart, flatten
+from pusta.statechart import Statechart
+
+NO_EVENT = -1
+
+
+class Simulation:
+    """
+    Steps many instances of one statechart at once.
+
+    The chart is flattened into a dense configuration x event matrix with an extra identity column for
+    NO_EVENT, the active configuration of all instances is a single integer vector and every step is one gather.
+    """
+
+    def __init__(self, chart: Union[Statechart, CompiledStatechart, FlatStatechart], instances: int, guard=None):
+        if isinstance(chart, Statechart):
+            chart = compile_statechart(chart)
+        if isinstance(chart, CompiledStatechart):
+            chart = flatten(chart, guard)
+        self._flat = chart
+
+        n = len(chart.configurations)
+        dtype = np.min_scalar_type(n)
+        matrix = np.empty((n, len(chart.event_names) + 1), dtype=dtype)
+        if chart.event_names:
+            matrix[:, :-1] = chart.transitions
+        matrix[:, -1] = np.arange(n, dtype=dtype)
+        self._matrix = matrix
+        self.state = np.full(instances, chart.initial, dtype=dtype)
+
+    @property
+    def flat(self) -> FlatStatechart:
+        return self._flat
+
+    @property
+    def matrix(self) -> np.ndarray:
+        return self._matrix
+
+    def event_ids(self, names: Sequence[str]) -> np.ndarray:
+        ids = {name: i for i, name in enumerate(self._flat.event_names)}
+        return np.array([ids[name] for name in names], dtype=np.intp)
+
+    def step(self, events):
+        """
+        Advance all instances by one event each; events is an event id (or name) for all instances or an array
+        with one event id per instance, NO_EVENT leaves an instance unchanged.
+        """
+        if isinstance(events, str):
+            events = self._flat.event(events)
+        self.state = self._matrix[self.state, events]
+        return self.state
+
+    def run(self, events: np.ndarray):
+        """
+        Apply a (steps x instances) array of event ids.
+        """
+        for row in events:
+            self.state = self._matrix[self.state, row]
+        return self.state
+
+    def counts(self) -> np.ndarray:
+        return np.bincount(self.state, minlength=len(self._flat.configurations))
+
+    def configuration(self, instance: int) -> List[str]:
+        return self._flat.configuration_names(int(self.state[instance]))
@@ -1,12 +1,130 @@
+import collections.abc
+import io
+import itertools
 import logging
-from typing import Optional, List
+from typing import Optional, List, Dict, Iterator
+
+from pusta import instrument
+
+
+_no_children = ()
+
+
+class ChildList:
+    """
+    The children of a node in insertion order. Appending, removing and membership tests take constant time and
+    compare nodes by identity, inserting at an index takes linear time.
+    """
+    __slots__ = ('_nodes',)
+
+    def __init__(self, nodes=()):
+        self._nodes: Dict[int, BaseNode] = {id(n): n for n in nodes}
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def __iter__(self) -> Iterator['BaseNode']:
+        return iter(self._nodes.values())
+
+    def __reversed__(self) -> Iterator['BaseNode']:
+        return reversed(self._nodes.values())
+
+    def __contains__(self, node) -> bool:
+        return self._nodes.get(id(node)) is node
+
+    def append(self, node: 'BaseNode'):
+        self._nodes[id(node)] = node
+
+    def insert(self, index: int, node: 'BaseNode'):
+        nodes = list(self._nodes.values())
+        nodes.insert(index, node)
+        self._nodes = {id(n): n for n in nodes}
+
+    def remove(self, node: 'BaseNode'):
+        if self._nodes.get(id(node)) is not node:
+            raise ValueError(f"{node!r} is not a child")
+        del self._nodes[id(node)]
+
+
+class ChildrenView(collections.abc.Sequence):
+    """
+    Read-only view of the children of a node, it reflects later changes. Iterating while the children change
+    raises RuntimeError, iterate over a list(view) to change them. Indexing takes linear time.
+    """
+    __slots__ = ('_children',)
+
+    def __init__(self, children):
+        self._children = children
+
+    def __len__(self):
+        return len(self._children)
+
+    def __iter__(self) -> Iterator['BaseNode']:
+        return iter(self._children)
+
+    def __reversed__(self) -> Iterator['BaseNode']:
+        return reversed(self._children)
+
+    def __contains__(self, node) -> bool:
+        return node in self._children
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self)[index]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("child index out of range")
+        return next(itertools.islice(self, index, None))
+
+    def __eq__(self, other):
+        if isinstance(other, (ChildrenView, list, tuple)):
+            return len(self) == len(other) and all(a is b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({list(self)!r})"
+
+
+class SiblingsView(ChildrenView):
+    """
+    Read-only view of the other children of the parent of a node.
+    """
+    __slots__ = ('_node',)
+
+    def __init__(self, children, node):
+        super().__init__(children)
+        self._node = node
+
+    def __len__(self):
+        return len(self._children) - (self._node in self._children)
+
+    def __iter__(self) -> Iterator['BaseNode']:
+        node = self._node
+        return (c for c in self._children if c is not node)
+
+    def __reversed__(self) -> Iterator['BaseNode']:
+        node = self._node
+        return (c for c in reversed(self._children) if c is not node)
+
+    def __contains__(self, node) -> bool:
+        return node is not self._node and node in self._children
 
 
 class BaseNode:
+    __slots__ = ('_parent', '_children', '_fingerprint')
+    _leaf = False
+    _logger = logging.getLogger('BaseNode')
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._logger = logging.getLogger(cls.__name__)
+
     def __init__(self):
         self._parent: Optional[BaseNode] = None
-        self._children: List[BaseNode] = list()
-        self._logger = logging.getLogger(self.__class__.__name__)
+        self._children: ChildList = _no_children if self._leaf else ChildList()
+        # Structural hash of the subtree, see pusta.delta
+        self._fingerprint: Optional[int] = None
 
     @property
     def parent(self) -> 'BaseNode':
@@ -16,48 +134,125 @@ class BaseNode:
     def parent(self, parent):
         if parent and self._parent:
             raise ValueError(f"Object {self!r} already has a parent: {self._parent!r}")
+        previous = self._parent
         self._parent = parent
+        self._invalidate_fqn()
+        if previous is not None and self._fingerprint is not None and not isinstance(self, UniqueNamedNode) \
+                and isinstance(self, NamedNode):
+            # The fully qualified names in the subtree change, transitions anywhere may refer to them
+            previous.root._clear_fingerprints()
+            self._clear_fingerprints()
+
+    def _invalidate_fingerprint(self):
+        node = self
+        while node is not None and node._fingerprint is not None:
+            node._fingerprint = None
+            node = node._parent
+
+    def _clear_fingerprints(self):
+        self._fingerprint = None
+        for node in self.iter_contents():
+            node._fingerprint = None
+
+    def _invalidate_fqn(self):
+        if isinstance(self, NamedNode):
+            self._fqn = None
+            self._sort_name = None
+        if self._children:
+            for node in self.iter_contents():
+                if isinstance(node, NamedNode):
+                    node._fqn = None
+                    node._sort_name = None
 
     @property
-    def children(self):
-        return list(self._children)
+    def children(self) -> ChildrenView:
+        return ChildrenView(self._children)
 
-    def add_child(self, child: 'BaseNode'):
+    def add_child(self, child: 'BaseNode', index: int = None):
+        if self._leaf:
+            raise TypeError(f"Object {self!r} can not have children")
         if child in self._children:
             raise ValueError(f"Object {self!r} already has child {child!r}")
-        self._children.append(child)
+        if index is None:
+            self._children.append(child)
+        else:
+            self._children.insert(index, child)
         child.parent = self
+        self._invalidate_fingerprint()
+        root = self.root
+        if isinstance(root, Statechart):
+            root._index(child)
 
     def remove_child(self, child: 'BaseNode'):
+        if child not in self._children:
+            raise ValueError(f"{child!r} is not a child of {self!r}")
+        root = self.root
+        if isinstance(root, Statechart):
+            # Observers see the child in its place
+            root._unindex(child)
         self._children.remove(child)
+        self._invalidate_fingerprint()
         child.parent = None
 
     @property
-    def siblings(self) -> List['BaseNode']:
+    def root(self) -> 'BaseNode':
+        node = self
+        while node._parent:
+            node = node._parent
+        return node
+
+    @property
+    def siblings(self) -> ChildrenView:
         if not self._parent:
-            return []
-        pc = self._parent._children
-        return list(filter(lambda c: c is not self, pc))
+            return ChildrenView(_no_children)
+        return SiblingsView(self._parent._children, self)
 
     def get_children_of_type(self, cls) -> List:
         return list(filter(lambda o: isinstance(o, cls), self._children))
 
     def get_parent_of_type(self, cls):
-        if isinstance(self._parent, cls):
-            return self._parent
-        elif self._parent:
-            return self._parent.get_parent_of_type(cls)
-        else:
-            return None
+        node = self._parent
+        while node is not None and not isinstance(node, cls):
+            node = node._parent
+        return node
+
+    def is_ancestor_of(self, node: 'BaseNode') -> bool:
+        """
+        Whether node is a (direct or indirect) child of this node. Statechart.tree_index() answers this in
+        constant time for many nodes.
+        """
+        node = node._parent
+        while node is not None:
+            if node is self:
+                return True
+            node = node._parent
+        return False
+
+    def common_ancestor(self, node: 'BaseNode') -> Optional['BaseNode']:
+        """
+        The deepest node that is this node or one of its ancestors and node or one of its ancestors, None if they
+        are in different trees. See Statechart.tree_index() for many queries.
+        """
+        ancestors = set()
+        n = self
+        while n is not None:
+            ancestors.add(id(n))
+            n = n._parent
+        while node is not None and id(node) not in ancestors:
+            node = node._parent
+        return node
+
+    def iter_contents(self) -> Iterator['BaseNode']:
+        stack = list(reversed(self._children))
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node._children))
 
     def get_contents(self):
-        contents = []
-        for c in self._children:
-            contents.append(c)
-            contents.extend(c.get_contents())
-        return contents
+        return list(self.iter_contents())
 
-    def get_contents_of_type(self, cls):
+    def get_contents_of_type(self, cls, ordered: bool = True):
         return list(filter(lambda o: isinstance(o, cls), self.get_contents()))
 
     def _str_header(self):
@@ -66,15 +261,34 @@ class BaseNode:
     def _str_children(self):
         return sorted(self._children)
 
-    def __str__(self) -> str:
-        s = self._str_header()
+    def _render_node(self):
         children = self._str_children()
         if children:
-            s += ":\n"
-            for child in children:
-                for line in str(child).splitlines():
-                    s += f"    {line}\n"
-        return s.strip()
+            return f"{self._str_header()}:".lstrip().splitlines(), children
+        return self._str_header().strip().splitlines(), ()
+
+    def render(self, stream):
+        with instrument.phase("render", "statechart"):
+            self._render(stream)
+
+    def _render(self, stream):
+        stack = [(0, self)]
+        first = True
+        while stack:
+            depth, node = stack.pop()
+            lines, children = node._render_node()
+            indent = "    " * depth
+            for line in lines:
+                if not first:
+                    stream.write("\n")
+                stream.write(indent + line)
+                first = False
+            stack.extend((depth + 1, c) for c in reversed(children))
+
+    def __str__(self) -> str:
+        stream = io.StringIO()
+        self.render(stream)
+        return stream.getvalue()
 
     def _cmp(self, other):
         return self.__class__.__name__ < other.__class__.__name__
@@ -90,9 +304,13 @@ class BaseNode:
 
 
 class NamedNode(BaseNode):
+    __slots__ = ()
+
     def __init__(self, name: str):
         super().__init__()
         self._name = name
+        self._fqn = None
+        self._sort_name = None
 
     @property
     def name(self) -> str:
@@ -102,24 +320,41 @@ class NamedNode(BaseNode):
         return f"{self.__class__.__name__} {self.name}"
 
     def fqn(self):
-        if isinstance(self.parent, NamedNode):
-            return f"{self.parent.fqn()}.{self.name}"
-        else:
-            return self.name
+        if self._fqn is None:
+            # Up to the first ancestor knowing its name, without recursion as the tree may be deep
+            chain = [self]
+            node = self._parent
+            while isinstance(node, NamedNode) and node._fqn is None and type(node).fqn is NamedNode.fqn:
+                chain.append(node)
+                node = node._parent
+            prefix = node.fqn() if isinstance(node, NamedNode) else None
+            for n in reversed(chain):
+                prefix = n._fqn = n.name if prefix is None else f"{prefix}.{n.name}"
+        return self._fqn
+
+    def _get_sort_name(self):
+        if self._sort_name is None:
+            self._sort_name = self.fqn().upper()
+        return self._sort_name
 
     def _cmp(self, other):
         if isinstance(other, NamedNode):
-            return self.fqn().upper() < other.fqn().upper()
+            return self._get_sort_name() < other._get_sort_name()
         else:
             return super()._cmp(other)
 
 
 class UniqueNamedNode(NamedNode):
+    __slots__ = ()
+
     def fqn(self):
         return self.name
 
 
 class Label(BaseNode):
+    __slots__ = ('_label',)
+    _leaf = True
+
     def __init__(self, label: str):
         super().__init__()
         if isinstance(label, str):
@@ -134,8 +369,16 @@ class Label(BaseNode):
             return list()
         return self._label.splitlines()
 
+    def _render_node(self):
+        s = self._str_header()
+        lines = self._str_children()
+        if lines:
+            s += ":\n" + "".join(f"    {line}\n" for line in lines if line)
+        return s.strip().splitlines(), ()
+
     def append_line(self, other: str):
         self._label += '\n' + other
+        self._invalidate_fingerprint()
         return self
 
     def __eq__(self, other):
@@ -147,6 +390,8 @@ class Label(BaseNode):
 
 
 class LabeledNode(BaseNode):
+    __slots__ = ()
+
     def __init__(self, label: str = None):
         super().__init__()
         if label:
@@ -162,7 +407,7 @@ class LabeledNode(BaseNode):
     @label.setter
     def label(self, value):
         if self._label:
-            self._children.remove(self._label)
+            self.remove_child(self._label)
         if value is None:
             self._label = None
             return
@@ -175,6 +420,8 @@ class LabeledNode(BaseNode):
 
 
 class StateContainer(BaseNode):
+    __slots__ = ()
+
     def __init__(self):
         super().__init__()
         self._initial_state = None
@@ -185,6 +432,17 @@ class StateContainer(BaseNode):
     def get_states(self) -> List['AbstractState']:
         return self.get_children_of_type(AbstractState)
 
+    def remove_child(self, child: 'BaseNode'):
+        super().remove_child(child)
+        if child is self._initial_state:
+            self._initial_state = None
+        elif child is self._final_state:
+            self._final_state = None
+        elif child is self._history_state:
+            self._history_state = None
+        elif child is self._deep_history_state:
+            self._deep_history_state = None
+
     @property
     def initial_state(self) -> 'InitialState':
         return self._initial_state
@@ -231,6 +489,8 @@ class StateContainer(BaseNode):
 
 
 class AbstractState(NamedNode, LabeledNode):
+    __slots__ = ('_name', '_label', '_fqn', '_sort_name')
+
     def get_transitions(self) -> List['Transition']:
         return self.get_children_of_type(Transition)
 
@@ -239,10 +499,12 @@ class AbstractState(NamedNode, LabeledNode):
 
 
 class State(AbstractState, UniqueNamedNode):
-    pass
+    __slots__ = ()
 
 
 class Transition(LabeledNode):
+    __slots__ = ('_label', '_src', '_dst')
+
     def __init__(self, label=None):
         super().__init__(label)
         self._src = None
@@ -254,9 +516,12 @@ class Transition(LabeledNode):
 
     @source.setter
     def source(self, src: State):
+        self.attach(src)
+
+    def attach(self, src: State, index: int = None):
         self._src = src
         if src:
-            src.add_child(self)
+            src.add_child(self, index)
 
     @property
     def destination(self) -> State:
@@ -265,12 +530,15 @@ class Transition(LabeledNode):
     @destination.setter
     def destination(self, dst: State):
         self._dst = dst
+        self._invalidate_fingerprint()
 
     def _str_header(self):
         return f"{self.__class__.__name__} -> {self.destination.fqn()}"
 
 
 class PseudoState(AbstractState):
+    __slots__ = ()
+
     def __init__(self):
         super().__init__(self.__class__.__name__)
 
@@ -279,67 +547,235 @@ class PseudoState(AbstractState):
 
 
 class InitialState(PseudoState):
-    pass
+    __slots__ = ()
 
 
 class FinalState(PseudoState):
-    pass
+    __slots__ = ()
 
 
 class HistoryState(PseudoState):
-    pass
+    __slots__ = ()
 
 
 class DeepHistoryState(PseudoState):
-    pass
+    __slots__ = ()
 
 
 class Choice(State):
-    pass
+    __slots__ = ()
 
 
 class Fork(State):
-    pass
+    __slots__ = ()
 
 
 class EntryPoint(State):
-    pass
+    __slots__ = ()
 
 
 class ExitPoint(State):
-    pass
+    __slots__ = ()
 
 
 class Region(NamedNode, StateContainer):
-    pass
+    __slots__ = ('_name', '_fqn', '_sort_name', '_initial_state', '_final_state', '_history_state',
+                 '_deep_history_state')
 
 
 class Statechart(StateContainer):
-    pass
+    __slots__ = ('_initial_state', '_final_state', '_history_state', '_deep_history_state',
+                 '_type_index', '_name_index', '_subtypes', '_observer', '_tree_index')
 
+    def __init__(self):
+        super().__init__()
+        self._type_index: Dict[type, Dict[int, BaseNode]] = dict()
+        self._name_index: Dict[str, Dict[int, NamedNode]] = dict()
+        self._subtypes: Dict[type, List[type]] = dict()
+        self._observer = None
+        self._tree_index = None
 
-_cls_sort_order = [Label, Transition, Region, InitialState, PseudoState, State, FinalState, NamedNode, BaseNode, object]
-
+    @property
+    def observer(self):
+        """
+        Object notified with node_added(node) and node_removed(node) whenever a subtree is attached to or
+        detached from the statechart. node_added is called once the node is attached, node_removed while it still
+        is.
+        """
+        return self._observer
+
+    @observer.setter
+    def observer(self, observer):
+        self._observer = observer
+
+    def tree_index(self) -> 'TreeIndex':
+        """
+        The TreeIndex of the statechart, built on first use after a change.
+        """
+        if self._tree_index is None:
+            self._tree_index = TreeIndex(self)
+        return self._tree_index
+
+    def _index(self, node: BaseNode):
+        self._tree_index = None
+        self._index_node(node)
+        if node._children:
+            for n in node.iter_contents():
+                self._index_node(n)
+        if self._observer is not None:
+            self._observer.node_added(node)
+
+    def _index_node(self, node: BaseNode):
+        cls = node.__class__
+        if cls not in self._type_index:
+            self._type_index[cls] = dict()
+            self._subtypes.clear()
+        self._type_index[cls][id(node)] = node
+        if isinstance(node, NamedNode):
+            self._name_index.setdefault(node.name, dict())[id(node)] = node
+
+    def _unindex(self, node: BaseNode):
+        self._tree_index = None
+        self._unindex_node(node)
+        if node._children:
+            for n in node.iter_contents():
+                self._unindex_node(n)
+        if self._observer is not None:
+            self._observer.node_removed(node)
+
+    def _unindex_node(self, node: BaseNode):
+        del self._type_index[node.__class__][id(node)]
+        if isinstance(node, NamedNode):
+            named = self._name_index[node.name]
+            del named[id(node)]
+            if not named:
+                del self._name_index[node.name]
+
+    def get_contents_of_type(self, cls, ordered: bool = True):
+        """
+        The nodes of type cls in tree order, sorted by their position in the tree index, which is built again after
+        changes. Unordered, they are taken from the type index in O(k), grouped by class.
+        """
+        if cls not in self._subtypes:
+            self._subtypes[cls] = [t for t in self._type_index if issubclass(t, cls)]
+        contents = []
+        for t in self._subtypes[cls]:
+            contents.extend(self._type_index[t].values())
+        if ordered and len(contents) > 1:
+            contents.sort(key=self.tree_index().position)
+        return contents
 
-def _merge(mros):
-    if not any(mros):  # all lists are empty
-        return []  # base case
-    for candidate, *_ in mros:
-        if all(candidate not in tail for _, *tail in mros):
-            return [candidate] + _merge([tail if head is candidate else [head, *tail]
-                                        for head, *tail in mros])
-    else:
-        raise TypeError("No legal mro")
+    def get_contents_by_name(self, name: str) -> List['NamedNode']:
+        return list(self._name_index.get(name, {}).values())
+
+    def to_scxml(self, stream, name: str = None):
+        from pusta.scxml import write_scxml
+        write_scxml(self, stream, name)
+
+
+class TreeIndex:
+    """
+    Preorder numbering and ancestor jump tables of the tree below root, for ancestor checks in constant time and
+    lowest common ancestor queries in O(log depth). The index is not updated, it is invalid once the tree changes.
+    """
+    __slots__ = ('_position', '_nodes', '_end', '_depth', '_up')
+
+    def __init__(self, root: BaseNode):
+        position: Dict[int, int] = dict()
+        nodes: List[BaseNode] = []
+        parents: List[int] = []
+        depths: List[int] = []
+        stack = [(root, 0, 0)]
+        while stack:
+            node, parent, depth = stack.pop()
+            i = len(nodes)
+            position[id(node)] = i
+            nodes.append(node)
+            parents.append(parent)
+            depths.append(depth)
+            stack.extend((c, i, depth + 1) for c in reversed(node._children))
+        # The subtree of node i are the positions i to end[i]
+        end = list(range(len(nodes)))
+        for i in range(len(nodes) - 1, 0, -1):
+            if end[i] > end[parents[i]]:
+                end[parents[i]] = end[i]
+        # up[k][i] is the ancestor 2 ** k levels above i, the root is its own parent
+        up = [parents]
+        max_depth = max(depths)
+        while 1 << len(up) <= max_depth:
+            up.append([up[-1][p] for p in up[-1]])
+        self._position = position
+        self._nodes = nodes
+        self._end = end
+        self._depth = depths
+        self._up = up
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def __contains__(self, node: BaseNode) -> bool:
+        i = self._position.get(id(node))
+        return i is not None and self._nodes[i] is node
+
+    def depth(self, node: BaseNode) -> int:
+        return self._depth[self._position[id(node)]]
+
+    def position(self, node: BaseNode) -> int:
+        """
+        The preorder number of node, the root is 0.
+        """
+        return self._position[id(node)]
+
+    def is_ancestor(self, ancestor: BaseNode, node: BaseNode) -> bool:
+        """
+        Whether node is a (direct or indirect) child of ancestor.
+        """
+        i = self._position[id(ancestor)]
+        return i < self._position[id(node)] <= self._end[i]
+
+    def lca(self, a: BaseNode, b: BaseNode) -> BaseNode:
+        """
+        The lowest common ancestor of a and b: the deepest node that is a or an ancestor of a and b or an ancestor
+        of b.
+        """
+        i = self._position[id(a)]
+        j = self._position[id(b)]
+        end = self._end
+        if i <= j <= end[i]:
+            return a
+        if j <= i <= end[j]:
+            return b
+        for up in reversed(self._up):
+            k = up[i]
+            if not k <= j <= end[k]:
+                i = k
+        return self._nodes[self._up[0][i]]
+
+    def domain(self, transition: 'Transition') -> Optional[StateContainer]:
+        """
+        The innermost region (or the statechart) containing the source and the destination of transition, the
+        states exited and entered by the transition are the ones below it.
+        """
+        source = transition.source
+        destination = transition.destination
+        node = self.lca(source, destination)
+        up = self._up[0]
+        i = self._position[id(node)]
+        while not isinstance(node, StateContainer) or node is source or node is destination:
+            if up[i] == i:
+                return None
+            i = up[i]
+            node = self._nodes[i]
+        return node
 
 
-def _mro(cls):
-    if cls is object:
-        return [object]
-    return [cls] + _merge([_mro(base) for base in cls.__bases__])
+_cls_sort_order = [Label, Transition, Region, InitialState, PseudoState, State, FinalState, NamedNode, BaseNode, object]
+_cls_sort_indices: Dict[type, int] = dict()
 
 
 def _sort_index(cls):
-    mro = _mro(cls)
-    for supercls in mro:
-        if supercls in _cls_sort_order:
-            return _cls_sort_order.index(supercls)
+    index = _cls_sort_indices.get(cls)
+    if index is None:
+        index = next(_cls_sort_order.index(c) for c in cls.__mro__ if c in _cls_sort_order)
+        _cls_sort_indices[cls] = index
+    return index
@@ -0,0 +1,271 @@
+import codecs
+import contextlib
+import logging
+import mmap
+import re
+from typing import Iterable, Iterator, List, Optional, Tuple, Union, IO
+
+import textx.exceptions
+
+import pusta
+from pusta.builder import StatechartBuilder
+from pusta.statechart import Statechart
+
+_logger = logging.getLogger(__name__)
+
+# Bytes decoded at once when reading files
+DEFAULT_CHUNK_SIZE = 1 << 16
+
+# Number of consecutive blocks iter_expressions joins before it reports a syntax error
+MAX_JOINED_BLOCKS = 64
+
+# Line classification used to split a diagram body into top-level blocks
+_structural = re.compile(r'[\t ]*(state|\{|\})')
+_quoted = re.compile(r'"[^"\n]*"')
+_long_note = re.compile(r'[\t ]*note[\t ]*\w+[\t ]*of[\t ]*\w+\b(?![\t ]*:)')
+_end_note = re.compile(r'[\t ]*end note')
+
+
+class BlockSplitter:
+    """
+    Splits a diagram body line by line into top-level blocks.
+
+    A block is a single line, a multi-line composite or parallel "state X { ... }" declaration, or a long note
+    up to its "end note". Splitting only counts braces on lines starting with "state", "{" or "}", so a block can
+    be split wrongly, it then fails to parse on its own.
+    """
+    __slots__ = ('_depth', '_note')
+
+    def __init__(self):
+        self._depth = 0
+        self._note = False
+
+    def feed(self, text: str, pos: int = 0, stop: int = None) -> bool:
+        """
+        Classifies the line text[pos:stop] and returns True if a block ends with it.
+        """
+        if stop is None:
+            stop = len(text)
+        if self._note:
+            self._note = not _end_note.match(text, pos, stop)
+        elif _long_note.match(text, pos, stop):
+            self._note = True
+        elif _structural.match(text, pos, stop):
+            line = _quoted.sub('', text[pos:stop])
+            self._depth = max(0, self._depth + line.count('{') - line.count('}'))
+        return not self._note and self._depth == 0
+
+
+def _lines(source) -> Iterator[str]:
+    """
+    Yields the lines of a text or binary file-like object or of any iterable of str or bytes chunks.
+    """
+    pending = ""
+    decoder = None
+    for chunk in source:
+        if isinstance(chunk, bytes):
+            # Characters may be split between chunks
+            if decoder is None:
+                decoder = codecs.getincrementaldecoder('utf-8')()
+            chunk = decoder.decode(chunk)
+        if not pending and chunk.endswith('\n') and chunk.count('\n') == 1:
+            yield chunk
+            continue
+        pending += chunk
+        lines = pending.split('\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line + '\n'
+    if decoder is not None:
+        pending += decoder.decode(b'', final=True)
+    if pending:
+        yield pending
+
+
+def _map(f) -> Optional[mmap.mmap]:
+    try:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        # Empty files, pipes and other special files cannot be mapped
+        return None
+
+
+@contextlib.contextmanager
+def map_file(path):
+    """
+    Context manager giving the content of the file at path as a read-only buffer: a memory map of the file, or the
+    bytes read if it cannot be mapped (empty files, pipes).
+    """
+    with open(path, 'rb') as f:
+        data = _map(f)
+        if data is None:
+            yield f.read()
+            return
+        with data:
+            yield data
+
+
+def iter_buffer(data, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[str]:
+    """
+    Yields the text of a UTF-8 encoded buffer (bytes, mmap, ...) decoded in chunks of chunk_size bytes, without
+    copying the buffer.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    with memoryview(data) as view:
+        for start in range(0, len(view), chunk_size):
+            with view[start:start + chunk_size] as chunk:
+                text = decoder.decode(chunk)
+            yield text
+    yield decoder.decode(b'', final=True)
+
+
+def iter_file(path, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[str]:
+    """
+    Yields the text of the UTF-8 file at path in decoded chunks. Regular files are memory mapped, others (e.g.
+    named pipes) are read chunk by chunk, so the file content is never held in memory as a whole.
+    """
+    with open(path, 'rb') as f:
+        data = _map(f)
+        if data is not None:
+            with data:
+                yield from iter_buffer(data, chunk_size)
+            return
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            yield decoder.decode(chunk)
+        yield decoder.decode(b'', final=True)
+
+
+def iter_blocks(source) -> Iterator[str]:
+    """
+    Yields the texts of the top-level blocks of a diagram read from source, see BlockSplitter.
+
+    The first non-blank line must start with @startuml, the body ends at a line consisting of @enduml. Raises
+    ValueError if either is missing or if anything but whitespace follows @enduml.
+    """
+    return (text for _, text in _numbered_blocks(source))
+
+
+def _numbered_blocks(source) -> Iterator[Tuple[int, str]]:
+    """
+    Yields the blocks of iter_blocks together with the number of their first line in source.
+    """
+    lines = _lines(source)
+    number = 0
+    for line in lines:
+        number += 1
+        stripped = line.lstrip()
+        if stripped:
+            if not stripped.startswith('@startuml'):
+                raise ValueError("Diagram must start with @startuml")
+            rest = stripped[len('@startuml'):]
+            break
+    else:
+        raise ValueError("Diagram must start with @startuml")
+
+    splitter = BlockSplitter()
+    block: List[str] = []
+    start = number + 1
+    if rest.strip():
+        block.append(rest)
+        start = number
+        if splitter.feed(rest):
+            yield start, "".join(block)
+            block = []
+            start = number + 1
+    for line in lines:
+        number += 1
+        if line.strip() == '@enduml' and not block:
+            break
+        block.append(line)
+        if splitter.feed(line):
+            yield start, "".join(block)
+            block = []
+            start = number + 1
+    else:
+        raise ValueError("Diagram must end with @enduml")
+    for line in lines:
+        if line.strip():
+            raise ValueError("Unexpected content after @enduml")
+
+
+def iter_expressions(source, parser: 'pusta.Pusta' = None, path: str = None) -> Iterator:
+    """
+    Parses a diagram block by block (see iter_blocks) and yields its top-level expressions, the memory of a
+    block's model is released once the block has been consumed.
+
+    Every block is parsed on its own with the engine of parser (default: a fast Pusta). A block that fails to
+    parse is joined with the previous and the following blocks, and a block is only passed on after the next
+    one parsed, so that an expression continued on the next line ("A --> B" followed by ": label") gives the
+    same model as parsing the whole diagram. The parser's error is raised if the blocks still do not parse
+    after joining MAX_JOINED_BLOCKS of them or at the end of the diagram, textX errors are located in source
+    (and path, if given).
+    """
+    parser = parser or pusta.Pusta(engine="fast")
+    held: Optional[list] = None
+    held_text = ""
+    failed = ""
+    failed_line = 0
+    joined = 0
+    error = None
+    for line, text in _numbered_blocks(source):
+        if failed:
+            text, line = failed + text, failed_line
+        try:
+            expressions = _parse_block(parser, text)
+        except Exception as e:
+            if held is not None:
+                try:
+                    held = _parse_block(parser, held_text + text)
+                    held_text += text
+                    failed, joined = "", 0
+                    continue
+                except Exception:
+                    pass
+            if joined == 0:
+                error = _locate(e, line, path)
+            joined += 1
+            if joined >= MAX_JOINED_BLOCKS:
+                raise error
+            failed, failed_line = text, line
+            continue
+        failed, joined = "", 0
+        if held is not None and not text.strip():
+            # An expression may continue after blank lines
+            held_text += text
+            continue
+        if held is not None:
+            yield from held
+        held, held_text = expressions, text
+    if failed:
+        raise error
+    if held is not None:
+        yield from held
+
+
+def _locate(error: Exception, line: int, path: Optional[str]) -> Exception:
+    """
+    Moves the position of a textX error in a block parsed with _parse_block starting at line to its position in
+    the diagram.
+    """
+    if isinstance(error, textx.exceptions.TextXError):
+        if error.line:
+            # Line 1 of the parsed text is the added @startuml
+            error.line += line - 2
+        error.filename = path
+    return error
+
+
+def _parse_block(parser, text):
+    return parser._model_from_str(f"@startuml\n{text}@enduml").expressions
+
+
+def transform_stream(source: Union[IO, Iterable], parser: 'pusta.Pusta' = None,
+                     builder: StatechartBuilder = None, path: str = None) -> Statechart:
+    """
+    Transforms a diagram read from a file-like object (text or binary, including pipes) or an iterable of lines
+    into a Statechart without keeping the model of the whole diagram in memory.
+    """
+    builder = builder or StatechartBuilder()
+    builder.consume_expressions(iter_expressions(source, parser, path))
+    return builder.statechart
@@ -0,0 +1,153 @@
+import pusta
+from pusta.aio import AsyncParser
+
+import asyncio
+import concurrent.futures
+import os
+import threading
+import time
+import pytest
+
+test_path = os.path.dirname(__file__)
+diagram_path = os.path.join(test_path, "diagrams")
+
+
+class SlowParser(AsyncParser):
+    def __init__(self, *args, delay=0.05, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.delay = delay
+        self.calls = 0
+        self.running = 0
+        self.max_running = 0
+        self._lock = threading.Lock()
+
+    def _transform(self, text, path):
+        with self._lock:
+            self.calls += 1
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(self.delay)
+        with self._lock:
+            self.running -= 1
+        return super()._transform(text, path)
+
+
+def diagram(i):
+    return f"@startuml\n[*] --> S{i}\nS{i} --> [*]\n@enduml\n"
+
+
+def test_aparse():
+    parser = pusta.Pusta(engine="fast")
+    path = os.path.join(diagram_path, "composite_states_2.pu")
+
+    async def main():
+        return await parser.aparse(diagram(1)), await parser.aparse_file(path)
+
+    text, file = asyncio.run(main())
+    assert text._statechart is not None and file._statechart is not None
+    assert text.transform() is text.transform()
+    assert str(text.transform()) == str(parser.parse(diagram(1)).transform())
+    assert str(file.transform()) == str(parser.parse_file(path).transform())
+    with pytest.raises(Exception):
+        asyncio.run(parser.aparse("@startuml\nA -> -> B\n@enduml\n"))
+
+
+def test_dedup_and_concurrency():
+    runner = SlowParser(pusta.Pusta(engine="fast"), max_workers=4, max_concurrency=2)
+
+    async def main():
+        return await asyncio.gather(*[runner.parse(diagram(i % 3)) for i in range(9)])
+
+    results = asyncio.run(main())
+    runner.close()
+    assert runner.calls == 3
+    assert runner.max_running <= 2
+    assert results[0] is results[3] and results[0] is not results[1]
+    assert "S2" in str(results[5].transform())
+
+
+def test_timeout_and_cancellation():
+    runner = SlowParser(pusta.Pusta(engine="fast"), max_concurrency=1, delay=0.2)
+
+    async def main():
+        with pytest.raises(asyncio.TimeoutError):
+            await runner.parse(diagram(1), timeout=0.01)
+
+        first = asyncio.ensure_future(runner.parse(diagram(2)))
+        second = asyncio.ensure_future(runner.parse(diagram(2)))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        assert "S2" in str((await second).transform())
+
+        # Waits for the semaphore behind a running request, cancelled before it reaches the executor
+        blocking = asyncio.ensure_future(runner.parse(diagram(3)))
+        waiting = asyncio.ensure_future(runner.parse(diagram(4)))
+        await asyncio.sleep(0.01)
+        waiting.cancel()
+        await blocking
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        assert not runner._state().in_flight
+
+    asyncio.run(main())
+    runner.close()
+    assert runner.calls == 3
+
+
+def test_event_loops():
+    parser = pusta.Pusta(engine="fast")
+    parser.configure_async(max_workers=1)
+    texts = [diagram(i) for i in range(4)]
+
+    async def main():
+        return await asyncio.gather(*(parser.aparse(t) for t in texts))
+
+    # The semaphore contended in the first loop must not be used in the second
+    for _ in range(2):
+        assert ["S3" in str(d.transform()) for d in asyncio.run(main())] == [False, False, False, True]
+    parser.configure_async().close()
+
+
+class CountingExecutor(concurrent.futures.ThreadPoolExecutor):
+    def __init__(self):
+        super().__init__(2)
+        self.functions = []
+
+    def submit(self, function, *args, **kwargs):
+        self.functions.append(function.__name__)
+        return super().submit(function, *args, **kwargs)
+
+
+def test_files_read_in_executor(tmp_path):
+    (tmp_path / "common.iuml").write_text("A --> B\n")
+    paths = []
+    for i in range(8):
+        paths.append(tmp_path / f"d{i}.pu")
+        paths[-1].write_text(f"@startuml\n!include common.iuml\n[*] --> S{i}\n@enduml\n")
+    parser = pusta.Pusta(engine="fast")
+    executor = CountingExecutor()
+    runner = AsyncParser(parser, executor, max_concurrency=2)
+
+    async def main():
+        return await asyncio.gather(*(runner.parse_file(p) for p in paths))
+
+    diagrams = asyncio.run(main())
+    executor.shutdown()
+    assert sorted(executor.functions) == ["_read"] * 8 + ["_transform"] * 8
+    assert [f"S{i}" in str(d.transform()) for i, d in enumerate(diagrams)] == [True] * 8
+    assert parser.preprocessor.dependents(tmp_path / "common.iuml") == set(map(str, paths))
+
+
+def test_process_executor():
+    parser = pusta.Pusta(engine="fast")
+    parser.configure_async("process", max_workers=1)
+    path = os.path.join(diagram_path, "history_states.pu")
+
+    async def main():
+        return await asyncio.gather(parser.aparse_file(path), parser.aparse_file(path))
+
+    first, second = asyncio.run(main())
+    parser.configure_async().close()
+    assert first is second
+    assert str(first.transform()) == str(parser.parse_file(path).transform())
+    assert first._model is not None
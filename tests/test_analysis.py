@@ -0,0 +1,102 @@
+import pusta
+from pusta.analysis import *
+
+import os
+
+parser = pusta.Pusta(engine="fast")
+
+test_path = os.path.dirname(__file__)
+diagram_path = os.path.join(test_path, "diagrams")
+
+
+def analysis(text):
+    return Analysis(parser.parse(f"@startuml\n{text}\n@enduml\n").transform())
+
+
+def test_reachability_regions():
+    a = analysis("""[*] --> Idle
+Idle --> P
+state P {
+  [*] --> A1
+  A1 --> A2
+  --
+  [*] --> B1
+  B1 --> B2
+  B2 --> B3
+}
+state Q {
+  [*] --> Q1
+}
+Lost --> Q""")
+    assert a.unreachable() == ["Lost", "Q", "Q.0.InitialState", "Q1"]
+    assert {"P", "A1", "A2", "B1", "B2", "B3"} <= set(a.reachable())
+
+    # Entering a state inside a region enters the other regions and activates the parent
+    a = analysis("""[*] --> Idle
+state P {
+  X1 : first
+  --
+  [*] --> Y1
+  Y2 : second
+  --
+  [*] --> Z1
+}
+Idle --> Y2""")
+    assert a.unreachable() == ["P.1.InitialState", "X1", "Y1"]
+    assert a.deadlocks() == ["Y2", "Z1"]
+
+
+def test_history():
+    a = analysis("""[*] --> Idle
+state S {
+  [*] --> S1
+  S1 --> S2
+}
+Idle --> S[H]
+S --> Idle""")
+    assert a.unreachable() == []
+    assert a.traps() == [sorted(n for n in a.compiled.names if n != "InitialState")]
+
+
+def test_example_diagrams():
+    statechart = parser.parse_file(os.path.join(diagram_path, "history_states.pu")).transform()
+    assert lint(statechart) == []
+    statechart = parser.parse_file(os.path.join(diagram_path, "pseudostates.pu")).transform()
+    assert [(i.kind, i.vertex) for i in lint(statechart)] == [(UNMATCHED_FORK, "fork1"), (UNMATCHED_JOIN, "join2")]
+    statechart = parser.parse_file(os.path.join(diagram_path, "fork_join.pu")).transform()
+    assert lint(statechart) == []
+
+
+def test_lint():
+    a = analysis("""state c <<choice>>
+[*] --> A
+A --> c
+c --> B : [x > 0]
+c --> C : [x < 0]
+B --> D
+C --> E
+E --> C
+state P {
+  [*] --> P1
+}
+D --> P""")
+    assert a.deadlocks() == ["P1"]
+    assert a.traps() == [["C", "E"]]
+    assert a.choices_without_else() == ["c"]
+    assert [(i.kind, i.vertex) for i in a.lint()] == [(DEADLOCK, "P1"), (TRAP, "C"), (CHOICE_WITHOUT_ELSE, "c")]
+
+    a = analysis("""state c <<choice>>
+[*] --> c
+c --> B : [x > 0]
+c --> [*] : [else]
+B --> [*]""")
+    assert a.lint() == []
+
+
+def test_large_chain():
+    states = 3000
+    lines = ["[*] --> S0"] + [f"S{i} --> S{i + 1}" for i in range(states)] + [f"S{states} --> S1000"]
+    a = analysis("\n".join(lines))
+    assert a.unreachable() == []
+    assert a.traps() == [sorted(f"S{i}" for i in range(1000, states + 1))]
+    assert len(a.components()) == len(a.compiled.names) - (states - 1000)
@@ -0,0 +1,49 @@
+import pusta
+from pusta.builder import StatechartBuilder
+
+import logging
+import os
+
+test_path = os.path.dirname(__file__)
+diagram_path = os.path.join(test_path, "diagrams")
+
+
+class CountingBuilder(StatechartBuilder):
+    def __init__(self):
+        super().__init__()
+        self.transitions = 0
+
+    def consume_TransitionExpression(self, transition):
+        self.transitions += 1
+        super().consume_TransitionExpression(transition)
+
+
+def test_dispatch_overrides():
+    for engine in pusta.Pusta._engines:
+        diagram = pusta.Pusta(engine=engine).parse("@startuml\n[*] --> A\nA --> B : go\nB --> [*]\n@enduml\n")
+        builder = CountingBuilder()
+        builder.consume_diagram(diagram)
+        assert builder.transitions == 3
+        assert str(builder.statechart) == str(diagram.transform())
+
+        builder = CountingBuilder()
+        descriptions = []
+        builder.consume_TransitionExpression = lambda transition: descriptions.append(transition.description)
+        builder.consume_diagram(diagram)
+        assert builder.transitions == 0
+        assert descriptions == [None, "go", None]
+
+
+def test_notes_are_ignored(caplog):
+    with caplog.at_level(logging.ERROR):
+        parser = pusta.Pusta(engine="fast")
+        statechart = parser.parse_file(os.path.join(diagram_path, "notes.pu")).transform()
+    assert not caplog.records
+    assert sorted(s.name for s in statechart.get_states()) == ["Active", "Inactive", "InitialState"]
+
+
+def test_parallel_state_restores_parent():
+    statechart = pusta.Pusta(engine="fast").parse(
+        "@startuml\nstate P {\n  [*] --> A\n  --\n  [*] --> B\n}\nP --> Done\n@enduml\n").transform()
+    [done] = statechart.get_contents_by_name("Done")
+    assert done.parent is statechart
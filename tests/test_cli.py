@@ -0,0 +1,103 @@
+import pusta
+from pusta.cli import *
+
+import io
+import json
+import os
+import pytest
+
+test_path = os.path.dirname(__file__)
+diagram_path = os.path.join(test_path, "diagrams")
+
+
+@pytest.fixture
+def tree(tmp_path):
+    (tmp_path / "lib").mkdir()
+    (tmp_path / "lib" / "states.iuml").write_text("A --> B\n")
+    (tmp_path / "a.pu").write_text("@startuml\n!include lib/states.iuml\n[*] --> A\n@enduml\n")
+    (tmp_path / "b.puml").write_text("@startuml\n[*] --> X\n@enduml\n")
+    return tmp_path
+
+
+def test_commands(tmp_path, capsys):
+    path = os.path.join(diagram_path, "history_states.pu")
+    assert main(["parse", path]) == 0
+    record = json.loads(capsys.readouterr().out)
+    assert record["path"] == path and record["ok"] and "parse" in record["phases"]
+
+    assert main(["transform", path]) == 0
+    assert capsys.readouterr().out == str(pusta.Pusta(engine="fast").parse_file(path).transform())
+
+    assert main(["export", path, "--name", "history"]) == 0
+    assert '<scxml xmlns="http://www.w3.org/2005/07/scxml" version="1.0"' in capsys.readouterr().out
+    assert main(["export", "-f", "c", "-o", str(tmp_path / "c"), path]) == 0
+    assert sorted(os.listdir(tmp_path / "c")) == ["history_states.c", "history_states.h"]
+
+    (tmp_path / "bad.pu").write_text("@startuml\nA -> -> B\n@enduml\n")
+    assert main(["transform", path, str(tmp_path / "bad.pu")]) == 1
+    assert "bad.pu" in capsys.readouterr().err
+
+
+def test_build_transforms_once(tmp_path, monkeypatch):
+    calls = []
+    consume_diagram = pusta.builder.StatechartBuilder.consume_diagram
+    monkeypatch.setattr(pusta.builder.StatechartBuilder, "consume_diagram",
+                        lambda self, diagram: calls.append(diagram) or consume_diagram(self, diagram))
+    path = os.path.join(diagram_path, "history_states.pu")
+    for fmt in FORMATS:
+        calls.clear()
+        record, _ = pusta.cli._build(path, fmt=fmt, target=str(tmp_path / fmt), parser=pusta.Pusta())
+        assert record["ok"]
+        assert len(calls) == 1
+
+
+def records(stream):
+    lines = stream.getvalue().splitlines()
+    stream.seek(0)
+    stream.truncate()
+    return [json.loads(line) for line in lines]
+
+
+def test_watch_rebuilds_dependents(tree):
+    stream = io.StringIO()
+    with Watch(pusta.Pusta(engine="fast"), tree, workers=1, fmt="text", output=tree / "out", poll=True,
+               stream=stream) as watch:
+        watch.build(watch.diagrams())
+        built = records(stream)
+        assert [r["path"] for r in built[:-1]] == [str(tree / "a.pu"), str(tree / "b.puml")]
+        assert built[-1] == dict(event="batch", files=2, failed=0, ms=built[-1]["ms"])
+        assert "Transition -> B" in (tree / "out" / "a.txt").read_text()
+        assert watch.dependents(tree / "lib" / "states.iuml") == {str(tree / "a.pu")}
+
+        (tree / "lib" / "states.iuml").write_text("A --> C\n")
+        assert [r["path"] for r in watch.update([str(tree / "lib" / "states.iuml")])] == [str(tree / "a.pu")]
+        assert "Transition -> C" in (tree / "out" / "a.txt").read_text()
+
+        os.remove(tree / "b.puml")
+        (tree / "a.pu").write_text("@startuml\n[*] --> A\n@enduml\n")
+        watch.update([str(tree / "b.puml"), str(tree / "a.pu")])
+        assert [r["event"] for r in records(stream)] == ["build", "batch", "removed", "build", "batch"]
+        assert watch.dependents(tree / "lib" / "states.iuml") == set()
+
+
+@pytest.mark.parametrize("poll", [True, False])
+def test_watcher(tree, poll):
+    w = watcher(tree, poll=poll, interval=0.01)
+    try:
+        assert isinstance(w, PollingWatcher) == poll or not hasattr(os, "O_CLOEXEC")
+        assert w.poll(0.05) == set()
+        (tree / "lib" / "states.iuml").write_text("A --> D\n")
+        (tree / "c.pu").write_text("@startuml\n@enduml\n")
+        assert w.poll(1) | w.poll(0.05) == {str(tree / "lib" / "states.iuml"), str(tree / "c.pu")}
+    finally:
+        w.close()
+
+
+def test_debounce(tree):
+    stream = io.StringIO()
+    with Watch(pusta.Pusta(engine="fast"), tree, workers=1, poll=True, interval=0.01, debounce=0.1,
+               stream=stream) as watch:
+        assert watch.changes(timeout=0.05) == set()
+        (tree / "a.pu").write_text("@startuml\n[*] --> A\n@enduml\n")
+        (tree / "b.puml").write_text("@startuml\n[*] --> Y\n@enduml\n")
+        assert watch.changes(timeout=1) == {str(tree / "a.pu"), str(tree / "b.puml")}
@@ -0,0 +1,143 @@
+import pusta
+from pusta.codegen import identifier, unique_identifiers
+from pusta.codegen.c import CGenerator, generate
+from pusta.runtime import Machine, compile_statechart
+
+import io
+import os
+import random
+import shutil
+import subprocess
+import pytest
+
+parser = pusta.Pusta()
+
+test_path = os.path.dirname(__file__)
+diagram_path = os.path.join(test_path, "diagrams")
+diagrams = sorted(f[:-3] for f in os.listdir(diagram_path) if f.endswith(".pu"))
+
+cc = shutil.which("cc")
+
+
+# Guards, actions, history, choices and parallel regions, the test diagrams have few guards and actions
+GUARDED = """@startuml
+[*] --> Idle
+Idle --> Busy : start / open
+state Busy {
+  state Check <<choice>>
+  [*] --> Work
+  Work --> Check : step [ready] / log
+  Check --> Done : [retry]
+  Check --> Work : [else]
+  Work --> Deep : dive
+  state Deep {
+    [*] --> D1
+    D1 --> D2 : step
+  }
+}
+Busy --> Paused : pause
+Paused --> Busy[H*] : resume
+Paused --> Busy[H] : shallow
+Busy --> Paused : stop [else]
+Busy --> Idle : stop [ready] / close
+state Par {
+  [*] --> A1
+  A1 --> A2 : step
+  --
+  [*] --> B1
+  B1 --> B2 : step [ready]
+}
+Idle --> Par : fork
+Par --> Idle : stop
+@enduml"""
+
+
+def statechart(name):
+    if name == "guarded":
+        return parser.parse(GUARDED).transform()
+    return parser.parse_file(os.path.join(diagram_path, f"{name}.pu")).transform()
+
+
+def test_identifier():
+    assert identifier("State3.0.HistoryState") == "State3_0_HistoryState"
+    assert identifier("New Data") == "New_Data"
+    assert identifier("0") == "_0"
+    assert unique_identifiers(["a b", "a.b", "c"], "P_") == {"a b": "P_a_b", "a.b": "P_a_b_2", "c": "P_c"}
+
+
+def test_generate():
+    generator = CGenerator(statechart("guarded"), "machine")
+    header = io.StringIO()
+    generator.write_header(header)
+    source = io.StringIO()
+    generator.write_source(source)
+    assert "MACHINE_EVENT_resume," in header.getvalue()
+    assert "MACHINE_STATE_Busy_0_DeepHistoryState," in header.getvalue()
+    assert generator.guard_identifiers == {"ready": "MACHINE_GUARD_ready", "retry": "MACHINE_GUARD_retry"}
+    assert "MACHINE_ACTION_log," in header.getvalue()
+    assert "#define MACHINE_REGION_COUNT 5" in header.getvalue()
+    assert 'const char *const machine_action_names[] = {"open", "close", "log"};' in source.getvalue()
+    assert "switch" not in source.getvalue()
+
+
+def guard(name, event, calls):
+    # The same in C and Python, completion transitions have the last event id
+    return (len(name.encode("utf-8")) + event + calls) % 3 != 0
+
+
+@pytest.mark.skipif(cc is None, reason="no C compiler")
+@pytest.mark.parametrize("name", diagrams + ["guarded"])
+def test_compiled_matches_runtime(name, tmp_path):
+    compiled = compile_statechart(statechart(name))
+    generator = CGenerator(compiled, "chart")
+    generator.write(tmp_path)
+    states = list(generator.state_identifiers.items())
+    rng = random.Random(0)
+    events = [rng.randrange(len(compiled.event_names)) for _ in range(200)] if compiled.event_names else []
+
+    checks = "".join(f'    if (chart_is_in(m, {ident})) printf("{state} ");\n' for state, ident in states)
+    main = tmp_path / "main.c"
+    main.write_text(
+        '#include <stdio.h>\n#include <string.h>\n#include "chart.h"\n'
+        f"static const int events[] = {{{', '.join(map(str, events)) or '0'}}};\n"
+        "static int guard(void *context, chart_guard_t g, chart_event_t e)\n{\n"
+        "    int *calls = context;\n"
+        "    return (strlen(chart_guard_names[g]) + e + (*calls)++) % 3 != 0;\n}\n"
+        "static void action(void *context, chart_action_t a, chart_event_t e)\n{\n"
+        "    (void)context;\n    (void)e;\n"
+        '    printf("/%s ", chart_action_names[a]);\n}\n'
+        f"static void print(const chart_t *m)\n{{\n{checks}"
+        '    printf("\\n");\n}\n'
+        "int main(void)\n{\n    chart_t m;\n    int calls = 0;\n"
+        "    chart_init(&m, guard, action, &calls);\n    print(&m);\n"
+        f"    for (int i = 0; i < {len(events)}; i++) {{\n"
+        "        if (chart_dispatch(&m, (chart_event_t)events[i]) < 0)\n            return 1;\n"
+        "        print(&m);\n    }\n    return 0;\n}\n")
+    binary = tmp_path / "chart"
+    flags = ["-std=c99", "-Wall", "-Wextra", "-pedantic", "-Werror"]
+    subprocess.run([cc, *flags, "-o", str(binary), str(main), str(tmp_path / "chart.c")], check=True)
+    output = subprocess.run([str(binary)], check=True, capture_output=True, text=True).stdout.splitlines()
+
+    actions = []
+    calls = []
+    completion = len(compiled.event_names)
+
+    def count(g, e, p):
+        calls.append(g)
+        return guard(g, completion if e is None else compiled.events[e], len(calls) - 1)
+
+    m = Machine(compiled, guard=count, action=lambda a, e, p: actions.append(f"/{a}")).start()
+    expected = [" ".join(actions + [n for n, _ in states if n in m.configuration])]
+    for e in events:
+        actions.clear()
+        m.dispatch(compiled.event_names[e])
+        expected.append(" ".join(actions + [n for n, _ in states if n in m.configuration]))
+    assert [line.strip() for line in output] == expected
+    if name == "guarded":
+        assert any("/log" in line for line in expected) and any("D2" in line for line in expected)
+
+
+def test_write(tmp_path):
+    header, source = generate(statechart("simple_state"), tmp_path, "Simple State")
+    assert os.path.basename(header) == "simple_state.h"
+    assert '#include "simple_state.h"' in open(source).read()
@@ -0,0 +1,155 @@
+import pusta
+from pusta.delta import *
+
+import os
+
+parser = pusta.Pusta(engine="fast")
+
+test_path = os.path.dirname(__file__)
+diagram_path = os.path.join(test_path, "diagrams")
+
+
+def transform(text):
+    return parser.parse(f"@startuml\n{text}\n@enduml\n").transform()
+
+
+def lines(delta):
+    return str(delta).splitlines()
+
+
+def test_equal(file):
+    a = parser.parse_file(file).transform()
+    b = parser.parse_file(file).transform()
+    assert fingerprint(a) == fingerprint(b)
+    assert not pusta.diff(a, b)
+    assert str(pusta.diff(a, b)) == ""
+
+
+def test_diff():
+    a = transform("""[*] --> A
+A --> B : go
+B --> A : back
+state C {
+  [*] --> C1
+  C1 --> C2
+}
+state D {
+  [*] --> D1
+}
+A --> C""")
+    b = transform("""[*] --> A
+A --> B : run
+state C {
+  [*] --> C1
+  C1 --> C2
+  C2 --> C3
+  state D {
+    [*] --> D1
+  }
+}
+A --> C
+A --> E""")
+    delta = pusta.diff(a, b)
+    assert lines(delta) == [
+        "+ State C3",
+        "+ State E",
+        "+ Transition A -> E",
+        "+ Transition C2 -> C3",
+        "- Transition B -> A",
+        "> State D: Statechart -> Region C.0",
+        "~ Transition A -> B: 'go' -> 'run'",
+    ]
+    assert delta.moved[0][0].root is a and delta.moved[0][1].root is b
+    assert lines(pusta.diff(b, a))[:3] == ["+ Transition B -> A", "- State C3", "- State E"]
+
+
+def test_removed_parent():
+    # The children of a removed composite state are found in their new place
+    a = transform("""state P {
+  state Q {
+    [*] --> Q1
+  }
+  [*] --> Q
+}
+[*] --> P""")
+    b = transform("""state Q {
+  [*] --> Q1
+}
+[*] --> Q""")
+    assert lines(pusta.diff(a, b)) == [
+        "+ Transition InitialState -> Q",
+        "- InitialState P.0.InitialState",
+        "- Region P.0",
+        "- State P",
+        "- Transition InitialState -> P",
+        "- Transition P.0.InitialState -> Q",
+        "> State Q: Region P.0 -> Statechart",
+    ]
+
+
+def test_kinds_and_duplicates():
+    a = transform("""state X <<choice>>
+[*] --> X
+X --> Y : [a]
+X --> Y : [a]""")
+    b = transform("""[*] --> X
+X --> Y : [a]
+X --> Y : x""")
+    assert lines(pusta.diff(a, b)) == [
+        "+ State X",
+        "+ Transition X -> Y",
+        "+ Transition X -> Y",
+        "- Choice X",
+        "- Transition X -> Y",
+        "- Transition X -> Y",
+    ]
+    c = transform("""[*] --> X
+X --> Y : [a]""")
+    assert lines(pusta.diff(b, c)) == ["- Transition X -> Y"]
+
+
+def test_changes_after_diff():
+    path = os.path.join(diagram_path, "composite_states_2.pu")
+    a = parser.parse_file(path).transform()
+    b = parser.parse_file(path).transform()
+    assert not pusta.diff(a, b)
+    state = b.get_contents_of_type(State)[-1]
+    state.label = "changed"
+    t = Transition("new")
+    t.destination = state
+    t.source = state
+    delta = pusta.diff(a, b)
+    assert [n for n in delta.added] == [t] and [p[1] for p in delta.relabelled] == [state]
+    t.label = None
+    state.remove_child(t)
+    state.label = None if a.get_contents_by_name(state.name)[0].label is None else \
+        a.get_contents_by_name(state.name)[0].label._label
+    assert not pusta.diff(a, b)
+
+
+def test_region_move():
+    # Transitions name pseudo states by a fully qualified name which changes with the region of the pseudo state
+    a = Statechart()
+    b = Statechart()
+    for chart in (a, b):
+        for name in ("A", "B"):
+            state = State(name)
+            chart.add_child(state)
+            region = Region("0")
+            state.add_child(region)
+        t = Transition()
+        t.destination = chart.get_contents_by_name("A")[0].get_regions()[0].create_final_state()
+        t.source = chart.get_contents_by_name("B")[0]
+    assert not pusta.diff(a, b)
+    b_a, b_b = b.get_contents_by_name("A")[0], b.get_contents_by_name("B")[0]
+    region = b_a.get_regions()[0]
+    b_a.remove_child(region)
+    b_b.remove_child(b_b.get_regions()[0])
+    b_b.add_child(region)
+    b_a.add_child(Region("0"))
+    assert lines(pusta.diff(a, b)) == [
+        "+ FinalState B.0.FinalState",
+        "+ Transition B -> B.0.FinalState",
+        "- FinalState A.0.FinalState",
+        "- Transition B -> A.0.FinalState",
+    ]
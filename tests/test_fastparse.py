@@ -0,0 +1,40 @@
+import pusta
+import pusta.fastparse
+import textx
+import pytest
+
+textx_parser = pusta.Pusta()
+fast_parser = pusta.Pusta(engine="fast")
+
+
+def normalize(o):
+    if hasattr(o, "_tx_attrs"):
+        return o.__class__.__name__, [(a, normalize(getattr(o, a))) for a in o._tx_attrs]
+    if isinstance(o, pusta.fastparse.Expression):
+        return o.__class__.__name__, [(a, normalize(getattr(o, a))) for a in o.__slots__]
+    if isinstance(o, list):
+        return [normalize(x) for x in o]
+    return o.__class__.__name__, o
+
+
+def test_fast_model(file):
+    expected = textx_parser.parse_file(file)
+    diagram = fast_parser.parse_file(file)
+    assert isinstance(diagram._model, pusta.fastparse.Diagram)
+    assert normalize(diagram._model) == normalize(expected._model)
+    assert str(diagram.transform()) == str(expected.transform())
+
+
+def test_fast_parse_error():
+    with pytest.raises(pusta.fastparse.FastParseError):
+        pusta.fastparse.FastParser().parse("@startuml\nA --> \n@enduml\n")
+
+
+def test_fallback_to_textx():
+    with pytest.raises(textx.TextXSyntaxError):
+        fast_parser.parse("@startuml\nA --> \n@enduml\n")
+
+
+def test_unknown_engine():
+    with pytest.raises(ValueError):
+        pusta.Pusta(engine="foo")
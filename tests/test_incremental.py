@@ -0,0 +1,243 @@
+import pusta
+from pusta.incremental import IncrementalDiagram, split_blocks
+
+import os
+import random
+import pytest
+
+parser = pusta.Pusta(engine="fast")
+
+test_path = os.path.dirname(__file__)
+diagram_path = os.path.join(test_path, "diagrams")
+diagrams = sorted(f[:-3] for f in os.listdir(diagram_path) if f.endswith(".pu"))
+
+
+def read(name):
+    with open(os.path.join(diagram_path, f"{name}.pu")) as f:
+        return f.read()
+
+
+def full(text):
+    return parser.parse(text).transform()
+
+
+def transitions(statechart):
+    return {s.fqn(): [(t.destination.fqn(), t.label) for t in s.get_transitions()]
+            for s in statechart.get_contents_of_type(pusta.statechart.AbstractState)}
+
+
+def assert_transformed(diagram):
+    expected = full(diagram.text)
+    assert str(diagram.statechart) == str(expected)
+    assert transitions(diagram.statechart) == transitions(expected)
+
+
+def test_split_blocks():
+    text = read("composite_states_1")
+    blocks = [text[s:e] for s, e in split_blocks(text, len("@startuml"), text.rindex("@enduml"))]
+    assert "".join(blocks) == text[len("@startuml"):text.rindex("@enduml")]
+    composite = [b for b in blocks if b.startswith("state A {")]
+    assert len(composite) == 1 and composite[0].rstrip().endswith("}")
+
+
+def test_split_notes():
+    text = "@startuml\nnote left of A\n  state B {\nend note\nA --> B\n@enduml"
+    blocks = [text[s:e] for s, e in split_blocks(text, len("@startuml\n"), text.rindex("@enduml"))]
+    assert blocks == ["note left of A\n  state B {\nend note\n", "A --> B\n"]
+
+
+@pytest.mark.parametrize("name", diagrams)
+def test_initial_transform(name):
+    assert_transformed(IncrementalDiagram(read(name)))
+
+
+def test_local_edits():
+    text = "@startuml\n[*] --> A\nA --> B : go\nB --> A : back\n@enduml\n"
+    diagram = IncrementalDiagram(text)
+    statechart = diagram.statechart
+    b = statechart.get_contents_by_name("B")[0]
+
+    pos = text.index("B --> A")
+    result = diagram.apply_edit((pos, pos), "B --> C : on\n")
+    assert not result.rebuilt
+    assert diagram.statechart is statechart
+    assert [s.name for s in result.added if isinstance(s, pusta.statechart.State)] == ["C"]
+    assert result.changed == [b]
+    assert [t.destination.name for t in b.get_transitions()] == ["C", "A"]
+    assert_transformed(diagram)
+
+    pos = diagram.text.index("B --> C : on") + len("B --> C : ")
+    result = diagram.apply_edit((pos, pos + 2), "off")
+    assert not result.rebuilt
+    assert b.get_transitions()[0].label == "off"
+    assert_transformed(diagram)
+
+    pos = diagram.text.index("B --> C")
+    result = diagram.apply_edit((pos, pos + len("B --> C : off\n")), "")
+    assert not result.rebuilt
+    assert sorted(n.__class__.__name__ for n in result.removed) == ["State", "Transition"]
+    assert_transformed(diagram)
+
+    # B is created by the first transition and used by the others, the next one takes it over and gives it back
+    pos = diagram.text.index("A --> B")
+    result = diagram.apply_edit((pos, pos + len("A --> B : go\n")), "")
+    assert not result.rebuilt
+    assert diagram.statechart.get_contents_by_name("B") == [b]
+    assert_transformed(diagram)
+    result = diagram.apply_edit((pos, pos), "A --> B : go\n")
+    assert not result.rebuilt
+    assert b in result.changed
+    assert_transformed(diagram)
+
+
+def test_transitions_between_states():
+    text = "@startuml\n[*] --> S0\nS0 --> S1 : a\nS2 --> S1 : b\nS1 --> S2 : c\nS2 --> S0 : d\n@enduml\n"
+    diagram = IncrementalDiagram(text)
+    for line in ("S0 --> S1 : a\n", "S2 --> S1 : b\n", "S1 --> S2 : c\n", "[*] --> S0\n"):
+        pos = diagram.text.index(line)
+        for edit in (((pos, pos + len(line)), ""), ((pos, pos), line)):
+            assert not diagram.apply_edit(*edit).rebuilt
+            assert_transformed(diagram)
+            expected = full(diagram.text)
+            assert [s.name for s in diagram.statechart.get_states()] == [s.name for s in expected.get_states()]
+
+
+def test_state_first_used_in_composite():
+    # Without the first transition B is created in C
+    text = "@startuml\nA --> B\nstate C {\n  B --> D\n}\n@enduml\n"
+    diagram = IncrementalDiagram(text)
+    result = diagram.apply_edit((len("@startuml\n"), len("@startuml\nA --> B\n")), "")
+    assert result.rebuilt
+    assert_transformed(diagram)
+
+
+def test_descriptions():
+    text = "@startuml\nA --> B\nA : first\nA : second\n@enduml\n"
+    diagram = IncrementalDiagram(text)
+    pos = diagram.text.index("A : first")
+    result = diagram.apply_edit((pos, pos + len("A : first\n")), "")
+    a = diagram.statechart.get_contents_by_name("A")[0]
+    assert not result.rebuilt
+    assert a in result.changed
+    assert a.label == "second"
+    assert_transformed(diagram)
+
+
+def test_label_edits():
+    text = read("transition_description")
+    diagram = IncrementalDiagram(text)
+    statechart = diagram.statechart
+    pos = diagram.text.index("EvNewValueSaved")
+    result = diagram.apply_edit((pos, pos + len("EvNewValueSaved")), "EvSaved")
+    assert not result.rebuilt
+    assert [t.label for t in result.changed] == ["EvSaved"]
+    assert diagram.statechart is statechart
+    assert_transformed(diagram)
+
+    text = "@startuml\nstate A {\n  A1 --> A2 : go\n  A1 : first\n}\nA --> B\n@enduml\n"
+    diagram = IncrementalDiagram(text)
+    pos = diagram.text.index("first")
+    result = diagram.apply_edit((pos, pos + len("first")), "second")
+    assert not result.rebuilt
+    assert [s.name for s in result.changed] == ["A1"]
+    assert_transformed(diagram)
+
+
+def test_composite_edit():
+    text = read("composite_states_2")
+    diagram = IncrementalDiagram(text)
+    pos = diagram.text.index("NewValueSelection --> NewValuePreview")
+    diagram.apply_edit((pos, pos), "NewValueSelection --> Idle : EvCancel\n  ")
+    assert_transformed(diagram)
+
+    # The composite state is used by later blocks and taken over by the edited block
+    text = "@startuml\nstate A {\n  [*] --> A1\n}\nB --> A\nA --> B\n@enduml\n"
+    diagram = IncrementalDiagram(text)
+    a = diagram.statechart.get_contents_by_name("A")[0]
+    pos = diagram.text.index("}")
+    result = diagram.apply_edit((pos, pos), "  A1 --> A2\n")
+    assert not result.rebuilt
+    assert diagram.statechart.get_contents_by_name("A") == [a]
+    assert a in result.changed
+    assert_transformed(diagram)
+
+
+def test_non_local_edit_rebuilds():
+    text = "@startuml\nA --> c\nstate c <<choice>>\nc --> B\n@enduml\n"
+    diagram = IncrementalDiagram(text)
+    pos = diagram.text.index("state c")
+    result = diagram.apply_edit((pos, pos + len("state c <<choice>>\n")), "")
+    assert result.rebuilt
+    assert [(s.name, type(s)) for s in result.changed] == [("c", pusta.statechart.State)]
+    assert_transformed(diagram)
+
+
+def test_rebuild_keeps_old_statechart():
+    text = "@startuml\n[*] --> A\nA --> B : go\nB --> C\nC : busy\n@enduml\n"
+    diagram = IncrementalDiagram(text)
+    old = diagram.statechart
+    before = str(old)
+    pos = diagram.text.index("A --> B")
+    # Patched in before it turns out to use a state of a later block
+    result = diagram.apply_edit((pos, pos), "C --> A : back\nC : idle\n")
+    assert result.rebuilt
+    assert diagram.statechart is not old
+    assert str(old) == before == str(full(text))
+    assert transitions(old) == transitions(full(text))
+    assert_transformed(diagram)
+
+
+@pytest.mark.parametrize("anchor, offset, text", [
+    ("S37 : Ev9", len("S37 : "), "\n"),
+    ("S38 : Ev9", len("S38"), "\n"),
+    ("S2 --> S26", len("S2"), "\n "),
+    ('"a b"', 2, "\n"),
+])
+def test_expression_split_over_lines(anchor, offset, text):
+    # Blocks that only parse together with their neighbours are joined like in pusta.stream
+    diagram = IncrementalDiagram("@startuml\n[*] --> S0\nS0 --> S38 : Ev9 [x > 2]\nS2 --> S26 : Ev10\n"
+                                 "S32 --> S37 : Ev9 [x > 3]\nnote \"a b\" as N1\nS38 --> S2\n@enduml\n")
+    pos = diagram.text.index(anchor) + offset
+    diagram.apply_edit((pos, pos), text)
+    assert_transformed(diagram)
+    diagram.apply_edit((pos, pos + len(text)), "")
+    assert_transformed(diagram)
+    diagram.apply_edit((pos, pos), "\n" + text)
+    assert_transformed(diagram)
+
+
+def test_syntax_error():
+    text = "@startuml\nA --> B\n@enduml\n"
+    diagram = IncrementalDiagram(text)
+    before = str(diagram.statechart)
+    pos = diagram.text.index("B\n")
+    with pytest.raises(Exception):
+        diagram.apply_edit((pos, pos), "--> ")
+    assert str(diagram.statechart) == before
+    diagram.apply_edit((pos, pos + len("--> ")), "C\nC --> ")
+    assert_transformed(diagram)
+
+
+def test_invalid_range():
+    diagram = IncrementalDiagram("@startuml\n@enduml\n")
+    with pytest.raises(ValueError):
+        diagram.apply_edit((5, 100), "")
+
+
+@pytest.mark.parametrize("name", diagrams)
+def test_random_edits(name):
+    rng = random.Random(name)
+    diagram = IncrementalDiagram(read(name))
+    lines = [line for line in diagram.text.splitlines(True) if line.strip() and "@" not in line]
+    for _ in range(30):
+        current = diagram.text
+        offsets = [i + 1 for i, c in enumerate(current) if c == "\n" and i + 1 < current.rindex("@enduml")]
+        pos = rng.choice(offsets)
+        end = current.index("\n", pos) + 1 if rng.random() < 0.4 else pos
+        text = "" if end > pos else rng.choice(lines)
+        try:
+            full(current[:pos] + text + current[end:])
+        except Exception:
+            continue
+        diagram.apply_edit((pos, end), text)
+        assert_transformed(diagram)
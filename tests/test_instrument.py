@@ -0,0 +1,73 @@
+import pusta
+from pusta import instrument
+
+import io
+import json
+import os
+
+test_path = os.path.dirname(__file__)
+diagram_path = os.path.join(test_path, "diagrams")
+
+
+def test_profile_phases():
+    parser = pusta.Pusta(engine="fast")
+    with parser.profile() as profiler:
+        assert instrument.active() is profiler
+        statechart = parser.parse_file(os.path.join(diagram_path, "composite_states_1.pu")).transform()
+        str(statechart)
+    assert instrument.active() is None
+
+    names = {(s.category, s.name): s for s in profiler.summary()}
+    for phase in [("pusta", "read"), ("pusta", "parse"), ("pusta", "transform"), ("statechart", "render")]:
+        assert names[phase].count == 1
+    assert names[("builder", "remove_empty_regions")].count == 1
+    assert names[("builder", "consume_TransitionExpression")].count > 1
+    assert names[("builder", "consume_StateDeclarationExpression")].count == 5
+
+    events = {e.name: e for e in profiler.events}
+    transform = events["transform"]
+    handler = events["consume_StateDeclarationExpression"]
+    assert transform.start <= handler.start
+    assert handler.start + handler.duration <= transform.start + transform.duration
+    assert events["parse"].args == {"engine": "fast"}
+
+    report = io.StringIO()
+    profiler.report(report)
+    assert "builder:consume_TransitionExpression" in report.getvalue()
+
+
+def test_disabled():
+    assert instrument.active() is None
+    assert instrument.phase("transform") is instrument.phase("parse")
+    with instrument.phase("transform"):
+        pass
+
+
+def test_nested_profilers():
+    parser = pusta.Pusta()
+    with parser.profile() as outer:
+        with parser.profile(events=False) as inner:
+            parser.parse("@startuml\nA --> B\n@enduml\n")
+        assert instrument.active() is outer
+        parser.parse("@startuml\nA --> B\n@enduml\n")
+    assert inner.events == []
+    assert [s.count for s in inner.summary() if s.name == "parse"] == [1]
+    assert [s.count for s in outer.summary() if s.name == "parse"] == [1]
+
+
+def test_callback_and_chrome_trace(tmp_path):
+    seen = []
+    parser = pusta.Pusta(engine="fast")
+    with parser.profile(callback=seen.append) as profiler:
+        parser.parse("@startuml\n[*] --> A\nA --> B : go\n@enduml\n").transform()
+    assert seen == profiler.events
+
+    path = tmp_path / "trace.json"
+    profiler.write_chrome_trace(str(path))
+    trace = json.loads(path.read_text())
+    events = trace["traceEvents"]
+    assert len(events) == len(profiler.events)
+    for event in events:
+        assert event["ph"] == "X"
+        assert {"name", "cat", "ts", "dur", "pid", "tid"} <= set(event)
+        assert "allocations" in event["args"]
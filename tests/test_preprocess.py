@@ -0,0 +1,129 @@
+import pusta
+from pusta.preprocess import Preprocessor, PreprocessorError
+
+import concurrent.futures
+import os
+import pytest
+
+
+def write(path, text):
+    path.write_text(text)
+    return str(path)
+
+
+@pytest.fixture
+def files(tmp_path):
+    (tmp_path / "lib").mkdir()
+    write(tmp_path / "lib" / "common.puml", """@startuml
+!startsub STATES
+state Idle
+state Busy
+!endsub
+Busy --> Idle : DONE
+@enduml
+""")
+    write(tmp_path / "lib" / "macros.iuml", """!define RUN(a, b) a --> b : run
+!define EVENT GO
+""")
+    write(tmp_path / "a.pu", """@startuml
+!include lib/common.puml
+!include lib/macros.iuml
+[*] --> Idle
+Idle --> Busy : EVENT
+RUN(Busy, Idle)
+@enduml
+""")
+    write(tmp_path / "b.pu", """@startuml
+!includesub lib/common.puml!STATES
+!include_once lib/macros.iuml
+!include_once lib/macros.iuml
+[*] --> Busy
+@enduml
+""")
+    return tmp_path
+
+
+def test_include_and_define(files):
+    preprocessor = Preprocessor()
+    text = preprocessor.process_file(files / "a.pu")
+    assert text == """@startuml
+state Idle
+state Busy
+Busy --> Idle : DONE
+[*] --> Idle
+Idle --> Busy : GO
+Busy --> Idle : run
+@enduml
+"""
+    assert preprocessor.process_file(files / "b.pu") == "@startuml\nstate Idle\nstate Busy\n[*] --> Busy\n@enduml\n"
+    # The included files are read once for both diagrams
+    assert preprocessor.reads == 4
+
+
+def test_parse_file(files):
+    expected = pusta.Pusta(engine="fast").parse(Preprocessor().process_file(files / "a.pu")).transform()
+    for engine in ("textx", "fast"):
+        parser = pusta.Pusta(engine=engine)
+        path = str(files / "a.pu")
+        assert str(parser.parse_file(path).transform()) == str(expected)
+        assert str(parser.transform_file(path)) == str(expected)
+        assert parser.preprocessor.dependencies(path) == {str(files / "lib" / "common.puml"),
+                                                          str(files / "lib" / "macros.iuml")}
+
+
+def test_dependents(files):
+    preprocessor = Preprocessor()
+    preprocessor.process_file(files / "a.pu")
+    preprocessor.process_file(files / "b.pu")
+    common = files / "lib" / "common.puml"
+    assert preprocessor.dependents(common) == {str(files / "a.pu"), str(files / "b.pu")}
+    assert preprocessor.invalidate(files / "a.pu") == {str(files / "a.pu")}
+
+    write(common, "state Idle\nstate Busy\nstate Done\n!startsub STATES\nstate Idle\n!endsub\n")
+    assert preprocessor.invalidate(common) == {str(files / "a.pu"), str(files / "b.pu")}
+    assert "state Done" in preprocessor.process_file(files / "a.pu")
+    assert "state Busy" not in preprocessor.process_file(files / "b.pu")
+
+
+def test_threads(files):
+    preprocessor = Preprocessor()
+    text = (files / "a.pu").read_text()
+    paths = [str(files / f"d{i}.pu") for i in range(200)]
+    common = files / "lib" / "common.puml"
+
+    def process(path):
+        result = preprocessor.process_text(text, path)
+        preprocessor.dependents(common)
+        return result
+
+    with concurrent.futures.ThreadPoolExecutor(8) as executor:
+        results = list(executor.map(process, paths))
+    assert len(set(results)) == 1
+    assert preprocessor.dependents(common) == set(paths)
+
+
+def test_macros():
+    text = Preprocessor().process_text("""@startuml
+!define PREFIX S_
+!define MOVE(a, b, e) a --> b : e
+MOVE(A, B, PREFIX)
+!undef PREFIX
+MOVE(B, A)
+PREFIXED --> A
+@enduml
+""")
+    assert text.splitlines()[1:-1] == ["A --> B : S_", "B --> A : ", "PREFIXED --> A"]
+
+
+def test_errors(tmp_path):
+    write(tmp_path / "a.pu", "@startuml\n!include b.pu\n@enduml\n")
+    write(tmp_path / "b.pu", "!include a.pu\n")
+    with pytest.raises(PreprocessorError, match="cycle"):
+        Preprocessor().process_file(tmp_path / "a.pu")
+    with pytest.raises(PreprocessorError, match="not found") as e:
+        Preprocessor().process_text("@startuml\n!include missing.pu\n@enduml\n", os.path.join(tmp_path, "c.pu"))
+    assert e.value.line == 2
+    with pytest.raises(PreprocessorError, match="no sub"):
+        Preprocessor().process_text(f"!includesub {tmp_path / 'b.pu'}!X\n")
+    with pytest.raises(PreprocessorError, match="Unsupported directive !ifdef"):
+        pusta.Pusta(engine="fast").parse("@startuml\n!ifdef X\n@enduml\n")
@@ -0,0 +1,120 @@
+import pusta
+
+
+def test_metamodel_cache():
+    cache = pusta.MetamodelCache()
+    first = cache.get(pusta.Pusta._grammar_path)
+    second = cache.get(pusta.Pusta._grammar_path)
+    assert first is second
+    assert cache.misses == 1
+    assert cache.hits == 1
+
+    cache.clear()
+    assert cache.get(pusta.Pusta._grammar_path) is not first
+    assert cache.misses == 1
+
+
+def test_pusta_shares_metamodel():
+    assert pusta.Pusta()._parser is pusta.Pusta()._parser
+
+
+def test_parse_files(tmp_path):
+    good = tmp_path / "good.pu"
+    good.write_text("@startuml\n[*] --> State1\nState1 --> [*]\n@enduml\n")
+    bad = tmp_path / "bad.pu"
+    bad.write_text("@startuml\nthis is not a diagram\n@enduml\n")
+    paths = [str(good), str(bad), str(good)]
+
+    parser = pusta.Pusta()
+    expected = str(parser.parse_file(str(good)).transform())
+
+    for workers in [1, 2]:
+        results = list(parser.parse_files(paths, workers=workers))
+        assert [r.path for r in results] == paths
+        assert [r.ok for r in results] == [True, False, True]
+        assert str(results[0].statechart) == expected
+        assert results[1].statechart is None
+
+    results = list(parser.parse_files(paths, workers=2, ordered=False))
+    assert sorted(r.path for r in results) == sorted(paths)
+
+
+def test_parse_files_large(tmp_path):
+    # Pickling the object graph of a statechart this size recurses too deep, results are shipped serialized
+    diagram = tmp_path / "large.pu"
+    diagram.write_text("@startuml\n[*] --> S0\n" + "".join(f"S{i} --> S{i + 1}\n" for i in range(6000)) + "@enduml\n")
+    parser = pusta.Pusta(engine="fast")
+    result, = parser.parse_files([str(diagram)], workers=2)
+    assert result.ok
+    assert str(result.statechart) == str(parser.transform_file(str(diagram)))
+
+
+def test_parse_cache(tmp_path):
+    diagram = tmp_path / "diagram.pu"
+    diagram.write_text("@startuml\n[*] --> State1\nState1 --> [*] : done\n@enduml\n")
+    cache_dir = str(tmp_path / "cache")
+
+    parser = pusta.Pusta(cache_dir=cache_dir)
+    expected = str(parser.parse_file(str(diagram)).transform())
+    assert parser.cache.misses == 1
+
+    parser = pusta.Pusta(engine="fast", cache_dir=cache_dir)
+    cached = parser.parse_file(str(diagram))
+    assert parser.cache.hits == 1
+    assert cached._statechart is not None
+    assert str(cached.transform()) == expected
+    assert cached._model is not None
+
+    diagram.write_text("@startuml\n[*] --> State2\n@enduml\n")
+    assert "State2" in str(parser.parse_file(str(diagram)).transform())
+    assert parser.cache.misses == 1
+
+
+def test_parse_cache_file_changed(tmp_path):
+    # The model is parsed from the text that was read and hashed, not from the file read again
+    diagram = tmp_path / "diagram.pu"
+    diagram.write_text("@startuml\n[*] --> State1\n@enduml\n")
+
+    def change(event):
+        if event.name == "read":
+            diagram.write_text("@startuml\n[*] --> State2\n@enduml\n")
+
+    for cache_dir in [None, str(tmp_path / "cache")]:
+        parser = pusta.Pusta(cache_dir=cache_dir)
+        with parser.profile(change):
+            assert "State1" in str(parser.parse_file(str(diagram)).transform())
+        diagram.write_text("@startuml\n[*] --> State1\n@enduml\n")
+    assert "State1" in str(parser.parse_file(str(diagram)).transform())
+    assert parser.cache.hits == 1
+
+
+def test_parse_cache_eviction(tmp_path):
+    parser = pusta.Pusta(cache_dir=str(tmp_path), cache_size=1)
+    for i in range(3):
+        parser.parse(f"@startuml\n[*] --> State{i}\n@enduml\n").transform()
+    assert len(list(tmp_path.iterdir())) == 0
+
+    cache = pusta.cache.ParseCache(str(tmp_path))
+    statechart = pusta.Pusta().parse("@startuml\n[*] --> A\n@enduml\n").transform()
+    cache.put("a", statechart)
+    assert str(cache.get("a")) == str(statechart)
+    assert cache.get("b") is None
+    assert cache.size() > 0
+    cache.clear()
+    assert cache.size() == 0
+
+
+def test_parse_cache_put(tmp_path, monkeypatch):
+    statechart = pusta.Pusta().parse("@startuml\n[*] --> A\n@enduml\n").transform()
+    entry = len(pusta.cache.dumps(statechart))
+    for max_size, listings in ((1000 * entry, 1), (20 * entry, 40)):
+        cache = pusta.cache.ParseCache(str(tmp_path / str(max_size)), max_size)
+        listed = []
+        entries = cache._entries
+        monkeypatch.setattr(cache, "_entries", lambda: listed.append(1) or entries())
+        for i in range(100):
+            cache.put(str(i), statechart)
+        cache.put("0", statechart)
+        assert len(listed) <= listings
+        assert cache.size() <= max_size
+        assert cache.get("99") is not None
@@ -0,0 +1,109 @@
+import pusta
+from pusta.runtime import *
+
+import os
+import pytest
+
+parser = pusta.Pusta()
+
+test_path = os.path.dirname(__file__)
+diagram_path = os.path.join(test_path, "diagrams")
+
+
+def machine(name, **kwargs):
+    statechart = parser.parse_file(os.path.join(diagram_path, f"{name}.pu")).transform()
+    return Machine(compile_statechart(statechart), **kwargs).start()
+
+
+def test_parse_label():
+    b = parse_label("EvConfig [ready] / save()")
+    assert (b.event, b.guard, b.action) == ("EvConfig", "ready", "save()")
+    b = parse_label("[Id <= 10]")
+    assert (b.event, b.guard, b.action) == (None, "Id <= 10", None)
+    b = parse_label("Succeeded / Save Result")
+    assert (b.event, b.guard, b.action) == ("Succeeded", None, "Save Result")
+    assert parse_label(None).event is None
+
+
+def test_simple_state():
+    m = machine("simple_state")
+    assert m.configuration == {"FinalState"}
+    assert m.finished
+
+
+def test_concurrent_states():
+    m = machine("concurrent_state_horizontal")
+    assert m.configuration == {"Active", "NumLockOff", "CapsLockOff", "ScrollLockOff"}
+    for _ in range(2):
+        assert m.dispatch("EvCapsLockPressed")
+        assert m.configuration == {"Active", "NumLockOff", "CapsLockOn", "ScrollLockOn"}
+        assert m.dispatch("EvNumLockPressed")
+        assert m.configuration == {"Active", "NumLockOn", "CapsLockOn", "ScrollLockOn"}
+        assert m.dispatch("EvCapsLockPressed")
+        assert m.dispatch("EvNumLockPressed")
+        assert m.configuration == {"Active", "NumLockOff", "CapsLockOff", "ScrollLockOff"}
+    assert not m.dispatch("Unknown")
+
+
+def test_history_states():
+    actions = []
+    m = machine("history_states", action=lambda action, event, payload: actions.append(action))
+    assert m.configuration == {"State1"}
+    m.dispatch("Succeeded")
+    m.dispatch("Succeeded")
+    assert m.configuration == {"State3", "long1"}
+    m.dispatch("Enough Data")
+    m.dispatch("Pause")
+    assert m.configuration == {"State2"}
+    m.dispatch("DeepResume")
+    assert m.configuration == {"State3", "ProcessData"}
+    m.dispatch("Pause")
+    m.dispatch("Resume")
+    assert m.configuration == {"State3", "ProcessData"}
+    m.dispatch("Succeeded")
+    assert actions == ["Save Result"]
+    assert m.finished
+
+
+def test_fork_join():
+    assert machine("fork_join").configuration == {"FinalState"}
+
+
+def test_entry_exit_points():
+    assert machine("entry_exit_point").configuration == {"Foo"}
+
+
+def test_choice():
+    statechart = parser.parse(
+        "@startuml\nstate c <<choice>>\n[*] --> Idle\nIdle --> c : Go\n"
+        "c --> Minor : [Id <= 10]\nc --> Major : [else]\n@enduml\n").transform()
+    compiled = compile_statechart(statechart)
+    for value, expected in [(5, "Minor"), (20, "Major")]:
+        m = Machine(compiled, guard=lambda guard, event, payload: eval(guard, {"Id": payload})).start()
+        m.dispatch("Go", value)
+        assert m.configuration == {expected}
+
+
+def test_else_on_state():
+    statechart = parser.parse(
+        "@startuml\n[*] --> Idle\nIdle --> Low : Go [else]\nIdle --> High : Go [Id > 10]\n@enduml\n").transform()
+    compiled = compile_statechart(statechart)
+    for value, expected in [(5, "Low"), (20, "High")]:
+        m = Machine(compiled, guard=lambda guard, event, payload: eval(guard, {"Id": payload})).start()
+        m.dispatch("Go", value)
+        assert m.configuration == {expected}
+
+
+def test_same_depth_in_tree_order():
+    regions = "\n--\n".join(f"[*] --> A{i}\nA{i} --> B{i} : go / a{i}" for i in range(12))
+    statechart = parser.parse(f"@startuml\n[*] --> P\nstate P {{\n{regions}\n}}\n@enduml\n").transform()
+    actions = []
+    m = Machine(compile_statechart(statechart), action=lambda action, event, payload: actions.append(action)).start()
+    m.dispatch("go")
+    assert actions == [f"a{i}" for i in range(12)]
+
+
+def test_completion_livelock():
+    statechart = parser.parse("@startuml\n[*] --> A\nA --> B\nB --> A\n@enduml\n").transform()
+    with pytest.raises(RuntimeError):
+        Machine(compile_statechart(statechart)).start()
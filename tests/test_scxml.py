@@ -0,0 +1,101 @@
+import pusta
+from pusta.scxml import SCXML_NAMESPACE
+
+import io
+import os
+import pytest
+import xml.etree.ElementTree as ET
+
+parser = pusta.Pusta()
+
+test_path = os.path.dirname(__file__)
+diagram_path = os.path.join(test_path, "diagrams")
+diagrams = sorted(f[:-3] for f in os.listdir(diagram_path) if f.endswith(".pu"))
+
+ns = {"s": SCXML_NAMESPACE}
+
+
+def scxml(name):
+    statechart = parser.parse_file(os.path.join(diagram_path, f"{name}.pu")).transform()
+    stream = io.StringIO()
+    statechart.to_scxml(stream)
+    return ET.fromstring(stream.getvalue())
+
+
+def by_id(root, id):
+    return root.find(f".//*[@id='{id}']")
+
+
+@pytest.mark.parametrize("name", diagrams)
+def test_well_formed(name):
+    root = scxml(name)
+    assert root.tag == f"{{{SCXML_NAMESPACE}}}scxml"
+    ids = [e.get("id") for e in root.iter() if e.get("id")]
+    assert len(ids) == len(set(ids))
+    for t in root.iter(f"{{{SCXML_NAMESPACE}}}transition"):
+        for target in t.get("target").split():
+            assert target in ids
+
+
+def test_binary_stream():
+    statechart = parser.parse_file(os.path.join(diagram_path, "simple_state.pu")).transform()
+    stream = io.BytesIO()
+    statechart.to_scxml(stream, name="simple")
+    root = ET.fromstring(stream.getvalue())
+    assert root.get("name") == "simple"
+    assert root.get("initial") == "State1"
+
+
+def test_transitions():
+    root = scxml("transition_description")
+    preview = by_id(root, "NewValuePreview")
+    events = [t.get("event") for t in preview.findall("s:transition", ns)]
+    assert events == ["EvNewValueRejected", "EvNewValueSaved"]
+    assert by_id(root, "State1").find("s:transition", ns).get("event") is None
+
+
+def test_parallel_regions():
+    root = scxml("concurrent_state_horizontal")
+    active = by_id(root, "Active")
+    assert active.tag == f"{{{SCXML_NAMESPACE}}}parallel"
+    regions = active.findall("s:state", ns)
+    assert [r.get("id") for r in regions] == ["Active.0", "Active.1", "Active.2"]
+    initial = regions[0].find("s:initial/s:transition", ns)
+    assert initial.get("target") == "NumLockOff"
+
+
+def test_history():
+    root = scxml("history_states")
+    history = root.findall(".//s:history", ns)
+    assert {h.get("type") for h in history} == {"shallow", "deep"}
+
+
+def test_choice():
+    root = scxml("choice")
+    choice = by_id(root, "c")
+    transitions = choice.findall("s:transition", ns)
+    assert all(t.get("event") is None for t in transitions)
+    assert [t.get("cond") for t in transitions] == ["Id <= 10", "Id > 10"]
+
+
+def test_choice_else_last():
+    statechart = parser.parse("""@startuml
+state c <<choice>>
+[*] --> c
+c --> A : [else]
+c --> B : [x > 0] / count()
+@enduml""").transform()
+    stream = io.StringIO()
+    statechart.to_scxml(stream)
+    transitions = by_id(ET.fromstring(stream.getvalue()), "c").findall("s:transition", ns)
+    assert [t.get("target") for t in transitions] == ["B", "A"]
+    assert transitions[0].get("cond") == "x > 0"
+    assert transitions[0].find("s:script", ns).text == "count()"
+    assert transitions[1].get("cond") is None
+
+
+def test_fork():
+    root = scxml("fork_join")
+    fork = by_id(root, "fork_state")
+    transition = fork.find("s:transition", ns)
+    assert len(transition.get("target").split()) == 2
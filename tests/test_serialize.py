@@ -0,0 +1,106 @@
+import pusta
+from pusta import serialize
+from pusta.statechart import *
+
+import os
+import pickle
+import pytest
+
+test_path = os.path.dirname(__file__)
+diagram_path = os.path.join(test_path, "diagrams")
+diagrams = sorted(f[:-3] for f in os.listdir(diagram_path) if f.endswith(".pu"))
+
+
+def transform(name):
+    return pusta.Pusta(engine="fast").parse_file(os.path.join(diagram_path, f"{name}.pu")).transform()
+
+
+def shape(statechart):
+    nodes = [statechart] + statechart.get_contents()
+    return [(n.__class__, getattr(n, "name", None), nodes.index(n.parent) if n.parent else None,
+             getattr(n, "label", None), n.destination.fqn() if isinstance(n, Transition) else None)
+            for n in nodes]
+
+
+@pytest.mark.parametrize("name", diagrams)
+def test_roundtrip(name):
+    statechart = transform(name)
+    loaded = serialize.loads(serialize.dumps(statechart))
+    assert str(loaded) == str(statechart)
+    assert shape(loaded) == shape(statechart)
+    assert len(loaded.tree_index()) == len(statechart.get_contents()) + 1
+
+    for node in [loaded] + loaded.get_contents():
+        assert all(child.parent is node for child in node.children)
+        if isinstance(node, Transition):
+            assert node.source is node.parent
+            assert node.destination.root is loaded
+        if isinstance(node, (AbstractState, Transition)) and node.label:
+            assert node.label in node.children
+        if isinstance(node, StateContainer):
+            for attr in ("initial_state", "final_state", "history_state", "deep_history_state"):
+                assert getattr(node, attr) is None or getattr(node, attr).parent is node
+    for cls in (State, Transition, Region, Label, InitialState):
+        assert len(loaded.get_contents_of_type(cls)) == len(statechart.get_contents_of_type(cls))
+    for state in statechart.get_contents_of_type(NamedNode):
+        assert len(loaded.get_contents_by_name(state.name)) == len(statechart.get_contents_by_name(state.name))
+
+    transition = Transition("go")
+    transition.destination = loaded.create_final_state()
+    transition.attach(loaded.create_initial_state())
+    assert str(loaded) != str(statechart)
+
+
+def test_table():
+    statechart = transform("composite_states_1")
+    table = serialize.StatechartTable(serialize.dumps(statechart))
+    assert len(table) == len(statechart.get_contents()) + 1
+    assert table.kind(0) is Statechart and table.parent(0) is None
+
+    [index] = table.find("X")
+    assert table.kind(index) is State and table.name(index) == "X"
+    assert [table.kind(i) for i in table.children(index)] == [Transition]
+    transition = table.children(index)[0]
+    assert table.source(transition) == index
+    assert table.name(table.destination(transition)) == "Z"
+    assert table._nodes is None
+
+    node = table.materialize_node(index)
+    assert node.name == "X" and node.root is table.materialize()
+    assert str(table.materialize()) == str(statechart)
+
+
+def test_errors():
+    data = serialize.dumps(transform("simple_state"))
+    with pytest.raises(ValueError):
+        serialize.loads(b"not a statechart")
+    with pytest.raises(ValueError):
+        serialize.loads(data[:len(data) // 2])
+
+    # Out of range string index of the first state, then kind of the first state
+    _, _, strings, count = serialize._header.unpack_from(data)
+    offset = serialize._header.size + 4 * (strings + 1) + 4 * count + 4
+    corrupt = data[:offset] + (1000).to_bytes(4, "little") + data[offset + 4:]
+    table = serialize.StatechartTable(corrupt)
+    with pytest.raises(ValueError):
+        table.name(1)
+    with pytest.raises(ValueError):
+        serialize.loads(corrupt)
+    offset = serialize._header.size + 4 * (strings + 1) + 16 * count + 1
+    with pytest.raises(ValueError):
+        serialize.loads(data[:offset] + b"\xff" + data[offset + 1:])
+
+    class Custom(State):
+        __slots__ = ()
+
+    statechart = Statechart()
+    statechart.add_child(Custom("A"))
+    with pytest.raises(TypeError):
+        serialize.dumps(statechart)
+
+
+def test_parse_result_pickle():
+    result = pusta.ParseResult("simple_state.pu", transform("simple_state"))
+    loaded = pickle.loads(pickle.dumps(result))
+    assert loaded.path == result.path and loaded.ok
+    assert str(loaded.statechart) == str(result.statechart)
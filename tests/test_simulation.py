@@ -0,0 +1,42 @@
+import pusta
+from pusta.runtime import Machine, compile_statechart
+
+import os
+import random
+import pytest
+
+np = pytest.importorskip("numpy")
+from pusta.simulation import Simulation, NO_EVENT  # noqa: E402
+
+parser = pusta.Pusta()
+
+test_path = os.path.dirname(__file__)
+diagram_path = os.path.join(test_path, "diagrams")
+
+
+@pytest.mark.parametrize("name", ["concurrent_state_horizontal", "history_states", "transition_description"])
+def test_simulation_matches_machine(name):
+    statechart = parser.parse_file(os.path.join(diagram_path, f"{name}.pu")).transform()
+    compiled = compile_statechart(statechart)
+    instances = 20
+    simulation = Simulation(compiled, instances)
+    machines = [Machine(compiled).start() for _ in range(instances)]
+
+    rnd = random.Random(0)
+    events = simulation.flat.event_names
+    for _ in range(50):
+        batch = np.array([rnd.randrange(-1, len(events)) for _ in range(instances)])
+        simulation.step(batch)
+        for m, e in zip(machines, batch):
+            if e != NO_EVENT:
+                m.dispatch(events[e])
+    for i, m in enumerate(machines):
+        assert simulation.configuration(i) == sorted(m.configuration)
+
+
+def test_simulation_event_name():
+    statechart = parser.parse_file(os.path.join(diagram_path, "concurrent_state_horizontal.pu")).transform()
+    simulation = Simulation(statechart, 3)
+    simulation.step("EvNumLockPressed")
+    assert simulation.configuration(2) == ["Active", "CapsLockOff", "NumLockOn", "ScrollLockOff"]
+    assert simulation.counts().sum() == 3
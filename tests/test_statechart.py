@@ -0,0 +1,181 @@
+import pusta
+from pusta.statechart import *
+
+import pytest
+
+parser = pusta.Pusta()
+
+
+def contents_of_type(node, cls):
+    return [c for c in node.iter_contents() if isinstance(c, cls)]
+
+
+def test_index(file):
+    statechart = parser.parse_file(file).transform()
+    assert statechart.get_contents() == list(statechart.iter_contents())
+    for cls in [BaseNode, NamedNode, State, Transition, Region, Label, PseudoState, Fork]:
+        expected = [id(c) for c in contents_of_type(statechart, cls)]
+        assert [id(c) for c in statechart.get_contents_of_type(cls)] == expected
+        assert sorted(id(c) for c in statechart.get_contents_of_type(cls, ordered=False)) == sorted(expected)
+    for state in contents_of_type(statechart, NamedNode):
+        assert any(s is state for s in statechart.get_contents_by_name(state.name))
+
+
+def test_index_update():
+    statechart = Statechart()
+    a = State("A")
+    b = State("B")
+    t = Transition("go")
+    t.source = a
+    t.destination = b
+    statechart.add_child(a)
+    statechart.add_child(b)
+    assert len(statechart.get_contents_of_type(Transition)) == 1
+    assert len(statechart.get_contents_of_type(Label)) == 1
+    assert statechart.get_contents_by_name("A") == [a]
+
+    t.label = "stop"
+    assert statechart.get_contents_of_type(Label) == ["stop"]
+
+    statechart.remove_child(a)
+    assert statechart.get_contents_of_type(Transition) == []
+    assert statechart.get_contents_of_type(State) == [b]
+    assert statechart.get_contents_by_name("A") == []
+
+
+def legacy_str(node):
+    s = node._str_header()
+    children = node._str_children()
+    if children:
+        s += ":\n"
+        for child in children:
+            child_str = child if isinstance(child, str) else legacy_str(child)
+            for line in child_str.splitlines():
+                s += f"    {line}\n"
+    return s.strip()
+
+
+def test_render(file):
+    statechart = parser.parse_file(file).transform()
+    assert str(statechart) == legacy_str(statechart)
+    for node in statechart.iter_contents():
+        assert str(node) == legacy_str(node)
+
+
+def test_render_labels():
+    statechart = Statechart()
+    for i, label in enumerate(["a\n\nb", "  \nx  \n  ", "\n", "   ", "tab\tend\t", "x\r\ny z", ""]):
+        state = State(f"S{i}")
+        statechart.add_child(state)
+        t = Transition(label)
+        t.source = state
+        t.destination = state
+        state.label = label or None
+    assert str(statechart) == legacy_str(statechart)
+
+
+def test_fqn_invalidation():
+    statechart = Statechart()
+    a = State("A")
+    region = Region("0")
+    a.add_child(region)
+    history = region.create_history_state()
+    assert history.fqn() == "A.0.HistoryState"
+    statechart.add_child(a)
+    a.remove_child(region)
+    assert history.fqn() == "0.HistoryState"
+    b = State("B")
+    b.add_child(region)
+    assert history.fqn() == "B.0.HistoryState"
+
+
+def test_deep_fqn():
+    depth = 3000
+    top = node = Region("R0")
+    for i in range(1, depth):
+        child = Region(f"R{i}") if i % 2 == 0 else PseudoState()
+        node.add_child(child)
+        node = child
+    assert node.fqn().count(".") == depth - 1
+    assert node.get_parent_of_type(Statechart) is None
+    assert node.get_parent_of_type(Region).name == f"R{depth - 2}"
+    assert top.is_ancestor_of(node) and not node.is_ancestor_of(top)
+    assert node.common_ancestor(top) is top
+    statechart = Statechart()
+    statechart.add_child(top)
+    assert statechart.tree_index().depth(node) == depth
+
+
+def test_tree_index(file):
+    statechart = parser.parse_file(file).transform()
+    index = statechart.tree_index()
+    nodes = [statechart] + statechart.get_contents()
+    assert len(index) == len(nodes) and all(n in index for n in nodes)
+    for a in nodes[::3]:
+        for b in nodes[::5]:
+            assert index.is_ancestor(a, b) == a.is_ancestor_of(b)
+            assert index.lca(a, b) is a.common_ancestor(b)
+    for t in statechart.get_contents_of_type(Transition):
+        domain = index.domain(t)
+        assert isinstance(domain, (Region, Statechart))
+        assert domain.is_ancestor_of(t.source) and domain.is_ancestor_of(t.destination)
+        assert not any(isinstance(r, Region) and r.is_ancestor_of(t.source) and r.is_ancestor_of(t.destination)
+                       for r in domain.iter_contents())
+
+
+def test_tree_index_invalidation():
+    statechart = Statechart()
+    a = State("A")
+    b = State("B")
+    statechart.add_child(a)
+    index = statechart.tree_index()
+    assert statechart.tree_index() is index and b not in index
+    region = Region("0")
+    a.add_child(region)
+    region.add_child(b)
+    index = statechart.tree_index()
+    assert index.lca(b, a) is a and index.depth(b) == 3
+    t = Transition()
+    t.source = b
+    t.destination = b
+    assert statechart.tree_index().domain(t) is region
+    t.destination = a
+    assert statechart.tree_index().domain(t) is statechart
+
+
+def test_children_views():
+    region = Region("0")
+    states = [State(f"S{i}") for i in range(5)]
+    for state in states:
+        region.add_child(state)
+    children = region.children
+    siblings = states[2].siblings
+    assert children == states and list(reversed(children)) == states[::-1]
+    assert siblings == states[:2] + states[3:] and len(siblings) == 4
+    assert states[2] not in siblings and states[3] in siblings
+    assert children[-1] is states[4] and children[1:3] == states[1:3]
+
+    region.remove_child(states[0])
+    region.add_child(states[0], 1)
+    assert children == [states[1], states[0], states[2], states[3], states[4]]
+    assert len(siblings) == 4 and states[0].siblings[0] is states[1]
+    with pytest.raises(ValueError):
+        region.add_child(states[0])
+    with pytest.raises(ValueError):
+        states[0].remove_child(states[1])
+    with pytest.raises(RuntimeError):
+        for child in children:
+            region.remove_child(child)
+    assert not hasattr(children, "append") and State("X").siblings == []
+
+
+def test_children_identity():
+    # Labels compare equal by text, children are distinct nodes
+    state = State("A")
+    first = Label("x")
+    second = Label("x")
+    state.add_child(first)
+    state.add_child(second)
+    state.remove_child(second)
+    assert len(state.children) == 1 and state.children[0] is first
+    assert second not in state.children and first in state.children
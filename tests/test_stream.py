@@ -0,0 +1,91 @@
+import pusta
+from pusta.stream import iter_blocks, iter_buffer, iter_file, transform_stream
+
+import io
+import os
+import pytest
+import textx.exceptions
+
+test_path = os.path.dirname(__file__)
+diagram_path = os.path.join(test_path, "diagrams")
+diagrams = sorted(f[:-3] for f in os.listdir(diagram_path) if f.endswith(".pu"))
+
+
+def transitions(statechart):
+    return {s.fqn(): [(t.destination.fqn(), t.label) for t in s.get_transitions()]
+            for s in statechart.get_contents_of_type(pusta.statechart.AbstractState)}
+
+
+def assert_same(statechart, text):
+    expected = pusta.Pusta(engine="fast").parse(text).transform()
+    assert str(statechart) == str(expected)
+    assert transitions(statechart) == transitions(expected)
+
+
+@pytest.mark.parametrize("name", diagrams)
+@pytest.mark.parametrize("engine", pusta.Pusta._engines)
+def test_diagrams(name, engine):
+    path = os.path.join(diagram_path, f"{name}.pu")
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    parser = pusta.Pusta(engine=engine)
+    with open(path, encoding="utf-8") as f:
+        assert_same(parser.transform_stream(f), text)
+    with open(path, "rb") as f:
+        assert_same(transform_stream(f, parser), text)
+
+
+def test_chunks_and_continuations():
+    text = "@startuml\n[*] --> A\nA --> B\n: go\nstate C\n{\nstate D\n}\nnote left of A\nx { y\nend note\n@enduml\n"
+    blocks = list(iter_blocks(io.StringIO(text)))
+    assert blocks == ["[*] --> A\n", "A --> B\n", ": go\n", "state C\n", "{\nstate D\n}\n",
+                      "note left of A\nx { y\nend note\n"]
+    chunks = [text[i:i + 7] for i in range(0, len(text), 7)]
+    assert_same(transform_stream(chunks), text)
+    assert_same(transform_stream(c.encode() for c in chunks), text)
+    text = "@startuml\nS0 --> S1\n\n: go\nS1 --> S2\n@enduml\n"
+    assert_same(transform_stream(io.StringIO(text)), text)
+
+
+def test_split_characters():
+    text = "@startuml\n[*] --> Zustand\u00c4\nZustand\u00c4 --> \u00c4ndern : \u00fcber \u20ac\n@enduml\n"
+    data = text.encode("utf-8")
+    # \u00c4 and \u20ac are split between chunks
+    chunks = [data[i:i + 6] for i in range(0, len(data), 6)]
+    assert_same(transform_stream(chunks), text)
+
+
+def test_errors():
+    with pytest.raises(ValueError):
+        transform_stream(io.StringIO("[*] --> A\n@enduml\n"))
+    with pytest.raises(ValueError):
+        transform_stream(io.StringIO("@startuml\n[*] --> A\n"))
+    with pytest.raises(ValueError):
+        transform_stream(io.StringIO("@startuml\n[*] --> A\n@enduml\nA --> B\n"))
+    with pytest.raises(Exception):
+        transform_stream(io.StringIO("@startuml\n[*] --> A\nA -> -> B\nB --> C\n@enduml\n"))
+
+
+def test_file_input(tmp_path):
+    text = "@startuml\n[*] --> Zustand\nZustand --> Ändern : \u00fcber \u20ac\n@enduml\n"
+    path = tmp_path / "diagram.pu"
+    path.write_bytes(text.encode("utf-8"))
+    assert "".join(iter_file(str(path), chunk_size=3)) == text
+    assert "".join(iter_buffer(text.encode("utf-8"), chunk_size=1)) == text
+    empty = tmp_path / "empty.pu"
+    empty.write_bytes(b"")
+    assert "".join(iter_file(str(empty))) == ""
+
+    parser = pusta.Pusta(engine="fast", cache_dir=str(tmp_path / "cache"))
+    assert_same(parser.transform_file(str(path)), text)
+    assert parser.cache.misses == 1
+    assert_same(parser.transform_file(str(path)), text)
+    assert parser.cache.hits == 1
+
+
+def test_error_location(tmp_path):
+    path = tmp_path / "bad.pu"
+    path.write_text("\n@startuml\n[*] --> A\nA --> B\nA -> -> B\nB --> C\n@enduml\n")
+    with pytest.raises(textx.exceptions.TextXSyntaxError) as error:
+        pusta.Pusta(engine="fast").transform_file(str(path))
+    assert (error.value.line, error.value.filename) == (5, str(path))